@@ -0,0 +1,97 @@
+import argparse
+import contextlib
+import copy
+import io
+import json
+import os
+import sys
+import time
+
+# Add the project root to sys.path
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.append(PROJECT_ROOT)
+
+from benchmarks.synthetic_taxonomy import count_nodes, generate_taxonomy
+from init_taxonomy.set_threshold import update_threshold
+from init_taxonomy.add_parent import add_pointers_to_parents
+from init_taxonomy.closest_sibling.merge_small_leave_nodes import gen_abstract as gen_abstract_cpc_lvl
+from taxonomy import merged_codes
+
+
+def merge_single_child_nodes_per_link(data, parent_node=None, is_top_level=False):
+    """
+    The previous merge_single_child_nodes, which merges every single child with merge_with_parent and
+    its full-tree lookups. Kept as the reference the single-traversal version is checked against.
+    """
+    nodes = parent_node["children"] if parent_node else data
+    for code in list(nodes.keys()):
+        node = nodes[code]
+        children = node.get("children", {})
+        if is_top_level:
+            if children:
+                merge_single_child_nodes_per_link(data, parent_node=node, is_top_level=False)
+            continue
+        if len(children) == 1:
+            child_code, child_node = list(children.items())[0]
+            candidate = {
+                "code": child_code,
+                "label": child_node.get("label"),
+                "count": child_node.get("count", 0),
+                "parent_code": code,
+                "threshold": child_node.get("threshold"),
+                "children": child_node.get("children", {}),
+            }
+            gen_abstract_cpc_lvl.merge_with_parent(candidate, [], data)
+        elif children:
+            merge_single_child_nodes_per_link(data, parent_node=node, is_top_level=False)
+
+
+def chain_heavy_tree(num_nodes, depth, single_child_rate, seed):
+    """Returns a deep synthetic taxonomy with many single-child nodes, with thresholds and parent codes."""
+    data = generate_taxonomy(num_nodes=num_nodes, depth=depth, single_child_rate=single_child_rate, seed=seed)
+    data = update_threshold.update_thresholds(data, z_threshold=-1)
+    return add_pointers_to_parents.assign_parent_codes(data)
+
+
+def run(merge, data):
+    """Runs a merge_single_child_nodes implementation quietly and returns the rendered result and its time."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        merge(data, is_top_level=True)
+        seconds = time.perf_counter() - start
+    return merged_codes.export_tree(data), seconds
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Time merge_single_child_nodes on deep, chain-heavy synthetic trees.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--depth", type=int, default=6, help="Number of levels below the sections.")
+    parser.add_argument("--single-child-rate", type=float, default=0.4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-per-link-nodes", type=int, default=20000,
+                        help="Largest tree the per-link reference is timed on.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    print(f"{'nodes':>9} {'per link':>10} {'one pass':>10} {'speedup':>8}  identical")
+    mismatches = 0
+    for size in args.sizes:
+        data = chain_heavy_tree(size, args.depth, args.single_child_rate, args.seed)
+        nodes = count_nodes(data)
+        result, seconds = run(gen_abstract_cpc_lvl.merge_single_child_nodes, copy.deepcopy(data))
+        if nodes > args.max_per_link_nodes:
+            print(f"{nodes:>9} {'-':>10} {seconds:>9.4f}s {'-':>8}  -")
+            continue
+        reference, reference_seconds = run(merge_single_child_nodes_per_link, data)
+        identical = json.dumps(result) == json.dumps(reference)
+        mismatches += not identical
+        print(f"{nodes:>9} {reference_seconds:>9.4f}s {seconds:>9.4f}s {reference_seconds / max(seconds, 1e-9):>7.1f}x  "
+              f"{identical}")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,211 @@
+import argparse
+import copy
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+# Add the project root to sys.path
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.append(PROJECT_ROOT)
+
+from benchmarks import simulated_llm
+from benchmarks.synthetic_taxonomy import count_nodes, generate_taxonomy
+from init_taxonomy.set_threshold import update_threshold
+from init_taxonomy.set_threshold import add_thresholds_level_sibling_based
+from init_taxonomy.add_parent import add_pointers_to_parents
+from init_taxonomy.refine_with_meta import refine_taxonomy_perspective
+from init_taxonomy.refine_with_meta.prompts import PROMPT_TEMPLATES as prompts_meta
+from init_taxonomy.closest_sibling.merge_based_on_common_knowledge_and_size import gen_abstract as gen_abstract_cpc_cnt
+from llm import prompt_cache as cache_store
+from llm import streaming
+from pipeline import runner
+from visualization import plot_abstract
+
+# Directory the benchmark results are written to by default, ignored by git
+RESULTS_DIR = os.path.join(PROJECT_ROOT, "benchmarks", "results")
+
+# Stages that call the (simulated) LLM
+LLM_STAGES = ["meta_refinement", "count_merge", "level_merge"]
+STAGES = ["update_thresholds", "parent_pointers", "final_thresholds", "find_node_by_key", "process_hierarchy"] + LLM_STAGES
+
+
+def prepare_tree(data):
+    """Applies the initial thresholds and parent pointers, as the pipeline does before the meta refinement."""
+    data = update_threshold.update_thresholds(data, z_threshold=-1)
+    return add_pointers_to_parents.assign_parent_codes(data)
+
+
+def all_codes(data, codes=None):
+    """Returns the codes of all nodes, in depth-first order."""
+    if codes is None:
+        codes = []
+    for code, node in data.items():
+        codes.append(code)
+        all_codes(node.get("children", {}), codes)
+    return codes
+
+
+def find_nodes(data, codes):
+    """Looks up each code with find_node_by_key."""
+    for code in codes:
+        gen_abstract_cpc_cnt.find_node_by_key(data, code)
+
+
+def stage_runners(lookups, seed):
+    """
+    Returns the function measured for each stage. Each one receives a fresh copy of the prepared tree.
+    """
+    meta_prompt = prompts_meta["decision_on_meta_characteristics"]
+
+    def lookup_stage(data):
+        codes = all_codes(data)
+        find_nodes(data, random.Random(seed).sample(codes, min(lookups, len(codes))))
+
+    return {
+        "update_thresholds": lambda data: update_threshold.update_thresholds(data, z_threshold=-1),
+        "parent_pointers": add_pointers_to_parents.assign_parent_codes,
+        "final_thresholds": lambda data: add_thresholds_level_sibling_based.add_final_thresholds(data, z_threshold=-2),
+        "find_node_by_key": lookup_stage,
+        "process_hierarchy": plot_abstract.process_hierarchy,
+        "meta_refinement": lambda data: runner.meta_refinement_stage(data, meta_prompt),
+        "count_merge": runner.count_merge_stage,
+        "level_merge": runner.level_merge_stage,
+    }
+
+
+def use_prompt_caches(cache_root):
+    """Points the prompt caches to an empty directory, so every LLM stage starts from a cold cache."""
+    for module, name in [(refine_taxonomy_perspective, "prompt_cache_meta"),
+                         (gen_abstract_cpc_cnt, "prompt_cache_cnt_based")]:
+        module.CACHE_DIR = os.path.join(cache_root, name)
+        os.makedirs(module.CACHE_DIR, exist_ok=True)
+
+
+def bench_size(num_nodes, stages, args):
+    """
+    Times the selected stages on a synthetic tree of the given size.
+
+    Returns:
+        list: One {"stage", "nodes", "seconds", "llm_calls"} entry per stage.
+    """
+    data = prepare_tree(generate_taxonomy(num_nodes=num_nodes, depth=args.depth, sections=args.sections,
+                                          single_child_rate=args.single_child_rate, seed=args.seed))
+    nodes = count_nodes(data)
+    runners = stage_runners(args.lookups, args.seed)
+    results = []
+    for stage in stages:
+        if stage in LLM_STAGES and nodes > args.max_llm_nodes:
+            print(f"Skipping {stage} on {nodes} nodes (above --max-llm-nodes).")
+            continue
+        tree = copy.deepcopy(data)
+        with tempfile.TemporaryDirectory() as cache_root:
+            use_prompt_caches(cache_root)
+            cache_store.call_counts.clear()
+            start = time.perf_counter()
+            runners[stage](tree)
+            seconds = time.perf_counter() - start
+        results.append({"stage": stage, "nodes": nodes, "seconds": round(seconds, 6),
+                        "llm_calls": cache_store.total_api_calls()})
+        print(f"{stage:>18} {nodes:>9} nodes {seconds:>10.4f}s {results[-1]['llm_calls']:>7} LLM calls")
+    return results
+
+
+def git_commit():
+    """Returns the current commit hash, or None outside of a git checkout."""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=PROJECT_ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_report(report, path):
+    """Writes a benchmark report as JSON, creating its directory."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w") as file:
+        json.dump(report, file, indent=4)
+    print(f"Benchmark results saved: {path}")
+
+
+def compare_results(results, baseline, tolerance=1.2):
+    """
+    Prints the ratio of each timing to the same stage and size in a baseline file.
+
+    Returns:
+        list: The (stage, nodes) pairs slower than tolerance times the baseline.
+    """
+    baseline_seconds = {(entry["stage"], entry["nodes"]): entry["seconds"] for entry in baseline["results"]}
+    regressions = []
+    print(f"\n{'stage':>18} {'nodes':>9} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for entry in results:
+        before = baseline_seconds.get((entry["stage"], entry["nodes"]))
+        if before is None:
+            continue
+        ratio = entry["seconds"] / max(before, 1e-9)
+        flag = "  REGRESSION" if ratio > tolerance else ""
+        print(f"{entry['stage']:>18} {entry['nodes']:>9} {before:>10.4f} {entry['seconds']:>10.4f} {ratio:>6.2f}x{flag}")
+        if flag:
+            regressions.append((entry["stage"], entry["nodes"]))
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Time each pipeline stage on synthetic taxonomies of growing size.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="Approximate numbers of nodes of the synthetic trees.")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--depth", type=int, default=3, help="Number of levels below the sections.")
+    parser.add_argument("--sections", type=int, default=9)
+    parser.add_argument("--single-child-rate", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--lookups", type=int, default=100, help="Number of find_node_by_key lookups.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated seconds per LLM request.")
+    parser.add_argument("--token-latency", type=float, default=0.0,
+                        help="Simulated seconds per further token of an LLM response.")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream the merge and removal decisions and cancel them once they are known.")
+    parser.add_argument("--max-llm-nodes", type=int, default=5000,
+                        help="Largest tree the LLM stages are run on.")
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, "bench_results.json"),
+                        help="Path the results are written to; benchmarks/results/bench_results.json by default.")
+    parser.add_argument("--compare", default=None, help="Results of an earlier commit to compare with.")
+    parser.add_argument("--tolerance", type=float, default=1.2,
+                        help="Slowdown ratio reported as a regression by --compare.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    simulated_llm.install(simulated_llm.SimulatedClient(latency=args.latency, token_latency=args.token_latency))
+    streaming.settings["enabled"] = args.stream
+
+    results = []
+    for size in args.sizes:
+        results.extend(bench_size(size, args.stages, args))
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": vars(args),
+        "results": results,
+    }
+    save_report(report, args.output)
+
+    if args.compare:
+        with open(args.compare, "r") as file:
+            regressions = compare_results(results, json.load(file), args.tolerance)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+# Add the project root to sys.path
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.append(PROJECT_ROOT)
+
+from benchmarks.bench_stages import RESULTS_DIR, git_commit, save_report
+
+# Commands timed from a fresh interpreter; "interpreter" is the startup of Python itself
+COMMANDS = {
+    "interpreter": ["-c", "pass"],
+    "pipeline_help": ["-m", "pipeline", "--help"],
+    "import_runner": ["-c", "import pipeline.runner"],
+    "import_main_modules": ["-c", "import init_taxonomy.refine_with_meta.refine_taxonomy_perspective, "
+                                  "init_taxonomy.closest_sibling.merge_based_on_common_knowledge_and_size.gen_abstract"],
+}
+
+# Modules that are only needed once their feature is used, and must not be imported at startup
+LAZY_MODULES = ["pandas", "openpyxl", "numpy", "openai", "httpx", "asyncio", "sqlite3", "multiprocessing",
+                "configs.config"]
+
+
+def time_command(args, repeat):
+    """Returns the median wall time of running Python with args in a fresh process."""
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=PROJECT_ROOT, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL, check=True)
+        seconds.append(time.perf_counter() - start)
+    return statistics.median(seconds)
+
+
+def import_times(args):
+    """
+    Runs Python with -X importtime and returns the cumulative import time of each top-level import in
+    microseconds, {module: microseconds}.
+    """
+    completed = subprocess.run([sys.executable, "-X", "importtime"] + args, cwd=PROJECT_ROOT,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    modules = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            modules[name.strip()] = int(cumulative)
+    return modules
+
+
+def eager_imports(modules):
+    """Returns the modules of LAZY_MODULES, or their submodules, that were imported."""
+    return sorted({lazy for lazy in LAZY_MODULES for name in modules if name == lazy or name.startswith(f"{lazy}.")})
+
+
+def compare_results(results, baseline, tolerance=1.2):
+    """
+    Prints the ratio of each startup time to the same command in a baseline file.
+
+    Returns:
+        list: The commands slower than tolerance times the baseline.
+    """
+    baseline_seconds = {entry["command"]: entry["seconds"] for entry in baseline["results"]}
+    regressions = []
+    print(f"\n{'command':>20} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for entry in results:
+        before = baseline_seconds.get(entry["command"])
+        if before is None:
+            continue
+        ratio = entry["seconds"] / max(before, 1e-9)
+        flag = "  REGRESSION" if ratio > tolerance else ""
+        print(f"{entry['command']:>20} {before:>10.4f} {entry['seconds']:>10.4f} {ratio:>6.2f}x{flag}")
+        if flag:
+            regressions.append(entry["command"])
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Time the startup of the pipeline entry points and check that "
+                                                 "heavy dependencies are imported lazily.")
+    parser.add_argument("--repeat", type=int, default=7, help="Runs per command; the median is reported.")
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest imports printed per command.")
+    parser.add_argument("--max-help-ms", type=float, default=200.0,
+                        help="Budget of 'python -m pipeline --help'; exceeding it fails the benchmark.")
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, "bench_startup.json"),
+                        help="Path the results are written to; benchmarks/results/bench_startup.json by default.")
+    parser.add_argument("--compare", default=None, help="Results of an earlier commit to compare with.")
+    parser.add_argument("--tolerance", type=float, default=1.2,
+                        help="Slowdown ratio reported as a regression by --compare.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = []
+    failures = []
+    for command, command_args in COMMANDS.items():
+        seconds = time_command(command_args, args.repeat)
+        modules = import_times(command_args)
+        eager = eager_imports(modules)
+        results.append({"command": command, "seconds": round(seconds, 4), "eager_imports": eager,
+                        "slowest_imports": sorted(modules.items(), key=lambda item: -item[1])[:args.top]})
+        print(f"{command:>20} {seconds * 1000:>8.1f} ms{'  eager: ' + ', '.join(eager) if eager else ''}")
+        for name, microseconds in results[-1]["slowest_imports"]:
+            print(f"{'':>24}{microseconds / 1000:>8.1f} ms  {name}")
+        if eager:
+            failures.append(f"{command} imports {', '.join(eager)} at startup")
+
+    help_ms = next(entry["seconds"] for entry in results if entry["command"] == "pipeline_help") * 1000
+    if help_ms > args.max_help_ms:
+        failures.append(f"pipeline --help took {help_ms:.0f} ms, over the budget of {args.max_help_ms:.0f} ms")
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": vars(args),
+        "results": results,
+    }
+    save_report(report, args.output)
+
+    if args.compare:
+        with open(args.compare, "r") as file:
+            failures.extend(f"{command} regressed" for command in compare_results(results, json.load(file),
+                                                                                   args.tolerance))
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+# Add the project root to sys.path
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.append(PROJECT_ROOT)
+
+from benchmarks.synthetic_taxonomy import generate_taxonomy
+from init_taxonomy.set_threshold import update_threshold
+from init_taxonomy.add_parent import add_pointers_to_parents
+from init_taxonomy.closest_sibling.merge_based_on_common_knowledge_and_size import gen_abstract as gen_abstract_cpc_cnt
+from taxonomy import compact
+from visualization import plot_abstract
+
+
+def taxonomy_json(num_nodes, depth, seed):
+    """Returns a synthetic taxonomy with thresholds and parent codes, serialized as the pipeline writes it."""
+    data = generate_taxonomy(num_nodes=num_nodes, depth=depth, seed=seed)
+    data = update_threshold.update_thresholds(data, z_threshold=-1)
+    return json.dumps(add_pointers_to_parents.assign_parent_codes(data), indent=4)
+
+
+def load_dict_tree(text):
+    return json.loads(text)
+
+
+def load_compact_tree(text):
+    return compact.from_dict(json.loads(text))
+
+
+def measure_memory(load, text):
+    """Returns the tree built by load and the bytes it retains."""
+    gc.collect()
+    tracemalloc.start()
+    tree = load(text)
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return tree, size
+
+
+def sum_counts(tree):
+    """Sums the counts of all nodes through the dict access the pipeline helpers use."""
+    return sum(node.get("count", 0) for _, node in compact.iter_nodes(tree))
+
+
+def sum_counts_native(tree):
+    """Sums the counts of all nodes with the native access of the representation."""
+    total = 0
+    stack = list(tree.values())
+    if stack and isinstance(stack[0], compact.TaxonomyNode):
+        while stack:
+            node = stack.pop()
+            total += node.count
+            stack.extend(node.children.values())
+    else:
+        while stack:
+            node = stack.pop()
+            total += node["count"]
+            stack.extend(node["children"].values())
+    return total
+
+
+def timed(func, repeat):
+    """Returns the best wall time of repeat calls of func."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+def bench_size(num_nodes, args):
+    """
+    Compares the dict tree and the compact tree of a synthetic taxonomy.
+
+    Returns:
+        list: One {"nodes", "representation", "bytes", "bytes_per_node", <traversal>: seconds} entry per tree.
+            sum_counts, process_hierarchy and find_node_by_key read nodes with node.get and node[...], as the
+            pipeline helpers do; sum_counts_native uses attribute access on compact nodes.
+    """
+    text = taxonomy_json(num_nodes, args.depth, args.seed)
+    results = []
+    for representation, load in [("dict", load_dict_tree), ("compact", load_compact_tree)]:
+        tree, size = measure_memory(load, text)
+        codes = [code for code, _ in compact.iter_nodes(tree)]
+        nodes = len(codes)
+        lookups = random.Random(args.seed).sample(codes, min(args.lookups, nodes))
+        result = {
+            "nodes": nodes,
+            "representation": representation,
+            "bytes": size,
+            "bytes_per_node": round(size / nodes, 1),
+            "sum_counts": timed(lambda: sum_counts(tree), args.repeat),
+            "sum_counts_native": timed(lambda: sum_counts_native(tree), args.repeat),
+            "process_hierarchy": timed(lambda: plot_abstract.process_hierarchy(tree), args.repeat),
+            "find_node_by_key": timed(lambda: [gen_abstract_cpc_cnt.find_node_by_key(tree, code) for code in lookups],
+                                      args.repeat),
+        }
+        results.append(result)
+        print(f"{representation:>8} {nodes:>9} nodes {size / 2**20:>9.1f} MiB {result['bytes_per_node']:>8.1f} B/node "
+              f"{result['sum_counts']:>9.4f}s {result['sum_counts_native']:>9.4f}s {result['process_hierarchy']:>9.4f}s {result['find_node_by_key']:>9.4f}s")
+        del tree
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the memory use and traversal speed of the dict and compact trees.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--depth", type=int, default=3, help="Number of levels below the sections.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--lookups", type=int, default=100, help="Number of find_node_by_key lookups.")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetitions per traversal; the best time is kept.")
+    parser.add_argument("--output", default=None, help="Optional path the results are written to.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    print(f"{'tree':>8} {'nodes':>15} {'memory':>13} {'per node':>13} {'sum_counts':>10} {'native':>10} {'hierarchy':>10} {'lookups':>10}")
+    results = []
+    for size in args.sizes:
+        results.extend(bench_size(size, args))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"config": vars(args), "results": results}, file, indent=4)
+        print(f"Benchmark results saved: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
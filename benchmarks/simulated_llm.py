@@ -0,0 +1,164 @@
+import ast
+import hashlib
+import re
+import time
+
+from llm import client as llm_client
+
+# Pieces a response is streamed in: up to four characters with the whitespace before them, about one token
+TOKEN = re.compile(r"\s*\S{1,4}|\s+")
+
+
+def _stable_hash(text):
+    return int(hashlib.md5(text.encode("utf-8")).hexdigest(), 16)
+
+
+def _field(prompt, name):
+    """Returns the value of an 'Input Information' line of a prompt, e.g. 'Sibling codes'."""
+    marker = f"{name}:"
+    if marker not in prompt:
+        return None
+    return prompt.rsplit(marker, 1)[1].split("\n", 1)[0].strip()
+
+
+def simulated_response(prompt, merge_rate=0.6, remove_rate=0.05):
+    """
+    Returns a deterministic, well-formed answer to a pipeline prompt.
+
+    Parameters:
+        prompt (str): A prompt built from one of the PROMPT_TEMPLATES.
+        merge_rate (float): The share of merge decisions answered with a sibling.
+        remove_rate (float): The share of meta decisions answered with 'Remove'.
+
+    Returns:
+        str: The response text, in the format the prompt asks for.
+    """
+    draw = (_stable_hash(prompt) % 10000) / 10000
+
+    # Meta refinement decision
+    if "Retain the category" in prompt:
+        return "Remove" if draw < remove_rate else "None"
+
+    # Merge decision
+    sibling_codes = _field(prompt, "Sibling codes")
+    if sibling_codes is not None:
+        codes = ast.literal_eval(sibling_codes)
+        labels = ast.literal_eval(_field(prompt, "Sibling Labels"))
+        if not codes or draw >= merge_rate:
+            return "None"
+        index = _stable_hash(prompt[::-1]) % len(codes)
+        return repr({"sibling_code": codes[index], "sibling_label": labels[index]})
+
+    # Representative label
+    return f"SIMULATED LABEL {_stable_hash(prompt) % 100000}"
+
+
+class _Message:
+    def __init__(self, content):
+        self.content = content
+
+
+class _Choice:
+    def __init__(self, content):
+        self.message = _Message(content)
+
+
+class _Completion:
+    def __init__(self, content):
+        self.choices = [_Choice(content)]
+
+
+class _Delta:
+    def __init__(self, content):
+        self.content = content
+
+
+class _ChunkChoice:
+    def __init__(self, content):
+        self.delta = _Delta(content)
+
+
+class _Chunk:
+    def __init__(self, content):
+        self.choices = [_ChunkChoice(content)]
+
+
+class _Stream:
+    """
+    A streamed response, like openai.Stream: the first token arrives after the latency of the backend and each
+    further token after its token_latency. close() cancels the tokens not sent yet.
+    """
+
+    def __init__(self, backend, content):
+        self.backend = backend
+        self.tokens = TOKEN.findall(content)
+        self.sent = 0
+        self.closed = False
+
+    def __iter__(self):
+        if self.backend.latency:
+            time.sleep(self.backend.latency)
+        for position, token in enumerate(self.tokens):
+            if self.closed:
+                return
+            if position and self.backend.token_latency:
+                time.sleep(self.backend.token_latency)
+            self.sent += 1
+            self.backend.streamed_tokens += 1
+            yield _Chunk(token)
+
+    def close(self):
+        if not self.closed and self.sent < len(self.tokens):
+            self.backend.cancelled += 1
+        self.closed = True
+
+
+class _Completions:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def create(self, model=None, messages=None, stream=False, **kwargs):
+        self.backend.calls += 1
+        prompt = messages[-1]["content"]
+        content = simulated_response(prompt, self.backend.merge_rate, self.backend.remove_rate)
+        if stream:
+            return _Stream(self.backend, content)
+        latency = self.backend.latency + self.backend.token_latency * max(len(TOKEN.findall(content)) - 1, 0)
+        if latency:
+            time.sleep(latency)
+        return _Completion(content)
+
+
+class _Chat:
+    def __init__(self, backend):
+        self.completions = _Completions(backend)
+
+
+class SimulatedClient:
+    """
+    Stand-in for the OpenAI client that answers chat completions locally.
+
+    Requests with stream=True are answered token by token, and the tokens of a closed stream are not sent.
+
+    Parameters:
+        latency (float): Seconds slept per request until the first token, to model the remote model.
+        merge_rate (float): The share of merge decisions answered with a sibling.
+        remove_rate (float): The share of meta decisions answered with 'Remove'.
+        token_latency (float): Seconds slept per further token of the response.
+    """
+
+    def __init__(self, latency=0.0, merge_rate=0.6, remove_rate=0.05, token_latency=0.0):
+        self.latency = latency
+        self.merge_rate = merge_rate
+        self.remove_rate = remove_rate
+        self.token_latency = token_latency
+        self.calls = 0
+        # Tokens sent by streams, and streams closed before their last token
+        self.streamed_tokens = 0
+        self.cancelled = 0
+        self.chat = _Chat(self)
+
+
+def install(client):
+    """Makes chat_gpt use the given client instead of creating an OpenAI client."""
+    llm_client.set_client(client)
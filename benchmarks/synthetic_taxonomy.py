@@ -0,0 +1,217 @@
+import argparse
+import json
+import math
+import os
+import random
+import string
+
+# Vocabulary the synthetic labels are drawn from
+VOCABULARY = [
+    "AGRICULTURE", "ANALYSIS", "APPARATUS", "BIOCHEMISTRY", "BUILDING", "CERAMICS", "CHEMISTRY", "CIRCUITS",
+    "CLEANING", "COATING", "COMBUSTION", "COMMUNICATION", "COMPOSITIONS", "COMPUTING", "CONTROL", "CONVEYING",
+    "COOLING", "DETAILS", "DEVICES", "DRYING", "ELECTRIC", "ELEMENTS", "ENGINES", "FABRICS", "FERTILISERS",
+    "FIBRES", "FOODSTUFFS", "FURNITURE", "GLASS", "HEATING", "HYDRAULICS", "IMPLEMENTS", "INSTRUMENTS",
+    "LIGHTING", "LUBRICATION", "MACHINES", "MATERIALS", "MEASURING", "MEDICINE", "METALLURGY", "METHODS",
+    "MINING", "OPTICS", "ORGANIC", "PACKAGING", "PAPER", "PHYSICS", "PLANTS", "PLASTICS", "POWER", "PRINTING",
+    "PROCESSES", "PRODUCTION", "PUMPS", "RADIATION", "SEMICONDUCTORS", "SEPARATION", "SHAPING", "SIGNALLING",
+    "STORAGE", "SYSTEMS", "TESTING", "TEXTILES", "TOOLS", "TRANSPORT", "TREATMENT", "VEHICLES", "WATER",
+    "WEAPONS", "WELDING", "WORKING",
+]
+
+
+def section_codes(count):
+    """Return CPC-like section codes: A, B, C, ... followed by AA, AB, ... when more sections are requested."""
+    codes = list(string.ascii_uppercase)
+    length = 2
+    while len(codes) < count:
+        codes.extend("".join(letters) for letters in _product(string.ascii_uppercase, length))
+        length += 1
+    return codes[:count]
+
+
+def _product(alphabet, length):
+    if length == 0:
+        yield ()
+        return
+    for head in alphabet:
+        for tail in _product(alphabet, length - 1):
+            yield (head,) + tail
+
+
+def child_code(parent_code, level, index):
+    """
+    Builds the code of a child in the CPC style: A -> A01 -> A01B -> A01B/1 -> A01B/1/3 -> ...
+
+    The code always extends the parent code, so codes are unique across the whole tree.
+    """
+    if level == 1:
+        return f"{parent_code}{index + 1:02d}"
+    if level == 2:
+        return f"{parent_code}{_letters(index)}"
+    return f"{parent_code}/{index + 1}"
+
+
+def _letters(index):
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = string.ascii_uppercase[remainder] + letters
+    return letters
+
+
+def mean_branching(num_nodes, sections, depth):
+    """
+    Finds the mean number of children per node so that a tree with the given number of sections and
+    levels below them has about num_nodes nodes.
+    """
+    target = max(num_nodes / sections - 1, 1)
+    low, high = 1.0, max(target, 2.0)
+    for _ in range(60):
+        mid = (low + high) / 2
+        size = sum(mid ** level for level in range(1, depth + 1))
+        if size < target:
+            low = mid
+        else:
+            high = mid
+    return (low + high) / 2
+
+
+def draw_count(rng, distribution, scale):
+    """Draws the count of a leaf node."""
+    if distribution == "lognormal":
+        return int(rng.lognormvariate(math.log(scale), 1.5))
+    if distribution == "pareto":
+        return int(scale * (rng.paretovariate(1.2) - 1))
+    if distribution == "uniform":
+        return rng.randint(0, 2 * scale)
+    raise ValueError(f"Unknown count distribution: {distribution}")
+
+
+def draw_label(rng, parent_label=None):
+    """Draws a CPC-like label; about half of the labels reuse a word of the parent label."""
+    words = rng.sample(VOCABULARY, rng.randint(2, 4))
+    if parent_label and rng.random() < 0.5:
+        words[0] = rng.choice(parent_label.replace(";", "").split())
+    return "; ".join(words)
+
+
+def split_children(rng, parents, total, branching_skew, single_child_rate):
+    """
+    Distributes a number of children over the nodes of a level.
+
+    Every parent receives at least one child; a share single_child_rate of the parents receives exactly
+    one, and the rest is distributed in proportion to lognormal weights, so the total is exact.
+
+    Returns:
+        list: The number of children of each parent.
+    """
+    singles = [rng.random() < single_child_rate for _ in parents]
+    sizes = [1] * len(parents)
+    open_parents = [index for index, single in enumerate(singles) if not single]
+    remaining = max(total - len(parents), 0)
+    if not open_parents or not remaining:
+        return sizes
+
+    weights = [rng.lognormvariate(0, branching_skew) if branching_skew > 0 else 1.0 for _ in open_parents]
+    weight_sum = sum(weights)
+    shares = [remaining * weight / weight_sum for weight in weights]
+    for index, share in zip(open_parents, shares):
+        sizes[index] += int(share)
+    # Hand out the rounding remainder to the largest fractional parts
+    leftover = remaining - sum(int(share) for share in shares)
+    by_fraction = sorted(range(len(open_parents)), key=lambda i: shares[i] - int(shares[i]), reverse=True)
+    for i in by_fraction[:leftover]:
+        sizes[open_parents[i]] += 1
+    return sizes
+
+
+def generate_taxonomy(num_nodes=1000, depth=2, sections=9, count_distribution="lognormal", count_scale=2000,
+                      branching_skew=1.0, single_child_rate=0.0, seed=0):
+    """
+    Generates a synthetic taxonomy in the format of data/cpc/label_count.json.
+
+    Parameters:
+        num_nodes (int): The approximate number of nodes.
+        depth (int): The number of levels below the sections.
+        sections (int): The number of top-level sections.
+        count_distribution (str): The distribution of leaf counts: "lognormal", "pareto" or "uniform".
+        count_scale (int): The typical leaf count.
+        branching_skew (float): Spread of the number of children; 0 gives every node about the mean
+            branching, larger values give a few large and many small sibling groups.
+        single_child_rate (float): The probability that an inner node has exactly one child, which
+            produces the single-child chains merged by merge_single_child_nodes.
+        seed (int): The random seed.
+
+    Returns:
+        dict: The hierarchical JSON data. Inner node counts are the sum of their children's counts.
+    """
+    rng = random.Random(seed)
+    branching = mean_branching(num_nodes, sections, depth)
+
+    data = {}
+    level_nodes = []
+    for code in section_codes(sections):
+        data[code] = {"label": draw_label(rng), "children": {}}
+        level_nodes.append((code, data[code]))
+
+    for level in range(1, depth + 1):
+        total = max(round(sections * branching ** level), len(level_nodes))
+        sizes = split_children(rng, level_nodes, total, branching_skew, single_child_rate)
+        next_level = []
+        for (code, node), size in zip(level_nodes, sizes):
+            for index in range(size):
+                code_of_child = child_code(code, level, index)
+                child = {"label": draw_label(rng, node["label"]), "children": {}}
+                node["children"][code_of_child] = child
+                next_level.append((code_of_child, child))
+        level_nodes = next_level
+
+    def add_counts(node):
+        if not node["children"]:
+            node["count"] = draw_count(rng, count_distribution, count_scale)
+        else:
+            node["count"] = sum(add_counts(child) for child in node["children"].values())
+        return node["count"]
+
+    for node in data.values():
+        add_counts(node)
+    return data
+
+
+def count_nodes(data):
+    """Returns the number of nodes of a taxonomy."""
+    return sum(1 + count_nodes(node.get("children", {})) for node in data.values())
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic CPC-shaped taxonomy.")
+    parser.add_argument("--nodes", type=int, default=1000, help="Approximate number of nodes.")
+    parser.add_argument("--depth", type=int, default=2, help="Number of levels below the sections.")
+    parser.add_argument("--sections", type=int, default=9, help="Number of top-level sections.")
+    parser.add_argument("--count-distribution", choices=["lognormal", "pareto", "uniform"], default="lognormal")
+    parser.add_argument("--count-scale", type=int, default=2000, help="Typical leaf count.")
+    parser.add_argument("--branching-skew", type=float, default=1.0, help="Spread of the number of children.")
+    parser.add_argument("--single-child-rate", type=float, default=0.0,
+                        help="Probability that an inner node has a single child.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="data/synthetic/label_count.json")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    data = generate_taxonomy(num_nodes=args.nodes, depth=args.depth, sections=args.sections,
+                             count_distribution=args.count_distribution, count_scale=args.count_scale,
+                             branching_skew=args.branching_skew, single_child_rate=args.single_child_rate,
+                             seed=args.seed)
+    directory = os.path.dirname(args.output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(args.output, "w") as file:
+        json.dump(data, file, indent=4)
+    print(f"Generated {count_nodes(data)} nodes and saved: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
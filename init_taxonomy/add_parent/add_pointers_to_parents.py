@@ -26,6 +26,25 @@ def add_parent_code(data, parent_code=""):
     
     return updated_data
 
+def assign_parent_codes(data, parent_code=""):
+    """
+    Recursively adds a 'parent_code' key to each node in place, without copying the hierarchy.
+
+    Parameters:
+        data (dict): The JSON data to process.
+        parent_code (str): The code of the parent node. This is an empty string for root-level nodes.
+
+    Returns:
+        dict: The same JSON data object with 'parent_code' set on each node.
+    """
+    for code, node in data.items():
+        node["parent_code"] = parent_code
+
+        if "children" in node:
+            assign_parent_codes(node["children"], code)
+
+    return data
+
 # Main code
 if __name__ == "__main__":
     # Read the JSON file
@@ -1,23 +1,16 @@
 import json
-from openai import OpenAI
-import os
 import ast
 
 # from prompts import PROMPT_TEMPLATES
 from prompts2 import PROMPT_TEMPLATES
-from configs.config import api_key
+from llm import client as llm_client
 
-client = OpenAI(
-    # defaults to os.environ.get("OPENAI_API_KEY")
-    api_key= api_key
-)
+# Base cache directory
+CACHE_DIR = "prompt_cache_closest_sibling"
 
-def chat_gpt(prompt):
-    response = client.chat.completions.create(
-        model="gpt-4",
-        messages=[{"role": "user", "content": prompt}]
-    )
-    return response.choices[0].message.content.strip()
+def chat_gpt(prompt, function_name):
+    """Send a prompt to GPT-4 through the shared client and cache the response."""
+    return llm_client.chat_gpt(prompt, function_name, CACHE_DIR)
 
 
 def generate_representative_label(candidate_code, candidate_label, sibling_code, sibling_label, parent_label):
@@ -31,7 +24,7 @@ def generate_representative_label(candidate_code, candidate_label, sibling_code,
         sibling_label = sibling_label,
         parent_label=parent_label
     )
-    return chat_gpt(prompt)
+    return chat_gpt(prompt, "generate_representative_label")
 
 def find_merge_candidates(nodes):
     """
@@ -298,7 +291,7 @@ def decide_to_merge(candidate, data, parent_label=None, is_top_level=False, prom
         sibling_codes=labels_info['sibling_codes']
     )
 
-    response = chat_gpt(prompt)
+    response = chat_gpt(prompt, "decide_to_merge")
     
     if response in ('None', None, "'None'", 'none', '"none"'):
         return None
@@ -1,68 +1,48 @@
 import json
-from openai import OpenAI
-import os
 import ast
-from configs.config import api_key
+import functools
+import heapq
+import itertools
+from instrumentation import events
+from instrumentation import metrics
+from llm import budget
+from llm import client as llm_client
+from llm import prompt_cache as cache_store
+from llm import streaming
+from llm import structured
+from llm import tiering
+from taxonomy import merged_codes
+from taxonomy.index import TaxonomyIndex
+from taxonomy.merge import find_siblings, merge_siblings
+from taxonomy.siblings import SiblingContext
 
 from .prompts import PROMPT_TEMPLATES
 
-client = OpenAI(
-    api_key = api_key
-)
-
 # Base cache directory
 CACHE_DIR = "prompt_cache_cnt_based"
 
-# Ensure the cache directory exists
-os.makedirs(CACHE_DIR, exist_ok=True)
+# Model and prompt template of each cached function, which tag its cache entries
+cache_store.register_function(CACHE_DIR, "decide_to_merge", llm_client.MODEL, "merge_decision",
+                               PROMPT_TEMPLATES["merge_decision"])
+cache_store.register_function(CACHE_DIR, "generate_representative_label", llm_client.MODEL,
+                               "representative_label_for_merge",
+                               PROMPT_TEMPLATES["representative_label_for_merge"])
 
 def get_cache_file(function_name):
     """Generate a cache file path based on the function name."""
-    return os.path.join(CACHE_DIR, f"{function_name}_prompts.json")
+    return cache_store.get_cache_file(CACHE_DIR, function_name)
 
 def load_cache(function_name):
     """Load the cache for a specific function."""
-    cache_file = get_cache_file(function_name)
-    if os.path.exists(cache_file):
-        try:
-            with open(cache_file, "r") as file:
-                return json.load(file)
-        except json.JSONDecodeError:
-            print(f"Cache file {cache_file} is corrupted. Reinitializing.")
-            return {}
-    return {}
-
-def save_cache(function_name, cache):
-    """Save the cache for a specific function."""
-    cache_file = get_cache_file(function_name)
-    try:
-        with open(cache_file, "w") as file:
-            json.dump(cache, file)
-        print(f"Cache saved to {cache_file}.")
-    except Exception as e:
-        print(f"Error saving cache: {e}")
-
-def chat_gpt(prompt, function_name):
-    """Send a prompt to GPT-4 and cache the response."""
-    # Load the cache specific to the calling function
-    prompt_cache = load_cache(function_name)
-
-    # Check if the prompt exists in the cache
-    if prompt in prompt_cache:
-        print(f"Cache hit for prompt in {function_name}.")
-        return prompt_cache[prompt]
-
-    # If not in cache, make the API call
-    response = client.chat.completions.create(
-        model="gpt-4",
-        messages=[{"role": "user", "content": prompt}]
-    )
-    result = response.choices[0].message.content.strip()
+    return cache_store.load_cache(CACHE_DIR, function_name)
 
-    # Cache the response
-    prompt_cache[prompt] = result
-    save_cache(function_name, prompt_cache)
-    return result
+def chat_gpt(prompt, function_name, parse=None, validate=None):
+    """
+    Send a prompt to GPT-4 and cache the response; with parse, the response is streamed until parse decides it,
+    and with validate, an invalid response is repaired once instead of cached.
+    """
+    return llm_client.chat_gpt(prompt, function_name, CACHE_DIR, announce_saves=True, parse=parse,
+                               validate=validate)
 
 def generate_representative_label_manual(candidate_code, candidate_label, sibling_code, sibling_label, parent_label):
     # Ensure labels are stripped of whitespace
@@ -86,14 +66,16 @@ def generate_representative_label(candidate_code, candidate_label, sibling_code,
     """
     Generates a representative label for merged categories.
     """
-    prompt = PROMPT_TEMPLATES["representative_label_for_merge"].format(
+    fields = dict(
         candidate_code= candidate_code,
         candidate_label = candidate_label,
         sibling_code  =sibling_code,
         sibling_label = sibling_label,
         parent_label=parent_label
     )
-    return chat_gpt(prompt, "generate_representative_label")
+    prompt = PROMPT_TEMPLATES["representative_label_for_merge"].format(**fields)
+    # Labels with the same words are kept without asking the model if tiered decisions are enabled
+    return tiering.resolve("generate_representative_label", CACHE_DIR, prompt, fields, chat_gpt)
 
 def find_merge_candidates(nodes):
     """
@@ -139,69 +121,33 @@ def find_parent_node(data, parent_code):
                 return found_parent
     return None
 
-def update_json(data, candidate_code, sibling_code, representative_label):
+def update_json(data, candidate_code, sibling_code, representative_label, index=None):
     """
     Updates the JSON data by merging two classes and saving the result in the parent's children dictionary.
+    The nodes may be at any depth.
     
     Parameters:
         data (dict): The hierarchical JSON data.
         candidate_code (str): Code of the first node to merge.
         sibling_code (str): Code of the second node to merge.
         representative_label (str): New label for the merged node.
+        index (TaxonomyIndex): Optional. The parent index of data, updated by the merge.
     """
     merged_key = f"{candidate_code}_{sibling_code}"
 
-    if len(candidate_code) == 1:
-        #get the union of children
-        children = {**data[candidate_code]['children'] , ** data[sibling_code]['children']}
-        cnt = data[candidate_code]['count'] + data[sibling_code]['count']
-        threshold = data[candidate_code]['threshold'] + data[sibling_code]['threshold']
-        # Remove the original candidate and sibling nodes from the parent node's children
-        del data[candidate_code]
-        del data[sibling_code]
-        # Create the merged node under the parent
-        data[merged_key] = {
-        "label": representative_label,
-        "children": children,
-        "count": cnt,
-        "threshold": threshold
-        }
-
-    if len(candidate_code) == 3:
-        lvl0_parent_code = candidate_code[0]
-        children = {**data[lvl0_parent_code]['children'][candidate_code]['children'] , **data[lvl0_parent_code]['children'][sibling_code]['children']}
-        cnt = data[lvl0_parent_code]['children'][candidate_code]['count'] + data[lvl0_parent_code]['children'][sibling_code]['count']
-        threshold = data[lvl0_parent_code]['children'][candidate_code]['threshold'] + data[lvl0_parent_code]['children'][sibling_code]['threshold']
-        # Remove the original candidate and sibling nodes from the parent node's children
-        del data[lvl0_parent_code]['children'][candidate_code]
-        del data[lvl0_parent_code]['children'][sibling_code]
-        # Create the merged node under the parent
-        data[lvl0_parent_code]['children'][merged_key] = {
-        "label": representative_label,
-        "children": children,
-        "count": cnt,
-        "threshold": threshold
-        }
-    if len(candidate_code) == 4:
-        lvl0_parent_code = candidate_code[0]
-        lvl1_parent_code = candidate_code[0:3]
-        children = {**data[lvl0_parent_code]['children'][lvl1_parent_code]['children'][candidate_code]['children'], **data[lvl0_parent_code]['children'][lvl1_parent_code]['children'][sibling_code]['children']}
-        cnt = data[lvl0_parent_code]['children'][lvl1_parent_code]['children'][candidate_code]['count'] + data[lvl0_parent_code]['children'][lvl1_parent_code]['children'][sibling_code]['count']
-        threshold = data[lvl0_parent_code]['children'][lvl1_parent_code]['children'][candidate_code]['threshold'] + data[lvl0_parent_code]['children'][lvl1_parent_code]['children'][sibling_code]['threshold']
-        # Remove the original candidate and sibling nodes from the parent node's children
-        del data[lvl0_parent_code]['children'][lvl1_parent_code]['children'][candidate_code]
-        del data[lvl0_parent_code]['children'][lvl1_parent_code]['children'][sibling_code]
-            # Create the merged node under the parent
-        data[lvl0_parent_code]['children'][lvl1_parent_code]['children'][merged_key] = {
-        "label": representative_label,
-        "children": children,
-        "count": cnt,
-        "threshold": threshold
-        }
-
+    siblings = find_siblings(data, candidate_code, index)
+    if siblings is not None:
+        # Union of the children, sum of the counts and of the thresholds
+        merge_siblings(siblings, [candidate_code, sibling_code], merged_key, lambda nodes: {
+            "label": representative_label,
+            "children": {**nodes[0]['children'], **nodes[1]['children']},
+            "count": nodes[0]['count'] + nodes[1]['count'],
+            "threshold": nodes[0]['threshold'] + nodes[1]['threshold']
+        }, index=index)
 
-    
-    print(f"Merged {candidate_code} and {sibling_code} with label '{representative_label}'")
+    events.emit("merge", f"Merged {candidate_code} and {sibling_code} with label '{representative_label}'",
+                candidate_code=candidate_code, sibling_code=sibling_code, merged_code=merged_key,
+                label=representative_label)
 
     return data
 
@@ -241,7 +187,8 @@ def find_node_by_key(data, key, parent_code=None):
     return None  # Node not found
 
 
-def merge_entities(data, candidate_code, sibling_code, representative_label, merge_candidates):
+def merge_entities(data, candidate_code, sibling_code, representative_label, merge_candidates, sibling_context=None,
+                   index=None):
     """
     Updates the JSON data by merging two classes and saving the result in the parent's children dictionary.
 
@@ -250,82 +197,55 @@ def merge_entities(data, candidate_code, sibling_code, representative_label, mer
         candidate_code (str): Code of the first node to merge.
         sibling_code (str): Code of the second node to merge.
         representative_label (str): New label for the merged node.
+        sibling_context (SiblingContext): Optional. The prompt context of the siblings, updated if the
+            merge happens in its group.
+        index (TaxonomyIndex): Optional. The parent index of data, which finds the siblings of a candidate
+            outside the group and is updated by the merge.
     """
-    # Check if both nodes are at the top level
-    if candidate_code in data and sibling_code in data:
-        # Top-level merge logic
-        candidate_node = data[candidate_code]
-        sibling_node = data[sibling_code]
-        parent_node = data  # Treat the entire `data` as the parent
-
+    # The siblings of the candidate: its group in process_level, otherwise found through the parent index
+    if sibling_context is not None and candidate_code in sibling_context.nodes:
+        siblings = sibling_context.nodes
     else:
-        # Nested level merge logic
-        candidate_node = find_node_by_key(data, candidate_code)
-        if candidate_node is None:
-            print(f"Error: Node with code {candidate_code} not found.")
-            return merge_candidates
-        sibling_node = find_node_by_key(data, sibling_code, parent_code=candidate_node.get("parent_code") if candidate_node else None)
-        if sibling_node is None:
-            sibling_node = find_node_by_key(data, sibling_code, parent_code=candidate_node.get("parent_code") if candidate_node else None)
-            print(f"Error: Sibling code for node {candidate_code} is missing.")
-            return merge_candidates
-        parent_node = find_node_by_key(data, candidate_node['parent_code'])
-        if parent_node is None:
-            print(f"Error: Parent code for node {candidate_code} is missing.")
-            return merge_candidates
-
-        # Check if both nodes share the same parent
-        if not candidate_node or not sibling_node or parent_node is None:
-            print(f"Could not find nodes {candidate_code} and {sibling_code} with the same parent.")
-            return data
-
-    # Calculate merged properties
-    merged_children = {**candidate_node.get("children", {}), **sibling_node.get("children", {})}
-    merged_count = candidate_node.get("count", 0) + sibling_node.get("count", 0)
-    merged_threshold = candidate_node.get("threshold", 0)  # Using candidate threshold as default
-
-    # Create the merged node
-    merged_key = f"{candidate_code}_{sibling_code}"
-    merged_node = {
-        "label": representative_label,
-        "children": merged_children,
-        "count": merged_count,
-        "threshold": merged_threshold,
-        "parent_code": candidate_node.get("parent_code", "")
-    }
-    # # merged_element is to be used for updating merge_candidates
-    # merge_elemnt = {
-    #     "code": merged_key,        
-    #     "label": representative_label,
-    #     "children": merged_children,
-    #     "count": merged_count,
-    #     "threshold": merged_threshold,
-    #     "parent_code": candidate_node.get("parent_code", "")
-    # }
+        siblings = find_siblings(data, candidate_code, index)
+    if siblings is None:
+        events.emit("merge_failed", f"Error: Node with code {merged_codes.render(candidate_code)} not found.", level=events.ERROR,
+                    candidate_code=merged_codes.render(candidate_code),
+                    sibling_code=merged_codes.render(sibling_code))
+        return merge_candidates
+    if sibling_code not in siblings:
+        events.emit("merge_failed", f"Error: Sibling code for node {merged_codes.render(candidate_code)} is missing.", level=events.ERROR,
+                    candidate_code=merged_codes.render(candidate_code),
+                    sibling_code=merged_codes.render(sibling_code))
+        return merge_candidates
+
+    def combine(nodes):
+        candidate_node, sibling_node = nodes
+        return {
+            "label": representative_label,
+            "children": {**candidate_node.get("children", {}), **sibling_node.get("children", {})},
+            "count": candidate_node.get("count", 0) + sibling_node.get("count", 0),
+            "threshold": candidate_node.get("threshold", 0),  # Using candidate threshold as default
+            "parent_code": candidate_node.get("parent_code", "")
+        }
+
+    # Replace both nodes by the merged node at the end of their parent's children
+    merged_key = merged_codes.merge_code([candidate_code, sibling_code])
+    merged_node = merge_siblings(siblings, [candidate_code, sibling_code], merged_key, combine, index=index)
+    merged_count = merged_node["count"]
 
     # Update `parent_code` for each child in the merged node
     for child_code in merged_node["children"]:
         merged_node["children"][child_code]["parent_code"] = merged_key
 
-    # Update the parent's children dictionary
-    if parent_node == data:
-        # For top-level nodes, modify `data` directly
-        data[merged_key] = merged_node
-        # Remove the original candidate and sibling nodes from `data`
-        if candidate_code in data:
-            del data[candidate_code]
-        if sibling_code in data:
-            del data[sibling_code]
-    else:
-        # For nested nodes, modify `parent_node`'s children
-        parent_node["children"][merged_key] = merged_node
-        # Remove original candidate and sibling nodes from parent's children
-        if candidate_code in parent_node["children"]:
-            del parent_node["children"][candidate_code]
-        if sibling_code in parent_node["children"]:
-            del parent_node["children"][sibling_code]
+    if sibling_context is not None and sibling_context.nodes is siblings:
+        sibling_context.remove(candidate_code)
+        sibling_context.remove(sibling_code)
+        sibling_context.add(merged_key)
 
-    print(f"Merged {candidate_code} and {sibling_code} with label '{representative_label}'")
+    rendered_candidate, rendered_sibling = merged_codes.render(candidate_code), merged_codes.render(sibling_code)
+    events.emit("merge", f"Merged {rendered_candidate} and {rendered_sibling} with label '{representative_label}'",
+                candidate_code=rendered_candidate, sibling_code=rendered_sibling, merged_code=merged_codes.render(merged_key),
+                label=representative_label, count=merged_count)
 
     ## update the merged_keys if these keys are in the candidate for merge 
     merge_candidates = [candidate for candidate in merge_candidates if candidate["code"] != candidate_code]
@@ -337,7 +257,9 @@ def merge_entities(data, candidate_code, sibling_code, representative_label, mer
 
 
 
-def collect_labels(candidate_code, data, parent_label=None, is_top_level=False):
+def collect_labels(candidate_code, data, parent_label=None, is_top_level=False, sibling_context=None):
+    if sibling_context is None:
+        sibling_context = SiblingContext(data, render=merged_codes.render)
     labels_info = {
         "parent_label": parent_label if parent_label else None,
         "candidate_label": None,
@@ -355,17 +277,11 @@ def collect_labels(candidate_code, data, parent_label=None, is_top_level=False):
         child.get("label", "No Label") for child in candidate_node.get("children", {}).values()
     ]
 
-    # Collect sibling codes and labels from other nodes at the same level in `data`
-    labels_info["sibling_codes"] = [
-        sibling_code
-        for sibling_code in data.keys()
-        if sibling_code != candidate_code
-    ]
-    labels_info["sibling_labels"] = [
-        sibling.get("label", "No Label")
-        for sibling_code, sibling in data.items()
-        if sibling_code != candidate_code
-    ]
+    # Sibling codes and labels of the other nodes at the same level in `data`, from the context of the group.
+    # The prompt shows the legacy keys of merged siblings
+    labels_info["sibling_keys"] = sibling_context.excluding("keys", candidate_code)
+    labels_info["sibling_codes"] = sibling_context.excluding("codes", candidate_code)
+    labels_info["sibling_labels"] = sibling_context.excluding("labels", candidate_code)
 
     return labels_info
 
@@ -376,10 +292,11 @@ def collect_labels(candidate_code, data, parent_label=None, is_top_level=False):
 
 import ast
 
-def decide_to_merge(candidate, data, parent_label=None, is_top_level=False, prompt_template=None):
+def decide_to_merge(candidate, data, parent_label=None, is_top_level=False, prompt_template=None, sibling_context=None):
     candidate_code = candidate.get("code")
     candidate_label = candidate.get("label")
-    labels_info = collect_labels(candidate_code, data, parent_label=parent_label, is_top_level=is_top_level)
+    labels_info = collect_labels(candidate_code, data, parent_label=parent_label, is_top_level=is_top_level,
+                                 sibling_context=sibling_context)
     if (len(labels_info['sibling_codes']) == 0):
         return "No Siblings"
 
@@ -391,11 +308,13 @@ def decide_to_merge(candidate, data, parent_label=None, is_top_level=False, prom
         sibling_codes=labels_info['sibling_codes']
     )
 
-    response = chat_gpt(prompt, "decide_to_merge").strip()
+    ask = functools.partial(chat_gpt, parse=streaming.merge_decision(labels_info),
+                            validate=structured.merge_validator(labels_info))
+    response = tiering.resolve("decide_to_merge", CACHE_DIR, prompt, labels_info, ask).strip()
 
     # Return None if response explicitly indicates no merge
     if response.lower() in (None, "'none'", 'none', '"none"'):
-        print("decide not to merge.")
+        events.emit("merge_decision", "decide not to merge.", candidate_code=candidate_code, decision=None)
         return None
 
     try:
@@ -405,59 +324,133 @@ def decide_to_merge(candidate, data, parent_label=None, is_top_level=False, prom
             # Clean the dictionary values (strip strings)
             cleaned_dict = {k: v.strip() if isinstance(v, str) else v for k, v in response_dict.items()}
             # Validate sibling code
-            if cleaned_dict.get('sibling_code') not in labels_info['sibling_codes']:
-                print("Error: GPT returned an invalid sibling code!")
+            sibling_key = labels_info['sibling_codes'].key_of(cleaned_dict.get('sibling_code'))
+            if sibling_key is None:
+                events.emit("invalid_response", "Error: GPT returned an invalid sibling code!", level=events.WARNING,
+                            candidate_code=candidate_code, response=response)
                 # return decide_to_merge(candidate, data, parent_label=None, is_top_level=False, prompt_template=None)
                 return None
+            events.emit("merge_decision", candidate_code=merged_codes.render(candidate_code),
+                        decision=cleaned_dict.get('sibling_code'))
+            # Continue with the code of the sibling in the tree
+            cleaned_dict['sibling_code'] = sibling_key
             return cleaned_dict
         else:
-            print("Error: Response is not a valid dictionary.")
+            events.emit("invalid_response", "Error: Response is not a valid dictionary.", level=events.WARNING,
+                        candidate_code=candidate_code, response=response)
             return None
     except (ValueError, SyntaxError):
-        print("Error: Response could not be parsed.")
+        events.emit("invalid_response", "Error: Response could not be parsed.", level=events.WARNING,
+                    candidate_code=candidate_code, response=response)
         return None
 
 
-def process_level(whole_data, nodes, parent_label=None, is_top_level=True, prompt_template=None):
+def process_level(whole_data, nodes, parent_label=None, is_top_level=True, prompt_template=None, recurse=True, level=0,
+                  index=None):
+    # Parent index of whole_data for the merges, built by the first call and shared by the groups below
+    if index is None:
+        index = TaxonomyIndex(whole_data)
     merge_candidates = find_merge_candidates(nodes)
+    # Codes and labels of the siblings for the prompts, kept up to date by merge_entities
+    sibling_context = SiblingContext(nodes, render=merged_codes.render)
 
     i = 0
     # Manually create the loop since merge_candidates is updated inside the loop
     while i < len(merge_candidates):
         candidate = merge_candidates[i]
-        merge_decision= decide_to_merge(candidate, nodes, parent_label=parent_label, is_top_level=is_top_level, prompt_template=prompt_template)
+        merge_decision= decide_to_merge(candidate, nodes, parent_label=parent_label, is_top_level=is_top_level, prompt_template=prompt_template,
+                                        sibling_context=sibling_context)
         candidate_code = candidate["code"]
         candidate_label = candidate["label"]
         if (merge_decision == "No Siblings"):
             i = 0
             merge_candidates = []
-            print(f"No sibling of {candidate_code}")
+            events.emit("no_siblings", f"No sibling of {merged_codes.render(candidate_code)}",
+                        candidate_code=merged_codes.render(candidate_code))
         
         elif merge_decision:
             sibling_code = merge_decision["sibling_code"]
             sibling_label =  merge_decision["sibling_label"]
 
             # Generate a representative label for the merged category
-            representative_label = generate_representative_label(candidate_code, candidate_label, sibling_code, sibling_label, parent_label)
+            rendered_candidate, rendered_sibling = merged_codes.render(candidate_code), merged_codes.render(sibling_code)
+            representative_label = generate_representative_label(rendered_candidate, candidate_label, rendered_sibling, sibling_label, parent_label)
             representative_label = representative_label.strip("'\"")
-            print(f"{candidate_code} ({candidate_label}) will be merged with {sibling_code} ({sibling_label}) "
-                  f"with the representative label: {representative_label}")
+            events.emit("representative_label",
+                        f"{rendered_candidate} ({candidate_label}) will be merged with {rendered_sibling} ({sibling_label}) "
+                        f"with the representative label: {representative_label}",
+                        level=events.DEBUG, candidate_code=rendered_candidate, sibling_code=rendered_sibling,
+                        label=representative_label)
 
 
             # Update the data with the merged label and counts
-            merge_candidates = merge_entities( whole_data, candidate_code, sibling_code, representative_label, merge_candidates)
+            merge_candidates = merge_entities( whole_data, candidate_code, sibling_code, representative_label, merge_candidates,
+                                               sibling_context=sibling_context, index=index)
+            metrics.count_at_level("merges", level)
             #Restart the loop to reprocess the updated list
             i = 0
         else:
-            print(f"decided not to merge {candidate_code} ({candidate_label}) with siblings")
+            events.emit("retained", f"decided not to merge {merged_codes.render(candidate_code)} ({candidate_label}) with siblings",
+                        level=events.DEBUG, candidate_code=merged_codes.render(candidate_code))
             i += 1 # Move to the next candidate
 
+    if not recurse:
+        return
+
     for code, node in nodes.items():
         children = node.get("children", {})
         if children:
-            process_level(whole_data, children, parent_label=node.get("label"), is_top_level=False, prompt_template=prompt_template)
+            process_level(whole_data, children, parent_label=node.get("label"), is_top_level=False, prompt_template=prompt_template,
+                          level=level + 1, index=index)
 
 
+def group_impact(nodes):
+    """
+    Returns the expected impact of the merge decisions of a sibling group: how far its candidates are under
+    their thresholds, relative to the thresholds, times the size of the group. A group without candidates
+    needs no decision and comes first, so that the groups below it are scheduled.
+    """
+    deficit = 0.0
+    has_candidates = False
+    for node in nodes.values():
+        count, threshold = node.get("count"), node.get("threshold")
+        if count is not None and threshold is not None and count <= threshold:
+            has_candidates = True
+            deficit += (threshold - count) / max(abs(threshold), 1)
+    return deficit * len(nodes) if has_candidates else float("inf")
+
+
+def process_by_impact(whole_data, prompt_template=None):
+    """
+    Runs process_level on every sibling group of the tree, the group with the highest impact first, until the
+    LLM budget runs out.
+
+    A group is scheduled once the group of its parent is done, since merges there rebuild the children. Every
+    group is processed once with the same parent label as by the recursion of process_level, so the tree is
+    the same; only the order in which the decisions are paid for changes.
+
+    Returns:
+        str: The budget limit that stopped the pass, or None if every group was processed.
+    """
+    queue = []
+    order = itertools.count()
+    index = TaxonomyIndex(whole_data)
+
+    def schedule(nodes, parent_label, level):
+        heapq.heappush(queue, (-group_impact(nodes), next(order), nodes, parent_label, level))
+
+    schedule(whole_data, None, 0)
+    while queue:
+        _, _, nodes, parent_label, level = heapq.heappop(queue)
+        try:
+            process_level(whole_data, nodes, parent_label=parent_label, is_top_level=level == 0,
+                          prompt_template=prompt_template, recurse=False, level=level, index=index)
+        except budget.BudgetExhausted as error:
+            return error.limit
+        for node in nodes.values():
+            if node.get("children"):
+                schedule(node["children"], node.get("label"), level + 1)
+    return None
 
 
 if __name__ == "__main__":
@@ -471,6 +464,7 @@ if __name__ == "__main__":
 
     # Start processing from the top level
     process_level(whole_data, data, is_top_level=True, prompt_template=prompt_template)
+    data = merged_codes.export_tree(data)
 
     # Save the updated data to a new JSON file
     with open('output/cpc/abstract_cpc7/cpc_abstract_round1_iter1.json', 'w') as output_file:
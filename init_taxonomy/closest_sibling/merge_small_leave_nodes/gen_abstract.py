@@ -1,7 +1,9 @@
 import json
-from openai import OpenAI
 import os
 import ast
+from instrumentation import events
+from instrumentation import metrics
+from taxonomy import merged_codes
 from .prompts import PROMPT_TEMPLATES
 # from prompts2 import PROMPT_TEMPLATES
 
@@ -21,11 +23,23 @@ def find_merge_candidates(nodes, parent_node=None):
     leaf_nodes = []
     single_child_nodes = []
 
+    # The smallest count among the siblings, the first node holding it, and the smallest count of the
+    # other siblings, so that the minimum over the siblings of any node is known in constant time
+    lowest_code = None
+    lowest = second_lowest = float("inf")
+
     # Collect leaf nodes and nodes with a single child
     for code, node in nodes.items():
         count = node.get("count", float("inf"))
         children = node.get("children", {})
 
+        if lowest_code is None or count < lowest:
+            if lowest_code is not None:
+                second_lowest = lowest
+            lowest_code, lowest = code, count
+        elif count < second_lowest:
+            second_lowest = count
+
         if not children:  # Leaf node
             leaf_nodes.append({
                 "code": code,
@@ -50,18 +64,14 @@ def find_merge_candidates(nodes, parent_node=None):
 
     # Check nodes with a single child if they are minimum among siblings
     for single_child_node in single_child_nodes:
-        sibling_counts = [
-            sibling.get("count", float("inf"))
-            for sibling_code, sibling in nodes.items()
-            if sibling_code != single_child_node["code"]
-        ]
-
         # Compare the node with siblings 
-        if sibling_counts:
-            if single_child_node["count"] < min(sibling_counts):
+        if len(nodes) > 1:
+            min_sibling_count = second_lowest if single_child_node["code"] == lowest_code else lowest
+            if single_child_node["count"] < min_sibling_count:
                 candidates.append(single_child_node)
         else:
-            print("no sibling for merge.")
+            events.emit("no_siblings", "no sibling for merge.", level=events.DEBUG,
+                        candidate_code=single_child_node["code"])
 
     return candidates
 
@@ -115,33 +125,36 @@ def merge_with_parent(candidate, merge_candidates, data, is_top_level=False):
         is_top_level (bool): Whether the candidate is at the top level of the hierarchy.
 
     Returns:
-        list: Updated merge_candidates list.
+        tuple: The updated merge_candidates list, and whether the candidate was merged into its parent.
     """
     candidate_code = candidate.get("code")
     candidate_node = find_node_by_key(data, candidate_code)
 
     if candidate_node is None:
-        print(f"Error: Node with code {candidate_code} not found.")
-        return merge_candidates
+        events.emit("merge_failed", f"Error: Node with code {merged_codes.render(candidate_code)} not found.",
+                    level=events.ERROR, candidate_code=merged_codes.render(candidate_code))
+        return merge_candidates, False
 
     # Skip merging for top-level nodes
     if is_top_level:
-        print(f"Skipping merge for top-level node: {candidate_code}")
+        events.emit("top_level_skipped", f"Skipping merge for top-level node: {merged_codes.render(candidate_code)}",
+                    level=events.DEBUG, candidate_code=merged_codes.render(candidate_code))
         merge_candidates = [mc for mc in merge_candidates if mc["code"] != candidate_code]
-        return merge_candidates
+        return merge_candidates, False
 
     parent_code = candidate_node.get("parent_code")
     parent_node = find_node_by_key(data, parent_code)
 
     if parent_node is None:
-        print(f"Error: Parent code for node {candidate_code} is missing.")
-        return merge_candidates
+        events.emit("merge_failed", f"Error: Parent code for node {merged_codes.render(candidate_code)} is missing.",
+                    level=events.ERROR, candidate_code=merged_codes.render(candidate_code))
+        return merge_candidates, False
 
     # Update parent's key
     grand_parent_code = parent_node.get("parent_code")
     grand_parent_node = find_node_by_key(data, grand_parent_code) if grand_parent_code else None
 
-    merged_key = f"{parent_code}_{candidate_code}"
+    merged_key = merged_codes.merge_code([parent_code, candidate_code])
     merged_label = parent_node.get("label")
     merged_children = parent_node.get("children", {})
     merged_count = parent_node.get("count", 0) 
@@ -174,23 +187,85 @@ def merge_with_parent(candidate, merge_candidates, data, is_top_level=False):
     # Update the merge_candidates list
     merge_candidates = [mc for mc in merge_candidates if mc["code"] != candidate_code]
 
-    print(f"Merged {candidate_code} into {parent_code}, new key: {merged_key}")
+    report_merge(candidate_code, parent_code, merged_key, merged_count)
+
+    return merge_candidates, True
+
+
+def report_merge(candidate_code, parent_code, merged_key, merged_count):
+    """Report the merge of a node into its parent."""
+    rendered_candidate, rendered_parent = merged_codes.render(candidate_code), merged_codes.render(parent_code)
+    events.emit("merge_with_parent",
+                f"Merged {rendered_candidate} into {rendered_parent}, new key: {merged_codes.render(merged_key)}",
+                candidate_code=rendered_candidate, parent_code=rendered_parent, merged_code=merged_codes.render(merged_key),
+                count=merged_count)
+
+
+def has_unique_keys(data, seen=None):
+    """Return whether every key occurs once in the tree, so that find_node_by_key finds each node by its key."""
+    if seen is None:
+        seen = set()
+    for code, node in data.items():
+        if code in seen:
+            return False
+        seen.add(code)
+        if not has_unique_keys(node.get("children", {}), seen):
+            return False
+    return True
+
+
+def fold_single_child(nodes, code):
+    """
+    Merges the single child of nodes[code] into it in constant time, with the result of merge_with_parent:
+    the merged node keeps the parent's label and count, takes the larger threshold, loses the child and
+    its subtree and replaces the parent at the end of its siblings.
+
+    Parameters:
+        nodes (dict): The children of the grandparent, or the top level.
+        code (str): The code of the parent of the single child.
+    """
+    node = nodes[code]
+    children = node["children"]
+    child_code, child_node = next(iter(children.items()))
+
+    merged_key = merged_codes.merge_code([code, child_code])
+    merged_node = {
+        "label": node.get("label"),
+        "children": children,
+        "count": node.get("count", 0),
+        "threshold": max(node.get("threshold", 0), child_node.get("threshold", 0)),
+        "parent_code": node.get("parent_code"),
+    }
+    child_node["parent_code"] = merged_key
 
-    return merge_candidates
+    nodes[merged_key] = merged_node
+    del nodes[code]
+    del children[child_code]
 
+    report_merge(child_code, code, merged_key, merged_node["count"])
 
-def merge_single_child_nodes(data, parent_node=None, is_top_level=False):
+
+def merge_single_child_nodes(data, parent_node=None, is_top_level=False, level=0, parent_key=None, unique_keys=None):
     """
     Merges nodes that have no siblings with their parent, except for top-level nodes.
 
+    The tree is traversed once. A single child is folded into its parent in place when the keys and
+    parent codes identify the nodes as the lookups of merge_with_parent would; otherwise the child
+    is merged with merge_with_parent.
+
     Parameters:
         data (dict): The hierarchical JSON data.
         parent_node (dict): Optional. The parent node for the current level.
         is_top_level (bool): Whether the current level is the top level.
+        level (int): The depth of the current level (0 = top level), used for the metrics.
+        parent_key (str): Optional. The key of parent_node.
+        unique_keys (bool): Whether the keys of data are unique; computed on the first call.
 
     Returns:
         None. The data is updated in place.
     """
+    if unique_keys is None:
+        unique_keys = has_unique_keys(data)
     nodes = parent_node["children"] if parent_node else data
 
     # Iterate over a copy of the keys to safely modify the dictionary
@@ -201,48 +276,67 @@ def merge_single_child_nodes(data, parent_node=None, is_top_level=False):
         # Skip merging for top-level nodes but process their children
         if is_top_level:
             if children:
-                merge_single_child_nodes(data, parent_node=node, is_top_level=False)
+                merge_single_child_nodes(data, parent_node=node, is_top_level=False, level=level + 1, parent_key=code,
+                                         unique_keys=unique_keys)
             continue
 
-        # If the node has only one child, call merge_with_parent
+        # If the node has only one child, merge it into the node
         if len(children) == 1:
             child_code, child_node = list(children.items())[0]
-            print(f"Identified single child {child_code} for merging into {code}")
-
-            # Construct candidate node for merging
-            candidate = {
-                "code": child_code,
-                "label": child_node.get("label"),
-                "count": child_node.get("count", 0),
-                "parent_code": code,
-                "threshold": child_node.get("threshold"),
-                "children": child_node.get("children", {}),
-            }
-
-            # Call merge_with_parent
-            merge_with_parent(candidate, [], data)
+            events.emit("single_child",
+                        f"Identified single child {merged_codes.render(child_code)} for merging into {merged_codes.render(code)}",
+                        level=events.DEBUG, candidate_code=merged_codes.render(child_code),
+                        parent_code=merged_codes.render(code))
+
+            if (unique_keys and parent_key and node.get("parent_code") == parent_key
+                    and child_node.get("parent_code") == code):
+                fold_single_child(nodes, code)
+                merged = True
+            else:
+                # Construct candidate node for merging
+                candidate = {
+                    "code": child_code,
+                    "label": child_node.get("label"),
+                    "count": child_node.get("count", 0),
+                    "parent_code": code,
+                    "threshold": child_node.get("threshold"),
+                    "children": child_node.get("children", {}),
+                }
+
+                # Call merge_with_parent
+                _, merged = merge_with_parent(candidate, [], data)
+            if merged:
+                metrics.count_at_level("single_child_merges", level + 1)
 
         # Recursively check deeper levels
         elif children:
-            merge_single_child_nodes(data, parent_node=node, is_top_level=False)
+            merge_single_child_nodes(data, parent_node=node, is_top_level=False, level=level + 1, parent_key=code,
+                                     unique_keys=unique_keys)
 
 
 
-def process_level(whole_data, nodes, parent_label=None, is_top_level=True, parent_node=None, prompt_template=None):
+def process_level(whole_data, nodes, parent_label=None, is_top_level=True, parent_node=None, prompt_template=None, recurse=True,
+                  level=0):
     merge_candidates = find_merge_candidates(nodes, parent_node=parent_node)
     
 
     i = 0
     while merge_candidates and isinstance(merge_candidates, list) and i < len(merge_candidates):
         candidate = merge_candidates[i]
-        merge_candidates = merge_with_parent(candidate, merge_candidates, whole_data, is_top_level)
+        merge_candidates, merged = merge_with_parent(candidate, merge_candidates, whole_data, is_top_level)
+        if merged:
+            metrics.count_at_level("level_merges", level)
+
+    if not recurse:
+        return
 
     # Recursively process child nodes
     for code in list(nodes.keys()):
         node = nodes[code]
         children = node.get("children", {})
         if children:
-            process_level(whole_data, children, parent_label=node.get("label"), is_top_level=False, parent_node=node, prompt_template=prompt_template)
+            process_level(whole_data, children, parent_label=node.get("label"), is_top_level=False, parent_node=node, prompt_template=prompt_template,
+                          level=level + 1)
 
 
 if __name__ == "__main__":
@@ -260,6 +354,7 @@ if __name__ == "__main__":
 
     # Merge nodes with no siblings at the end, excluding top-level nodes
     merge_single_child_nodes(whole_data, is_top_level=True)
+    data = merged_codes.export_tree(data)
 
     # Save the updated data to a new JSON file
     with open('output/cpc/abstract_cpc12/cpc_abstract_round2_iter1.json', 'w') as output_file:
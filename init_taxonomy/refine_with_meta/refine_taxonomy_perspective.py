@@ -4,71 +4,47 @@ import os
 
 # Add the project root to sys.path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
-print(sys.path)
 import json
-from openai import OpenAI
 
 import ast
-from configs.config import api_key
-from prompts import PROMPT_TEMPLATES
-
-client = OpenAI(
-    api_key = api_key
-)
+import functools
+from instrumentation import events
+from instrumentation import metrics
+from llm import client as llm_client
+from llm import prompt_cache as cache_store
+from llm import streaming
+from llm import structured
+from llm import tiering
+from taxonomy.index import TaxonomyIndex
+from taxonomy.siblings import SiblingContext
+from init_taxonomy.refine_with_meta.prompts import PROMPT_TEMPLATES
+from init_taxonomy.refine_with_meta.removed_groups import open_removed_groups
 
 # Base cache directory
 CACHE_DIR = "prompt_cache_meta"
 
-# Ensure the cache directory exists
-os.makedirs(CACHE_DIR, exist_ok=True)
+# Model and prompt template of each cached function, which tag its cache entries
+cache_store.register_function(CACHE_DIR, "decision_on_meta_characteristics", llm_client.MODEL,
+                               "decision_on_meta_characteristics",
+                               PROMPT_TEMPLATES["decision_on_meta_characteristics"])
+cache_store.register_function(CACHE_DIR, "representative_label_based_on_meta_characteristics", llm_client.MODEL,
+                               "representative_label_based_on_meta_characteristics",
+                               PROMPT_TEMPLATES["representative_label_based_on_meta_characteristics"])
 
 def get_cache_file(function_name):
     """Generate a cache file path based on the function name."""
-    return os.path.join(CACHE_DIR, f"{function_name}_prompts.json")
+    return cache_store.get_cache_file(CACHE_DIR, function_name)
 
 def load_cache(function_name):
     """Load the cache for a specific function."""
-    cache_file = get_cache_file(function_name)
-    if os.path.exists(cache_file):
-        try:
-            with open(cache_file, "r") as file:
-                return json.load(file)
-        except json.JSONDecodeError:
-            print(f"Cache file {cache_file} is corrupted. Reinitializing.")
-            return {}
-    return {}
-
-def save_cache(function_name, cache):
-    """Save the cache for a specific function."""
-    cache_file = get_cache_file(function_name)
-    try:
-        with open(cache_file, "w") as file:
-            json.dump(cache, file)
-        # print(f"Cache saved to {cache_file}.")
-    except Exception as e:
-        print(f"Error saving cache: {e}")
-
-def chat_gpt(prompt, function_name):
-    """Send a prompt to GPT-4 and cache the response."""
-    # Load the cache specific to the calling function
-    prompt_cache = load_cache(function_name)
-
-    # Check if the prompt exists in the cache
-    if prompt in prompt_cache:
-        print(f"Cache hit for prompt in {function_name}.")
-        return prompt_cache[prompt]
-
-    # If not in cache, make the API call
-    response = client.chat.completions.create(
-        model="gpt-4",
-        messages=[{"role": "user", "content": prompt}]
-    )
-    result = response.choices[0].message.content.strip()
+    return cache_store.load_cache(CACHE_DIR, function_name)
 
-    # Cache the response
-    prompt_cache[prompt] = result
-    save_cache(function_name, prompt_cache)
-    return result
+def chat_gpt(prompt, function_name, parse=None, validate=None):
+    """
+    Send a prompt to GPT-4 and cache the response; with parse, the response is streamed until parse decides it,
+    and with validate, an invalid response is repaired once instead of cached.
+    """
+    return llm_client.chat_gpt(prompt, function_name, CACHE_DIR, parse=parse, validate=validate)
 
 
 
@@ -146,72 +122,6 @@ def find_parent_node(data, parent_code):
                 return found_parent
     return None
 
-def update_json(data, candidate_code, sibling_code, representative_label):
-    """
-    Updates the JSON data by merging two classes and saving the result in the parent's children dictionary.
-    
-    Parameters:
-        data (dict): The hierarchical JSON data.
-        candidate_code (str): Code of the first node to merge.
-        sibling_code (str): Code of the second node to merge.
-        representative_label (str): New label for the merged node.
-    """
-    merged_key = f"{candidate_code}, {sibling_code}"
-
-    if len(candidate_code) == 1:
-        #get the union of children
-        children = {**data[candidate_code]['children'] , ** data[sibling_code]['children']}
-        cnt = data[candidate_code]['count'] + data[sibling_code]['count']
-        threshold = data[candidate_code]['threshold'] + data[sibling_code]['threshold']
-        # Remove the original candidate and sibling nodes from the parent node's children
-        del data[candidate_code]
-        del data[sibling_code]
-        # Create the merged node under the parent
-        data[merged_key] = {
-        "label": representative_label,
-        "children": children,
-        "count": cnt,
-        "threshold": threshold
-        }
-
-    if len(candidate_code) == 3:
-        lvl0_parent_code = candidate_code[0]
-        children = {**data[lvl0_parent_code]['children'][candidate_code]['children'] , **data[lvl0_parent_code]['children'][sibling_code]['children']}
-        cnt = data[lvl0_parent_code]['children'][candidate_code]['count'] + data[lvl0_parent_code]['children'][sibling_code]['count']
-        threshold = data[lvl0_parent_code]['children'][candidate_code]['threshold'] + data[lvl0_parent_code]['children'][sibling_code]['threshold']
-        # Remove the original candidate and sibling nodes from the parent node's children
-        del data[lvl0_parent_code]['children'][candidate_code]
-        del data[lvl0_parent_code]['children'][sibling_code]
-        # Create the merged node under the parent
-        data[lvl0_parent_code]['children'][merged_key] = {
-        "label": representative_label,
-        "children": children,
-        "count": cnt,
-        "threshold": threshold
-        }
-    if len(candidate_code) == 4:
-        lvl0_parent_code = candidate_code[0]
-        lvl1_parent_code = candidate_code[0:3]
-        children = {**data[lvl0_parent_code]['children'][lvl1_parent_code]['children'][candidate_code]['children'], **data[lvl0_parent_code]['children'][lvl1_parent_code]['children'][sibling_code]['children']}
-        cnt = data[lvl0_parent_code]['children'][lvl1_parent_code]['children'][candidate_code]['count'] + data[lvl0_parent_code]['children'][lvl1_parent_code]['children'][sibling_code]['count']
-        threshold = data[lvl0_parent_code]['children'][lvl1_parent_code]['children'][candidate_code]['threshold'] + data[lvl0_parent_code]['children'][lvl1_parent_code]['children'][sibling_code]['threshold']
-        # Remove the original candidate and sibling nodes from the parent node's children
-        del data[lvl0_parent_code]['children'][lvl1_parent_code]['children'][candidate_code]
-        del data[lvl0_parent_code]['children'][lvl1_parent_code]['children'][sibling_code]
-            # Create the merged node under the parent
-        data[lvl0_parent_code]['children'][lvl1_parent_code]['children'][merged_key] = {
-        "label": representative_label,
-        "children": children,
-        "count": cnt,
-        "threshold": threshold
-        }
-
-
-    
-    # print(f"Merged {candidate_code} and {sibling_code} with label '{representative_label}'")
-
-    return data
-
 def find_node_by_key(data, key, parent_code=None):
     """
     Recursively searches for a node by key within the data, considering a specified parent code.
@@ -248,93 +158,9 @@ def find_node_by_key(data, key, parent_code=None):
     return None  # Node not found
 
 
-def merge_entities(data, candidate_code, sibling_codes, representative_label):
-    """
-    Updates the JSON data by merging a candidate node with multiple sibling nodes
-    and saving the result in the parent's children dictionary.
-
-    Parameters:
-        data (dict): The hierarchical JSON data as a dictionary.
-        candidate_code (str): Code of the node to merge.
-        sibling_codes (list): List of codes of sibling nodes to merge with the candidate node.
-        representative_label (str): New label for the merged node.
-    """
-    # Check if candidate node is at the top level
-    if candidate_code in data:
-        candidate_node = data[candidate_code]
-        parent_node = data  # Top-level parent
-    else:
-        # Nested level candidate node
-        candidate_node = find_node_by_key(data, candidate_code)
-        parent_node = find_node_by_key(data, candidate_node.get("parent_code")) if candidate_node else None
-
-    if not candidate_node or not parent_node:
-        # print(f"Candidate node {candidate_code} or its parent not found.")
-        return data
-
-    # Initialize merged properties
-    merged_children = candidate_node.get("children", {}).copy()
-    merged_count = candidate_node.get("count", 0)
-    merged_threshold = candidate_node.get("threshold", 0)  # Default to candidate threshold
-
-    # Iterate over sibling codes
-    for sibling_code in sibling_codes:
-        # Check if sibling node is at the top level
-        if sibling_code in data:
-            sibling_node = data[sibling_code]
-        else:
-            sibling_node = find_node_by_key(data, sibling_code, parent_code=candidate_node.get("parent_code"))
-
-        if not sibling_node:
-            # print(f"Sibling node {sibling_code} not found. Skipping.")
-            continue
-
-        # Merge properties of sibling node
-        merged_children.update(sibling_node.get("children", {}))
-        merged_count += sibling_node.get("count", 0)
-
-        # Remove sibling node from its parent
-        if sibling_code in data:
-            del data[sibling_code]
-        elif sibling_code in parent_node.get("children", {}):
-            del parent_node["children"][sibling_code]
-
-    # Create the merged node
-    merged_key = f"{candidate_code}," + ",".join(sibling_codes)
-    merged_node = {
-        "key": merged_key,
-        "label": representative_label,
-        "children": merged_children,
-        "count": merged_count,
-        "threshold": merged_threshold,
-        "parent_code": candidate_node.get("parent_code", "")
-    }
-
-    # Update `parent_code` for each child in the merged node
-    for child_code in merged_node["children"]:
-        merged_node["children"][child_code]["parent_code"] = merged_key
-
-    # Update the parent's children dictionary
-    if parent_node == data:
-        # For top-level nodes, modify `data` directly
-        data[merged_key] = merged_node
-        # Remove the original candidate node from `data`
-        if candidate_code in data:
-            del data[candidate_code]
-    else:
-        # For nested nodes, modify `parent_node`'s children
-        parent_node["children"][merged_key] = merged_node
-        # Remove the original candidate node from parent's children
-        if candidate_code in parent_node["children"]:
-            del parent_node["children"][candidate_code]
-
-    # print(f"Merged {candidate_code} with siblings {sibling_codes} under label '{representative_label}'")
-
-    return data
-
-
-
-def collect_labels(candidate_code, data, parent_label=None, is_top_level=False):
+def collect_labels(candidate_code, data, parent_label=None, is_top_level=False, sibling_context=None):
+    if sibling_context is None:
+        sibling_context = SiblingContext(data)
     labels_info = {
         "parent_label": parent_label if parent_label else None,
         "candidate_label": None,
@@ -352,26 +178,19 @@ def collect_labels(candidate_code, data, parent_label=None, is_top_level=False):
         child.get("label", "No Label") for child in candidate_node.get("children", {}).values()
     ]
 
-    # Collect sibling codes and labels from other nodes at the same level in `data`
-    labels_info["sibling_codes"] = [
-        sibling_code
-        for sibling_code in data.keys()
-        if sibling_code != candidate_code
-    ]
-    labels_info["sibling_labels"] = [
-        sibling.get("label", "No Label")
-        for sibling_code, sibling in data.items()
-        if sibling_code != candidate_code
-    ]
+    # Sibling codes and labels of the other nodes at the same level in `data`, from the context of the group
+    labels_info["sibling_codes"] = sibling_context.excluding("codes", candidate_code)
+    labels_info["sibling_labels"] = sibling_context.excluding("labels", candidate_code)
 
     return labels_info
 
 
 
-def decide_to_remove(candidate, data, parent_label=None, is_top_level=False, prompt_template=None):
+def decide_to_remove(candidate, data, parent_label=None, is_top_level=False, prompt_template=None, sibling_context=None):
     candidate_code = candidate.get("code")
     candiate_label = candidate.get("label")
-    labels_info = collect_labels(candidate_code, data, parent_label=parent_label, is_top_level=is_top_level)
+    labels_info = collect_labels(candidate_code, data, parent_label=parent_label, is_top_level=is_top_level,
+                                 sibling_context=sibling_context)
 
     # Format the chosen prompt template with the relevant details
     prompt = prompt_template.format(
@@ -381,7 +200,8 @@ def decide_to_remove(candidate, data, parent_label=None, is_top_level=False, pro
         sibling_codes=labels_info['sibling_codes']
     )
 
-    response = chat_gpt(prompt, "decision_on_meta_characteristics" )
+    ask = functools.partial(chat_gpt, parse=streaming.removal_decision(), validate=structured.removal_validator)
+    response = tiering.resolve("decision_on_meta_characteristics", CACHE_DIR, prompt, labels_info, ask)
     
     if response is None or str(response).lower() in ('none', "'none'", '"none"'):
         # print("in if")
@@ -395,57 +215,57 @@ def decide_to_remove(candidate, data, parent_label=None, is_top_level=False, pro
         else:
             response_dict = ast.literal_eval(response)
             if not response_dict:
-                print("return none!")
+                events.emit("invalid_response", "return none!", level=events.WARNING,
+                            candidate_code=candidate_code, response=response)
                 return None
             return response_dict
     except (ValueError, SyntaxError):
         # Print an error if parsing fails
-        print("Parsing error. Returning raw response.")
+        events.emit("invalid_response", "Parsing error. Returning raw response.", level=events.WARNING,
+                    candidate_code=candidate_code, response=response)
     return None
 
-def remove_node_and_children(data, candidate_code):
+def remove_node_and_children(data, candidate_code, index=None):
     """
-    Recursively removes a candidate node and all its children from the JSON data structure.
-    If the candidate node is the only child, its parent is also removed.
+    Removes a candidate node and all its children from the JSON data structure.
+    If the candidate node is the only child, its parent is also removed, and so on up to the nodes of data.
 
     Parameters:
         data (dict): The hierarchical JSON data.
         candidate_code (str): The code of the candidate node to be removed.
+        index (TaxonomyIndex): Optional. The parent index of data, kept up to date across removals.
+            Without it, the index is built for this removal.
 
     Returns:
         dict: The updated data with the specified node and its children removed.
     """
-    # Check if candidate node exists at the top level
-    if candidate_code in data:
-        # Remove the node at the top level
-        del data[candidate_code]
-        print(f"Removed top-level node {candidate_code}")
-        return data
-
-    # Recursively look for the node in children
-    for code, node in list(data.items()):
-        if "children" in node and candidate_code in node["children"]:
-            # Remove the candidate node
-            del node["children"][candidate_code]
-            print(f"Removed node {candidate_code} from parent {code}")
-
-            # Check if the parent node now has no children
-            if not node["children"]:  # If parent has no remaining children
-                print(f"Removing parent node {code} as it has no remaining children.")
-                remove_node_and_children(data, code)  # Recursively remove the parent
-
-            return data
-        elif "children" in node:
-            # Recursively process deeper levels
-            updated_children = remove_node_and_children(node["children"], candidate_code)
-            if updated_children is not None:
-                return data
+    if index is None or (candidate_code in data and index.node(candidate_code) is not data[candidate_code]):
+        # The index lists the first node of a code that is used more than once
+        index = TaxonomyIndex(data)
+
+    code = candidate_code
+    while code in index:
+        siblings = index.siblings(code)
+        parent_code = index.remove(code)
+        if siblings is data or parent_code is None:
+            events.emit("removal", f"Removed top-level node {code}", candidate_code=code)
+            break
+        events.emit("removal", f"Removed node {code} from parent {parent_code}",
+                    candidate_code=code, parent_code=parent_code)
+
+        # Continue with the parent if it has no remaining children
+        if siblings:
+            break
+        events.emit("empty_parent", f"Removing parent node {parent_code} as it has no remaining children.",
+                    candidate_code=parent_code)
+        code = parent_code
 
     return data
 
 
 
-def process_level(nodes, parent_label=None, is_top_level=True, prompt_template=None, removed_groups=None):
+def process_level(nodes, parent_label=None, is_top_level=True, prompt_template=None, removed_groups=None, recurse=True,
+                  level=0, index=None):
     """
     Processes each level of the JSON hierarchy, making decisions to retain or remove nodes based on LLM prompts.
 
@@ -454,41 +274,58 @@ def process_level(nodes, parent_label=None, is_top_level=True, prompt_template=N
         parent_label (str): The label of the parent node, if any.
         is_top_level (bool): Whether the current level is the top level of the hierarchy.
         prompt_template (str): The prompt template to use for LLM decisions.
-        removed_groups (list): A list to track removed groups.
+        removed_groups (list): A list to track removed groups, or a RemovedGroupsWriter writing them as they
+            are removed.
+        recurse (bool): Whether the levels below are processed as well.
+        level (int): The depth of nodes in the hierarchy (0 = top level), used for the metrics.
+        index (TaxonomyIndex): The parent index of the levels processed, built by the first call.
     """
     # Ensure removed_groups is initialized as an empty list if not provided
     if removed_groups is None:
         removed_groups = []
+    if index is None:
+        index = TaxonomyIndex(nodes)
 
     # Find candidates for removal
     remove_candidates = find_meta_candidates(nodes)
+    # Codes and labels of the siblings for the prompts, updated on every removal
+    sibling_context = SiblingContext(nodes)
 
     # Process each candidate for removal
     for candidate in remove_candidates:
         remove_decision = decide_to_remove(
-            candidate, nodes, parent_label=parent_label, is_top_level=is_top_level, prompt_template=prompt_template
+            candidate, nodes, parent_label=parent_label, is_top_level=is_top_level, prompt_template=prompt_template,
+            sibling_context=sibling_context
         )
         candidate_code = candidate["code"]
         candidate_label = candidate["label"]
 
         if remove_decision == "Remove":
-            print(f"Removing {candidate_code} and all its children.")
+            events.emit("remove_decision", f"Removing {candidate_code} and all its children.",
+                        candidate_code=candidate_code, decision="Remove")
             # Add the removed group to the list
             removed_groups.append({
                 "code": candidate_code,
                 "label": candidate_label,
                 "children": candidate.get("children", {})
             })
-            remove_node_and_children(nodes, candidate_code)
+            remove_node_and_children(nodes, candidate_code, index=index)
+            sibling_context.remove(candidate_code)
+            metrics.count_at_level("removals", level)
         else:
-            print(f"Decided to retain {candidate_code}")
+            events.emit("remove_decision", f"Decided to retain {candidate_code}", level=events.DEBUG,
+                        candidate_code=candidate_code, decision=None)
+
+    if not recurse:
+        return removed_groups
 
     # Recursively process child nodes
     for code, node in list(nodes.items()):  # Convert to list to avoid issues with modifying dict during iteration
         children = node.get("children", {})
         if children:
             # Pass the same removed_groups list to the recursive call
-            process_level(children, parent_label=node.get("label"), is_top_level=False, prompt_template=prompt_template, removed_groups=removed_groups)
+            process_level(children, parent_label=node.get("label"), is_top_level=False, prompt_template=prompt_template, removed_groups=removed_groups,
+                          level=level + 1, index=index)
 
     return removed_groups
 
@@ -499,17 +336,10 @@ if __name__ == "__main__":
     with open('output/cpc/abstract_cpc/label_count_updated_parents.json', 'r') as file:
         data = json.load(file)
 
-    # List to store removed groups
-    removed_groups = []
     # Use the prompt template from prompts.py
     prompt_template = PROMPT_TEMPLATES["decision_on_meta_characteristics"]
-    removed_groups = process_level(data, is_top_level=True, prompt_template=prompt_template, removed_groups=removed_groups)
+    # The removed groups are written to the JSON and text files as they are removed
+    with open_removed_groups('output/cpc/abstract_cpc') as removed_groups:
+        process_level(data, is_top_level=True, prompt_template=prompt_template, removed_groups=removed_groups)
     with open('output/cpc/abstract_cpc/cpc_abstract_meta_refined_relavants.json', 'w') as output_file:
-        json.dump(data, output_file, indent=4)
-    # Save the removed groups to a JSON file
-    with open('output/cpc/abstract_cpc/removed_groups_from_meta_refinement.json', 'w') as removed_json_file:
-        json.dump(removed_groups, removed_json_file, indent=4)
-    # Save the removed groups to a text file
-    with open('output/cpc/abstract_cpc/removed_groups_from_meta_refinement.txt', 'w') as removed_text_file:
-        for group in removed_groups:
-            removed_text_file.write(f"Code: {group['code']}, Label: {group['label']}\n")
\ No newline at end of file
+        json.dump(data, output_file, indent=4)
\ No newline at end of file
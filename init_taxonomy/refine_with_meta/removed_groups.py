@@ -0,0 +1,56 @@
+import json
+import os
+
+# File names of the groups removed by the meta refinement
+REMOVED_GROUPS_JSON = "removed_groups_from_meta_refinement.json"
+REMOVED_GROUPS_TXT = "removed_groups_from_meta_refinement.txt"
+
+
+class RemovedGroupsWriter:
+    """
+    Writes the groups removed by the meta refinement to the JSON and text files as they are removed.
+
+    process_level appends the removed groups to its removed_groups argument; with a writer instead of a
+    list, every group is written right away and not kept in memory until the end of the refinement. The
+    JSON file is identical to json.dump(removed_groups, file, indent=4).
+    """
+
+    def __init__(self, json_path, text_path):
+        self.json_path = json_path
+        self.text_path = text_path
+        self.json_file = open(json_path, "w")
+        self.text_file = open(text_path, "w")
+        self.count = 0
+
+    def append(self, group):
+        """Writes one removed group, {"code", "label", "children"}."""
+        lines = json.dumps(group, indent=4).replace("\n", "\n    ")
+        self.json_file.write(f"{',' if self.count else '['}\n    {lines}")
+        self.text_file.write(f"Code: {group['code']}, Label: {group['label']}\n")
+        self.count += 1
+
+    def extend(self, groups):
+        for group in groups:
+            self.append(group)
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        """Closes the list of the JSON file and both files."""
+        if self.json_file.closed:
+            return
+        self.json_file.write("\n]" if self.count else "[]")
+        self.json_file.close()
+        self.text_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_removed_groups(output_dir):
+    """Return a RemovedGroupsWriter for the removed-groups files in output_dir."""
+    return RemovedGroupsWriter(os.path.join(output_dir, REMOVED_GROUPS_JSON), os.path.join(output_dir, REMOVED_GROUPS_TXT))
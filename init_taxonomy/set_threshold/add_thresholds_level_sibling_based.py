@@ -1,5 +1,4 @@
 import json
-import numpy as np
 
 def remove_low_count_classes(data, min_count, removed_codes):
     """
@@ -46,11 +45,48 @@ def calculate_threshold(counts, z_threshold=-1):
     if not counts:
         return 0
 
+    # numpy is imported on first use, so that importing the pipeline stays fast
+    import numpy as np
+
     mean_count = np.mean(counts)
     std_count = np.std(counts)
     threshold_value = mean_count + (z_threshold * std_count)
     return max(0, int(threshold_value))
 
+def add_children_sibling_thresholds(node, z_threshold=-1):
+    """
+    Recursively adds the sibling threshold to every descendant of a node.
+
+    Parameters:
+        node (dict): The node whose descendants are processed.
+        z_threshold (float): The Z-score threshold to determine significant outliers.
+    """
+    # If node has children, calculate threshold for each child based on sibling counts
+    if "children" in node and isinstance(node["children"], dict):
+        counts = [child.get("count", 0) for child in node["children"].values()]
+        threshold = calculate_threshold(counts, z_threshold)
+
+        # Process each child
+        for key, child in node["children"].items():
+            # Add sibling threshold for each child node
+            child["sibling_threshold"] = threshold
+            # Recur into the child node to process deeper levels
+            add_children_sibling_thresholds(child, z_threshold)
+
+def add_root_sibling_thresholds(data, z_threshold=-1):
+    """
+    Adds the sibling threshold to the top-level nodes only.
+
+    Parameters:
+        data (dict): The JSON data structure.
+        z_threshold (float): The Z-score threshold to determine significant outliers.
+    """
+    root_counts = [root.get("count", 0) for root in data.values()]
+    root_threshold = calculate_threshold(root_counts, z_threshold)
+    for key, root_node in data.items():
+        if "count" in root_node:
+            root_node["sibling_threshold"] = root_threshold
+
 def add_thresholds_sibling_based(data, z_threshold=-1):
     """
     Recursively traverses the JSON data, calculates thresholds based on sibling counts,
@@ -63,48 +99,27 @@ def add_thresholds_sibling_based(data, z_threshold=-1):
     Returns:
         dict: The modified JSON data with sibling thresholds added.
     """
-    def recursive_add_thresholds(node):
-        # If node has children, calculate threshold for each child based on sibling counts
-        if "children" in node and isinstance(node["children"], dict):
-            counts = [child.get("count", 0) for child in node["children"].values()]
-            threshold = calculate_threshold(counts, z_threshold)
-
-            # Process each child
-            for key, child in node["children"].items():
-                # Add sibling threshold for each child node
-                child["sibling_threshold"] = threshold
-                # Recur into the child node to process deeper levels
-                recursive_add_thresholds(child)
+    # Calculate threshold for the top-level nodes
+    add_root_sibling_thresholds(data, z_threshold)
 
-    # Start the recursion with the root node
+    # Apply thresholds recursively to the rest of the hierarchy
     for key, root_node in data.items():
-        if "count" in root_node:
-            # Calculate threshold for the top-level nodes
-            root_counts = [root.get("count", 0) for root in data.values()]
-            root_threshold = calculate_threshold(root_counts, z_threshold)
-            root_node["sibling_threshold"] = root_threshold
-
-        # Apply thresholds recursively to the rest of the hierarchy
-        recursive_add_thresholds(root_node)
+        add_children_sibling_thresholds(root_node, z_threshold)
 
     return data
 
-def add_thresholds_level_based(data, z_threshold=-1):
+def collect_level_counts(data, level_counts=None):
     """
-    Recursively traverses the JSON data, calculates thresholds based on level counts,
-    and adds the level-based threshold to each node with a count.
+    Collects the counts of all nodes grouped by level, in depth-first order.
 
     Parameters:
         data (dict): The JSON data structure.
-        z_threshold (float): The Z-score threshold to determine significant outliers.
+        level_counts (dict): Optional dictionary to extend, mapping a level to its list of counts.
 
     Returns:
-        dict: The modified JSON data with level-based thresholds added.
+        dict: The counts of each level; top-level nodes are at level 0.
     """
-    def collect_all_level_counts(node, current_level, level_counts):
-        """
-        Collect counts for all nodes grouped by levels.
-        """
+    def collect_all_level_counts(node, current_level):
         if current_level not in level_counts:
             level_counts[current_level] = []
 
@@ -113,34 +128,74 @@ def add_thresholds_level_based(data, z_threshold=-1):
 
         if "children" in node and isinstance(node["children"], dict):
             for child in node["children"].values():
-                collect_all_level_counts(child, current_level + 1, level_counts)
+                collect_all_level_counts(child, current_level + 1)
+
+    if level_counts is None:
+        level_counts = {}
+    for root in data.values():
+        collect_all_level_counts(root, 0)
+    return level_counts
+
+def calculate_level_thresholds(level_counts, z_threshold=-1):
+    """
+    Calculates the threshold of each level from its counts.
 
-    def recursive_add_thresholds(node, current_level, level_thresholds):
-        """
-        Add level-based thresholds to nodes based on pre-computed thresholds for each level.
-        """
+    Parameters:
+        level_counts (dict): The counts of each level, as returned by collect_level_counts.
+        z_threshold (float): The Z-score threshold to determine significant outliers.
+
+    Returns:
+        dict: The threshold of each level.
+    """
+    level_thresholds = {}
+    for level, counts in level_counts.items():
+        level_thresholds[level] = calculate_threshold(counts, z_threshold)
+    return level_thresholds
+
+def apply_level_thresholds(data, level_thresholds):
+    """
+    Adds pre-computed level-based thresholds to all nodes.
+
+    Parameters:
+        data (dict): The JSON data structure.
+        level_thresholds (dict): The threshold of each level, as returned by calculate_level_thresholds.
+
+    Returns:
+        dict: The modified JSON data with level-based thresholds added.
+    """
+    def recursive_add_thresholds(node, current_level):
         if current_level in level_thresholds:
             node["level_threshold"] = level_thresholds[current_level]
 
         if "children" in node and isinstance(node["children"], dict):
             for child in node["children"].values():
-                recursive_add_thresholds(child, current_level + 1, level_thresholds)
+                recursive_add_thresholds(child, current_level + 1)
+
+    for key, root_node in data.items():
+        recursive_add_thresholds(root_node, 0)
+
+    return data
+
+def add_thresholds_level_based(data, z_threshold=-1):
+    """
+    Recursively traverses the JSON data, calculates thresholds based on level counts,
+    and adds the level-based threshold to each node with a count.
+
+    Parameters:
+        data (dict): The JSON data structure.
+        z_threshold (float): The Z-score threshold to determine significant outliers.
 
+    Returns:
+        dict: The modified JSON data with level-based thresholds added.
+    """
     # Step 1: Collect all counts grouped by levels
-    level_counts = {}
-    for root in data.values():
-        collect_all_level_counts(root, 0, level_counts)
+    level_counts = collect_level_counts(data)
 
     # Step 2: Calculate level-based thresholds
-    level_thresholds = {}
-    for level, counts in level_counts.items():
-        level_thresholds[level] = calculate_threshold(counts, z_threshold)
+    level_thresholds = calculate_level_thresholds(level_counts, z_threshold)
 
     # Step 3: Add thresholds to nodes
-    for key, root_node in data.items():
-        recursive_add_thresholds(root_node, 0, level_thresholds)
-
-    return data
+    return apply_level_thresholds(data, level_thresholds)
 
 def assign_maximum_threshold(data):
     """
@@ -167,6 +222,21 @@ def assign_maximum_threshold(data):
 
     return data
 
+def add_final_thresholds(data, z_threshold=-1):
+    """
+    Adds sibling and level thresholds and keeps the maximum of both as the final threshold of each node.
+
+    Parameters:
+        data (dict): The JSON data structure.
+        z_threshold (float): The Z-score threshold to determine significant outliers.
+
+    Returns:
+        dict: The modified JSON data with the final thresholds assigned.
+    """
+    data_with_sibling_thresholds = add_thresholds_sibling_based(data, z_threshold=z_threshold)
+    data_with_level_thresholds = add_thresholds_level_based(data_with_sibling_thresholds, z_threshold=z_threshold)
+    return assign_maximum_threshold(data_with_level_thresholds)
+
 
 
 if __name__ == "__main__":
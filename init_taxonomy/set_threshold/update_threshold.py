@@ -1,5 +1,4 @@
 import json
-import numpy as np
 
 
 
@@ -17,6 +16,9 @@ def calculate_threshold(counts, z_threshold=-1):
     if not counts:
         return 0
     
+    # numpy is imported on first use, so that importing the pipeline stays fast
+    import numpy as np
+
     mean_count = np.mean(counts)
     std_count = np.std(counts)
     threshold_value = mean_count + (z_threshold * std_count)
@@ -0,0 +1,177 @@
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+from llm import prompt_cache as cache_store
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR}
+LEVEL_NAMES = {value: name for name, value in LEVELS.items()}
+
+# Number of events the writer thread appends to the log under one lock
+WRITE_BATCH = 500
+
+# Event log of this process. While it is disabled, emit prints the message of an event as before.
+state = {
+    "enabled": False,
+    "path": None,
+    "level": INFO,
+    "sample_rate": 1.0,
+    "progress_interval": 10.0,
+    "buffer": deque(maxlen=10000),
+    "counts": {},
+    "queue": None,
+    "writer": None,
+    "last_progress": 0.0,
+}
+
+
+def configure(path, level="info", sample_rate=1.0, buffer_size=10000, progress_interval=10.0):
+    """
+    Sends the events of this process to a JSONL file instead of printing them.
+
+    Parameters:
+        path (str): The JSONL file the events are appended to by a background thread.
+        level (str): The lowest level written: "debug", "info", "warning" or "error".
+        sample_rate (float): The share of debug and info events written; every event is still counted.
+            Warnings and errors are always written.
+        buffer_size (int): The number of recent events kept in memory, see recent().
+        progress_interval (float): Seconds between the progress summaries printed to the console.
+    """
+    close()
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    state.update({
+        "enabled": True,
+        "path": path,
+        "level": LEVELS[level],
+        "sample_rate": sample_rate,
+        "progress_interval": progress_interval,
+        "buffer": deque(maxlen=buffer_size),
+        "counts": {},
+        "queue": queue.Queue(),
+        "last_progress": time.monotonic(),
+    })
+    state["writer"] = threading.Thread(target=_write_events, args=(path, state["queue"]), daemon=True)
+    state["writer"].start()
+
+
+def settings():
+    """Return the arguments of configure used by this process, e.g. to configure worker processes alike."""
+    if not state["enabled"]:
+        return None
+    return {
+        "path": state["path"],
+        "level": LEVEL_NAMES[state["level"]],
+        "sample_rate": state["sample_rate"],
+        "buffer_size": state["buffer"].maxlen,
+        "progress_interval": state["progress_interval"],
+    }
+
+
+def is_enabled():
+    """Return whether events are sent to the event log."""
+    return state["enabled"]
+
+
+def emit(event, message=None, level=INFO, **fields):
+    """
+    Records an event, e.g. a merge decision, with its structured fields.
+
+    Without an event log the message, if any, is printed, so the scripts keep their console output.
+
+    Parameters:
+        event (str): The name of the event, e.g. "merge" or "llm_call".
+        message (str): The human-readable description of the event.
+        level (int): DEBUG, INFO, WARNING or ERROR.
+        **fields: JSON-serializable details such as codes, the decision, the latency or the cache status.
+    """
+    if not state["enabled"]:
+        if message is not None:
+            print(message)
+        return
+
+    counts = state["counts"]
+    seen = counts.get(event, 0)
+    counts[event] = seen + 1
+    if level >= state["level"] and (level >= WARNING or _sampled(seen)):
+        record = {"time": time.time(), "pid": os.getpid(), "level": LEVEL_NAMES[level], "event": event}
+        if message is not None:
+            record["message"] = message
+        record.update(fields)
+        state["buffer"].append(record)
+        state["queue"].put(record)
+        if level >= WARNING and message is not None:
+            print(message)
+
+    now = time.monotonic()
+    if now - state["last_progress"] >= state["progress_interval"]:
+        state["last_progress"] = now
+        print_progress()
+
+
+def _sampled(seen):
+    """Keeps every n-th event of a kind, so that sampled logs are reproducible."""
+    rate = state["sample_rate"]
+    if rate >= 1:
+        return True
+    if rate <= 0:
+        return False
+    return seen % round(1 / rate) == 0
+
+
+def _write_events(path, events):
+    """Appends the queued events to the log, in batches, until None is queued."""
+    while True:
+        batch = [events.get()]
+        while len(batch) < WRITE_BATCH and not events.empty():
+            batch.append(events.get_nowait())
+        records = [record for record in batch if record is not None]
+        if records:
+            lines = "".join(json.dumps(record) + "\n" for record in records)
+            with cache_store.locked(path):
+                with open(path, "a") as file:
+                    file.write(lines)
+        for _ in batch:
+            events.task_done()
+        if len(records) < len(batch):
+            return
+
+
+def recent(count=None):
+    """Return the last events kept in memory, oldest first."""
+    events = list(state["buffer"])
+    return events if count is None else events[-count:]
+
+
+def print_progress():
+    """Prints the number of events of each kind recorded so far."""
+    counts = ", ".join(f"{event}: {count}" for event, count in sorted(state["counts"].items()))
+    print(f"[{time.strftime('%H:%M:%S')}] Progress: {counts}")
+
+
+def flush():
+    """Wait until the queued events are written to the log."""
+    if state["enabled"]:
+        state["queue"].join()
+
+
+def close():
+    """Writes the remaining events, prints the final progress summary and stops the writer thread."""
+    if not state["enabled"]:
+        return
+    print_progress()
+    state["queue"].put(None)
+    state["writer"].join()
+    state["enabled"] = False
+
+
+atexit.register(close)
@@ -0,0 +1,187 @@
+import csv
+import json
+import math
+
+from llm import prompt_cache as cache_store
+
+# Upper bounds, in seconds, of the LLM latency histogram buckets
+LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1, 2, 5, 10, 30, math.inf]
+
+# Metrics of this process. All recording functions return immediately while disabled.
+state = {"enabled": False}
+metrics = {
+    "llm_latency": {},
+    "level_counts": {},
+    "tree_size": [],
+}
+
+
+def enable():
+    """Start recording metrics in this process."""
+    state["enabled"] = True
+
+
+def is_enabled():
+    """Return whether metrics are recorded."""
+    return state["enabled"]
+
+
+def reset():
+    """Drop the metrics recorded so far."""
+    metrics["llm_latency"] = {}
+    metrics["level_counts"] = {}
+    metrics["tree_size"] = []
+
+
+def record_llm_latency(function_name, seconds):
+    """Record the latency of an API call."""
+    if not state["enabled"]:
+        return
+    metrics["llm_latency"].setdefault(function_name, []).append(seconds)
+
+
+def count_at_level(event, level):
+    """Count an operation, e.g. "merges" or "removals", at a level of the hierarchy (0 = top level)."""
+    if not state["enabled"]:
+        return
+    per_level = metrics["level_counts"].setdefault(event, {})
+    per_level[str(level)] = per_level.get(str(level), 0) + 1
+
+
+def count_nodes(data):
+    """Return the number of nodes of a taxonomy."""
+    return sum(1 + count_nodes(node.get("children", {})) for node in data.values())
+
+
+def record_tree_size(step, data, rows=None):
+    """Record the number of nodes (and visualization rows, if known) of the tree after a step."""
+    if not state["enabled"]:
+        return
+    metrics["tree_size"].append({"step": step, "nodes": count_nodes(data), "rows": rows})
+
+
+def snapshot():
+    """Return the metrics of this process, e.g. to send them from a worker process to the coordinator."""
+    return {"llm_latency": metrics["llm_latency"], "level_counts": metrics["level_counts"]}
+
+
+def merge_snapshot(other):
+    """Add the metrics of a worker process to the metrics of this process."""
+    if not state["enabled"]:
+        return
+    for function_name, latencies in other["llm_latency"].items():
+        metrics["llm_latency"].setdefault(function_name, []).extend(latencies)
+    for event, per_level in other["level_counts"].items():
+        own = metrics["level_counts"].setdefault(event, {})
+        for level, count in per_level.items():
+            own[level] = own.get(level, 0) + count
+
+
+def latency_summary(latencies):
+    """Return the count, mean, median, 95th percentile and histogram of a list of latencies."""
+    ordered = sorted(latencies)
+    histogram = {}
+    for bound in LATENCY_BUCKETS:
+        histogram[f"<={bound}s" if bound != math.inf else "slower"] = 0
+    for latency in ordered:
+        for bound in LATENCY_BUCKETS:
+            if latency <= bound:
+                histogram[f"<={bound}s" if bound != math.inf else "slower"] += 1
+                break
+    return {
+        "count": len(ordered),
+        "mean": sum(ordered) / len(ordered) if ordered else 0,
+        "p50": ordered[len(ordered) // 2] if ordered else 0,
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] if ordered else 0,
+        "histogram": histogram,
+    }
+
+
+def build_report(timings):
+    """
+    Combines the recorded metrics and the step timings of a run.
+
+    Parameters:
+        timings (list): The {"stage", "seconds"} entries recorded by the runner.
+
+    Returns:
+        dict: The metrics report.
+    """
+    rounds = {}
+    stages = {}
+    for entry in timings:
+        step, _, stage = entry["stage"].rpartition("/")
+        round_name = step.split("_")[0] if step else entry["stage"]
+        rounds[round_name] = rounds.get(round_name, 0) + entry["seconds"]
+        stages[stage] = stages.get(stage, 0) + entry["seconds"]
+
+    cache = {}
+    for function_name, counts in cache_store.call_counts.items():
+        calls = counts["api_calls"] + counts["cache_hits"]
+        cache[function_name] = dict(counts, hit_rate=counts["cache_hits"] / calls if calls else 0)
+
+    return {
+        "timings": timings,
+        "seconds_per_round": rounds,
+        "seconds_per_stage": stages,
+        "cache": cache,
+        "llm_latency": {name: latency_summary(values) for name, values in metrics["llm_latency"].items()},
+        "level_counts": metrics["level_counts"],
+        "tree_size": metrics["tree_size"],
+    }
+
+
+def write_report(report, path):
+    """Writes a metrics report as JSON, or as CSV rows of (section, name, value) if the path ends with .csv."""
+    if not path.endswith(".csv"):
+        with open(path, "w") as file:
+            json.dump(report, file, indent=4)
+        return
+
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["section", "name", "value"])
+        for entry in report["timings"]:
+            writer.writerow(["timing", entry["stage"], entry["seconds"]])
+        for section in ["seconds_per_round", "seconds_per_stage"]:
+            for name, value in report[section].items():
+                writer.writerow([section, name, value])
+        for function_name, counts in report["cache"].items():
+            for name, value in counts.items():
+                writer.writerow(["cache", f"{function_name}.{name}", value])
+        for function_name, summary in report["llm_latency"].items():
+            for name in ["count", "mean", "p50", "p95"]:
+                writer.writerow(["llm_latency", f"{function_name}.{name}", summary[name]])
+            for bucket, count in summary["histogram"].items():
+                writer.writerow(["llm_latency", f"{function_name}.{bucket}", count])
+        for event, per_level in report["level_counts"].items():
+            for level, count in per_level.items():
+                writer.writerow(["level_counts", f"{event}.level{level}", count])
+        for entry in report["tree_size"]:
+            writer.writerow(["tree_size", entry["step"], entry["nodes"]])
+
+
+def print_summary(report):
+    """Prints the summary tables of a metrics report."""
+    print("\n### Run summary ###")
+    for round_name, seconds in report["seconds_per_round"].items():
+        print(f"{round_name:<24} {seconds:>10.3f}s")
+
+    print(f"\n{'function':<52} {'api':>7} {'hits':>7} {'hit rate':>8} {'p50':>7} {'p95':>7}")
+    for function_name, counts in report["cache"].items():
+        latency = report["llm_latency"].get(function_name, latency_summary([]))
+        print(f"{function_name:<52} {counts['api_calls']:>7} {counts['cache_hits']:>7} {counts['hit_rate']:>8.1%} "
+              f"{latency['p50']:>6.2f}s {latency['p95']:>6.2f}s")
+
+    for function_name, counts in report["cache"].items():
+        if counts.get("parse_failures"):
+            print(f"{function_name}: {counts['parse_failures']} invalid answers, {counts.get('repaired', 0)} repaired, "
+                  f"{counts.get('quarantined', 0)} quarantined, {counts.get('wasted_calls', 0)} wasted API calls")
+
+    for event, per_level in report["level_counts"].items():
+        levels = ", ".join(f"level {level}: {count}" for level, count in sorted(per_level.items(), key=lambda item: int(item[0])))
+        print(f"\n{event}: {levels}")
+
+    if report["tree_size"]:
+        first, last = report["tree_size"][0], report["tree_size"][-1]
+        print(f"\nTree size: {first['nodes']} nodes after {first['step']}, {last['nodes']} nodes after {last['step']}")
@@ -0,0 +1,168 @@
+import json
+
+# Name of the checkpoint a budget-stopped run writes to its output folder
+CHECKPOINT_FILE = "checkpoint.json"
+# Name of the tree a budget-stopped pipeline saves instead of cpc_abstract_final.json
+PARTIAL_FILE = "cpc_abstract_partial.json"
+
+# Limits of the LLM spend. None means unlimited; with no limit set, the governor is disabled and the pipeline
+# runs as before. Calls are API requests; cache hits are free. Tokens are those the API reports, or an
+# estimate of four characters per token for streams and clients that report none.
+limits = {"run_calls": None, "run_tokens": None, "round_calls": None, "round_tokens": None}
+
+# Spend of this process, of the run and of the current round; the round limits only apply while a round of the
+# abstraction runs
+spent = {"run": {"calls": 0, "tokens": 0}, "round": None}
+
+# Tree size reached after each step of the run with the spend so far, and the limit that stopped the run
+progress = {"steps": [], "stopped": None}
+
+
+class BudgetExhausted(Exception):
+    """Raised instead of sending a request once a limit of the budget is reached."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        super().__init__(f"LLM budget exhausted: {limit} reached")
+
+
+def configure(**new_limits):
+    """Sets the limits given, as in limits, and starts the spend of the run from zero."""
+    limits.update((name, value) for name, value in new_limits.items() if name in limits)
+    spent["run"] = {"calls": 0, "tokens": 0}
+    spent["round"] = None
+    progress["steps"] = []
+    progress["stopped"] = None
+
+
+def resume(checkpoint_spent):
+    """
+    Starts the spend of the run from the spend recorded in a checkpoint, so that the run limits apply to the
+    whole run across its resumes. Called after configure.
+    """
+    spent["run"] = {"calls": checkpoint_spent.get("calls", 0), "tokens": checkpoint_spent.get("tokens", 0)}
+
+
+def is_enabled():
+    """Return whether any limit is set."""
+    return any(value is not None for value in limits.values())
+
+
+def start_round():
+    """Starts the spend of a new round from zero."""
+    spent["round"] = {"calls": 0, "tokens": 0}
+
+
+def exhausted(scope=None):
+    """
+    Return the first limit reached, e.g. "round_calls", or None if requests may still be sent.
+
+    Parameters:
+        scope (str): Optional. "run" or "round" to check the limits of one scope only.
+    """
+    for name, value in limits.items():
+        limit_scope, kind = name.split("_")
+        if value is None or scope not in (None, limit_scope) or spent[limit_scope] is None:
+            continue
+        if spent[limit_scope][kind] >= value:
+            return name
+    return None
+
+
+def reserve():
+    """
+    Called before each request.
+
+    Raises:
+        BudgetExhausted: If a limit is reached.
+    """
+    limit = exhausted()
+    if limit is not None:
+        raise BudgetExhausted(limit)
+
+
+def estimate_tokens(*texts):
+    return sum(len(text) for text in texts) // 4 + 1
+
+
+def charge(tokens):
+    """Adds a request and its tokens to the spend of the run and of the round."""
+    for scope in spent.values():
+        if scope is not None:
+            scope["calls"] += 1
+            scope["tokens"] += tokens
+
+
+def response_tokens(response, prompt, text):
+    """Return the tokens the API reports for a response, or an estimate from the prompt and the text."""
+    usage = getattr(response, "usage", None)
+    total = getattr(usage, "total_tokens", None)
+    return total if isinstance(total, int) else estimate_tokens(prompt, text)
+
+
+def record_step(step, rows):
+    """Records the tree size reached after a step together with the spend of the run so far."""
+    progress["steps"].append({"step": step, "rows": rows, "calls": spent["run"]["calls"],
+                              "tokens": spent["run"]["tokens"]})
+
+
+def stop(limit):
+    """Marks the run as stopped by a limit."""
+    progress["stopped"] = limit
+
+
+def is_stopped():
+    """Return whether a limit of the run stopped it, i.e. the tree reached is partial."""
+    return progress["stopped"] is not None
+
+
+def build_report():
+    """
+    Returns the spend of the run and the tree size reached per unit of spend.
+
+    Returns:
+        dict: The limits, the spend, the limit that stopped the run if any, the rows and spend after each
+            step, and the rows removed per call and per thousand tokens between the first and the last step.
+    """
+    steps = progress["steps"]
+    report = {"limits": dict(limits), "spent": dict(spent["run"]), "stopped": progress["stopped"], "steps": steps}
+    if len(steps) > 1:
+        removed = steps[0]["rows"] - steps[-1]["rows"]
+        calls = steps[-1]["calls"] - steps[0]["calls"]
+        tokens = steps[-1]["tokens"] - steps[0]["tokens"]
+        report["rows_removed"] = removed
+        report["rows_removed_per_call"] = removed / calls if calls else None
+        report["rows_removed_per_1k_tokens"] = removed * 1000 / tokens if tokens else None
+    return report
+
+
+def print_report(report):
+    """Prints the spend of the run and the rows reached per step."""
+    print(f"\n{'step':<24} {'rows':>8} {'calls':>8} {'tokens':>10}")
+    for step in report["steps"]:
+        print(f"{step['step']:<24} {step['rows']:>8} {step['calls']:>8} {step['tokens']:>10}")
+    if "rows_removed" in report:
+        per_call = report["rows_removed_per_call"]
+        per_tokens = report["rows_removed_per_1k_tokens"]
+        print(f"{report['rows_removed']} rows removed, "
+              f"{f'{per_call:.2f}' if per_call is not None else '-'} per call, "
+              f"{f'{per_tokens:.2f}' if per_tokens is not None else '-'} per 1k tokens")
+    if report["stopped"]:
+        print(f"Stopped: {report['stopped']} reached after {report['spent']['calls']} calls and "
+              f"{report['spent']['tokens']} tokens.")
+
+
+def save_checkpoint(path, stage, data, state=None):
+    """
+    Writes the point a budget-stopped run resumes from: the input of the interrupted step and the loop state.
+
+    Parameters:
+        path (str): The checkpoint file.
+        stage (str): The stage the run resumes with, "meta_refinement" or "abstraction".
+        data (dict): The input tree of that stage.
+        state (dict): Optional. For the abstraction, the round, iteration and previous row count.
+    """
+    with open(path, "w") as file:
+        json.dump({"stage": stage, "state": state or {}, "spent": dict(spent["run"]),
+                   "stopped": progress["stopped"], "data": data}, file)
+    print(f"Checkpoint saved: {path}")
@@ -0,0 +1,133 @@
+import os
+from contextlib import contextmanager
+
+# Fields of a cache entry, as in the prompt cache JSON files
+COLUMNS = ("response", "model", "template", "version", "created", "used", "hits")
+
+# Open connections of this process: {path: sqlite3.Connection}
+connections = {}
+
+# Connections a forked process inherited from its parent; kept referenced so that the child never closes them
+inherited = []
+
+
+def connect(path):
+    """
+    Return the connection of this process to a cache database, creating the database on first use.
+
+    The database is in WAL mode: readers never block the writer, and every insert is one short transaction
+    instead of a rewrite of the whole cache.
+    """
+    connection = connections.get(path)
+    if connection is None:
+        import sqlite3
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("CREATE TABLE IF NOT EXISTS entries (prompt TEXT PRIMARY KEY, response TEXT NOT NULL, "
+                           "model TEXT, template TEXT, version TEXT, created REAL, used REAL, hits INTEGER DEFAULT 0)")
+        connection.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries (used)")
+        connections[path] = connection
+    return connection
+
+
+@contextmanager
+def transaction(path):
+    """Runs the statements of the block in one write transaction, taken before the first read."""
+    connection = connect(path)
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        yield connection
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    connection.execute("COMMIT")
+
+
+def forget_connections():
+    """Drops the connections of the parent process after a fork; the child opens its own."""
+    inherited.extend(connections.values())
+    connections.clear()
+
+
+def row(prompt, entry):
+    return (prompt,) + tuple(entry.get(column) for column in COLUMNS[:-1]) + (entry.get("hits", 0),)
+
+
+def get(path, prompt):
+    """Return the entry of a prompt with its response, model and version, or None if it is not in the database."""
+    found = connect(path).execute("SELECT response, model, version FROM entries WHERE prompt = ?",
+                                  (prompt,)).fetchone()
+    if found is None:
+        return None
+    return {column: value for column, value in zip(("response", "model", "version"), found) if value is not None}
+
+
+def read_all(path):
+    """Return all entries as {prompt: entry}, with the fields of the JSON cache files."""
+    entries = {}
+    for prompt, *values in connect(path).execute(f"SELECT prompt, {', '.join(COLUMNS)} FROM entries"):
+        entries[prompt] = {column: value for column, value in zip(COLUMNS, values) if value is not None}
+    return entries
+
+
+def evict(connection, max_entries=None, max_age_days=None, now=None):
+    """
+    Deletes the entries not used for max_age_days, then the least recently used entries above max_entries.
+
+    Returns:
+        int: The number of deleted entries.
+    """
+    deleted = 0
+    if max_age_days is not None:
+        deleted += connection.execute("DELETE FROM entries WHERE used < ?", (now - max_age_days * 86400,)).rowcount
+    if max_entries is not None:
+        excess = connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0] - max_entries
+        if excess > 0:
+            deleted += connection.execute("DELETE FROM entries WHERE prompt IN "
+                                          "(SELECT prompt FROM entries ORDER BY used LIMIT ?)", (excess,)).rowcount
+    return deleted
+
+
+def insert(path, entries, usage=None, max_entries=None, max_age_days=None, now=None):
+    """
+    Adds entries and the last use and hits of served entries in one transaction, then applies the bounds.
+    An entry another process added first for the same model and template version is kept; one of another
+    model or version is replaced.
+
+    Parameters:
+        path (str): The cache database.
+        entries (dict): New entries, {prompt: entry}.
+        usage (dict): Optional. {prompt: (last use, hits)} of entries served since the last write.
+        max_entries (int): Optional. The number of entries kept.
+        max_age_days (float): Optional. Entries not used for this many days are deleted.
+        now (float): The current time, for max_age_days.
+
+    Returns:
+        int: The number of added entries.
+    """
+    with transaction(path) as connection:
+        connection.executemany("DELETE FROM entries WHERE prompt = ? AND (model IS NOT ? OR version IS NOT ?)",
+                               [(prompt, entry["model"], entry["version"]) for prompt, entry in entries.items()
+                                if "version" in entry])
+        before = connection.total_changes
+        connection.executemany(f"INSERT OR IGNORE INTO entries (prompt, {', '.join(COLUMNS)}) "
+                               f"VALUES ({', '.join('?' * (len(COLUMNS) + 1))})",
+                               [row(prompt, entry) for prompt, entry in entries.items()])
+        added = connection.total_changes - before
+        connection.executemany("UPDATE entries SET used = MAX(COALESCE(used, 0), ?), hits = COALESCE(hits, 0) + ? "
+                               "WHERE prompt = ?",
+                               [(used, hits, prompt) for prompt, (used, hits) in (usage or {}).items()])
+        evict(connection, max_entries, max_age_days, now)
+    return added
+
+
+def replace_all(path, entries):
+    """Replaces all entries of the database in one transaction."""
+    with transaction(path) as connection:
+        connection.execute("DELETE FROM entries")
+        connection.executemany(f"INSERT INTO entries (prompt, {', '.join(COLUMNS)}) "
+                               f"VALUES ({', '.join('?' * (len(COLUMNS) + 1))})",
+                               [row(prompt, entry) for prompt, entry in entries.items()])
@@ -0,0 +1,233 @@
+import os
+import time
+
+from instrumentation import events
+from instrumentation import metrics
+from llm import budget
+from llm import concurrency
+from llm import prompt_cache as cache_store
+from llm import replay
+from llm import streaming
+from llm import structured
+
+# Model the prompts are sent to
+MODEL = "gpt-4"
+
+# Connection pool of the clients: connections are kept alive between requests, so the TCP and TLS handshakes
+# are paid once per connection instead of once per request
+POOL_LIMITS = {"max_connections": 64, "max_keepalive_connections": 32, "keepalive_expiry": 120.0}
+
+# Seconds allowed for a request, and for opening a connection
+TIMEOUT = {"timeout": 120.0, "connect": 10.0}
+
+# Client of this process, created on the first API call, so cache-only and replay runs need neither network nor
+# configs.config
+clients = {"sync": None}
+
+# Whether the client was installed with set_client rather than created here
+installed = {"sync": False}
+
+
+def http_options():
+    import httpx
+
+    return {"limits": httpx.Limits(**POOL_LIMITS),
+            "timeout": httpx.Timeout(TIMEOUT["timeout"], connect=TIMEOUT["connect"])}
+
+
+def get_client():
+    """Return the OpenAI client of this process, creating it with its connection pool on first use."""
+    if clients["sync"] is None:
+        from openai import DefaultHttpxClient, OpenAI
+        from configs.config import api_key
+
+        clients["sync"] = OpenAI(api_key=api_key, http_client=DefaultHttpxClient(**http_options()))
+    return clients["sync"]
+
+
+def set_client(client=None):
+    """
+    Installs the client used instead of the OpenAI client, e.g. a local stand-in; None restores the default.
+
+    Parameters:
+        client: An object with chat.completions.create, like openai.OpenAI.
+    """
+    clients["sync"] = client
+    installed["sync"] = client is not None
+
+
+def reset_after_fork():
+    """A forked worker opens its own connections instead of sharing the sockets of its parent."""
+    if not installed["sync"]:
+        clients["sync"] = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_after_fork)
+
+
+def request(prompt, model=MODEL):
+    """
+    Send a prompt to the model and return the stripped response and the latency of the request.
+
+    Raises:
+        budget.BudgetExhausted: If a limit of the LLM budget is reached; the prompt is not sent.
+    """
+    budget.reserve()
+    with concurrency.released():
+        start = time.perf_counter()
+        response = get_client().chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}]
+        )
+        result = response.choices[0].message.content.strip()
+        latency = time.perf_counter() - start
+    budget.charge(budget.response_tokens(response, prompt, result))
+    return result, latency
+
+
+def request_streamed(prompt, function_name, parse, model=MODEL):
+    """
+    Stream the response to a prompt and cancel the stream as soon as parse decides it.
+
+    Returns:
+        tuple: The stripped response, or the decision of parse, and the latency until it was known.
+    """
+    budget.reserve()
+    with concurrency.released():
+        start = time.perf_counter()
+        stream = get_client().chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            stream=True
+        )
+        result, characters = streaming.read_stream(stream, parse)
+        latency = time.perf_counter() - start
+    budget.charge(budget.estimate_tokens(prompt, result))
+    events.emit("stream_read", level=events.DEBUG, function_name=function_name, early=characters is not None,
+                characters=characters, latency=latency)
+    return result, latency
+
+
+def replayed(cache_dir, function_name, prompt):
+    """
+    Serve a prompt in replay mode from the cache or the decision log, without network. A missing prompt is
+    answered with replay.MISSING_RESPONSE, and the stage fails once it is done.
+    """
+    result = replay.replay_response(cache_dir, function_name, prompt)
+    if result is None:
+        events.emit("llm_call", level=events.DEBUG, function_name=function_name, cached=False, replay=True,
+                    missing=True)
+        return replay.MISSING_RESPONSE
+    events.emit("llm_call", level=events.DEBUG, function_name=function_name, cached=True, replay=True)
+    replay.record_decision(function_name, prompt, result)
+    return result
+
+
+def cache_hit(cache_dir, function_name, prompt, cached):
+    events.emit("llm_call", f"Cache hit for prompt in {function_name}.", level=events.DEBUG,
+                function_name=function_name, cached=True)
+    cache_store.record_call(function_name, cached=True)
+    cache_store.touch(cache_dir, function_name, prompt)
+    replay.record_decision(function_name, prompt, cached)
+    return cached
+
+
+def answered(cache_dir, function_name, prompt, result, latency, announce_saves=False):
+    """Record and cache the response of an API call; announce_saves prints where it was cached."""
+    metrics.record_llm_latency(function_name, latency)
+    events.emit("llm_call", level=events.DEBUG, function_name=function_name, cached=False, latency=latency)
+    cache_store.record_call(function_name, cached=False)
+    cache_store.save_cache_entry(cache_dir, function_name, prompt, result)
+    message = f"Cache saved to {cache_store.get_cache_file(cache_dir, function_name)}." if announce_saves else None
+    events.emit("cache_saved", message, level=events.DEBUG, function_name=function_name)
+    replay.record_decision(function_name, prompt, result)
+    return result
+
+
+def quarantine_hit(cache_dir, function_name, prompt, held):
+    events.emit("llm_call", f"Quarantined answer for prompt in {function_name}.", level=events.DEBUG,
+                function_name=function_name, cached=True, quarantined=True)
+    cache_store.count_answer(function_name, "quarantine_hits")
+    replay.record_decision(function_name, prompt, held)
+    return held
+
+
+def validated(cache_dir, function_name, prompt, result, latency, validate, announce_saves=False):
+    """
+    Cache a valid response. An invalid one is quarantined and asked again once, with its validation error. A
+    valid repair is cached for the prompt; otherwise the repair is quarantined as the final answer and returned,
+    so that the caller handles it as an invalid response.
+    """
+    error = validate(result)
+    if error is None:
+        return answered(cache_dir, function_name, prompt, result, latency, announce_saves)
+
+    metrics.record_llm_latency(function_name, latency)
+    cache_store.record_call(function_name, cached=False)
+    cache_store.count_answer(function_name, "parse_failures")
+    events.emit("invalid_response", f"Invalid answer in {function_name}: {error}. Asking once more.",
+                level=events.WARNING, function_name=function_name, response=result, error=error)
+    structured.quarantine(cache_dir, function_name, prompt, result, error, final=False)
+
+    repaired, latency = request(structured.repair_prompt(prompt, result, error))
+    cache_store.count_answer(function_name, "repairs")
+    error = validate(repaired)
+    if error is None:
+        cache_store.count_answer(function_name, "repaired")
+        cache_store.count_answer(function_name, "wasted_calls")
+        return answered(cache_dir, function_name, prompt, repaired, latency, announce_saves)
+
+    metrics.record_llm_latency(function_name, latency)
+    cache_store.record_call(function_name, cached=False)
+    cache_store.count_answer(function_name, "quarantined")
+    cache_store.count_answer(function_name, "wasted_calls", 2)
+    events.emit("invalid_response", f"Invalid repaired answer in {function_name}: {error}. Quarantined.",
+                level=events.WARNING, function_name=function_name, response=repaired, error=error)
+    structured.quarantine(cache_dir, function_name, prompt, repaired, error, final=True)
+    replay.record_decision(function_name, prompt, repaired)
+    return repaired
+
+
+def chat_gpt(prompt, function_name, cache_dir, announce_saves=False, parse=None, validate=None):
+    """
+    Send a prompt to the model through the prompt cache of the calling function.
+
+    Parameters:
+        prompt (str): The prompt.
+        function_name (str): The name of the calling function, which selects its cache file.
+        cache_dir (str): The cache directory of the calling module.
+        announce_saves (bool): Whether "Cache saved to ..." is printed after each API call.
+        parse (callable): Optional. The incremental parser of a decision, see llm.streaming; if given, the
+            response is streamed and cancelled once parse decides it, and the decision is cached.
+        validate (callable): Optional. Returns the validation error of a response, or None if it is valid. An
+            invalid response is not cached: it is repaired once, and quarantined if the repair is invalid too.
+
+    Returns:
+        str: The response, from the cache, the quarantine, the decision log in replay mode, or the API.
+    """
+    # In the pipelined executor, wait for another thread asking for the same prompt, then answer as after it
+    with concurrency.exclusive((cache_dir, function_name, prompt)):
+        # A prompt whose answer was invalid even after its repair is not paid for again
+        if validate is not None:
+            held = structured.held_answer(cache_dir, function_name, prompt)
+            if held is not None:
+                return quarantine_hit(cache_dir, function_name, prompt, held)
+
+        # In replay mode, serve the response from the cache or the decision log without network
+        if replay.is_replay():
+            return replayed(cache_dir, function_name, prompt)
+
+        # Look the prompt up in the cache specific to the calling function, or wait for another run requesting it
+        with cache_store.single_flight(cache_dir, function_name, prompt) as cached:
+            if cached is not None:
+                return cache_hit(cache_dir, function_name, prompt, cached)
+
+            # If not in cache, make the API call
+            if parse is not None:
+                result, latency = request_streamed(prompt, function_name, parse)
+            else:
+                result, latency = request(prompt)
+            if validate is not None:
+                return validated(cache_dir, function_name, prompt, result, latency, validate, announce_saves)
+            return answered(cache_dir, function_name, prompt, result, latency, announce_saves)
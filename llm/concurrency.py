@@ -0,0 +1,51 @@
+import threading
+from contextlib import contextmanager
+
+# Lock of the pipelined executor (pipeline.pipelined). Its worker threads run the merge decisions one at a time
+# while holding it, and release it only while they wait: for the network, or for another thread or run requesting
+# the same prompt. The tree, the caches and the counters therefore need no locks of their own. None when no
+# executor runs.
+state = {"lock": None}
+
+# Prompts a thread of the executor is requesting: {(cache_dir, function_name, prompt): threading.Lock}
+requesting = {}
+
+
+def install(lock):
+    """Sets the lock of the running executor, or None once it is done."""
+    state["lock"] = lock
+    requesting.clear()
+
+
+@contextmanager
+def released():
+    """Releases the executor lock, held by the calling thread, for the enclosed wait; does nothing without one."""
+    lock = state["lock"]
+    if lock is None:
+        yield
+        return
+    lock.release()
+    try:
+        yield
+    finally:
+        lock.acquire()
+
+
+@contextmanager
+def exclusive(key):
+    """
+    Lets one thread of the executor at a time ask for a prompt. The others wait for its answer and then find it
+    in the cache, as they would have after it in a single thread. Does nothing without an executor.
+    """
+    if state["lock"] is None:
+        yield
+        return
+    flight = requesting.setdefault(key, threading.Lock())
+    with released():
+        flight.acquire()
+    try:
+        yield
+    finally:
+        flight.release()
+        if requesting.get(key) is flight:
+            del requesting[key]
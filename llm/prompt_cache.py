@@ -0,0 +1,610 @@
+import argparse
+import atexit
+import hashlib
+import importlib
+import json
+import os
+import re
+import shutil
+import string
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+
+from llm import cache_database
+from llm import concurrency
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Number of API calls and cache hits of this process, per function name
+call_counts = {}
+
+# Size and age bounds of the prompt caches, applied whenever a cache file is written, the size of the in-memory
+# tier, and when new entries are written: after flush_interval seconds or once flush_entries are pending.
+# None is unbounded, or never for the flush settings.
+limits = {"max_entries": None, "max_age_days": None, "memory_entries": 100000, "flush_interval": 5.0,
+          "flush_entries": 100}
+
+# Model and prompt template of each cached function:
+# {(cache_dir, function_name): {"model", "template", "text", "version"}}
+functions = {}
+
+# Last use and number of hits of the entries served from a cache since it was last written:
+# {cache_file: {prompt: (used, hits)}}
+usage = {}
+
+# Cache files as last read or written by this process: {cache_file: [file identity, entries, responses]}.
+# A file is parsed again only once another process has replaced it.
+snapshots = {}
+
+# Directory the relative cache directories are placed in, shared by all runs on the host; None keeps them in the
+# working directory. Under the shared root, each cache is a database instead of a JSON file, and concurrent runs
+# wait for each other's API calls on the same prompt (single_flight).
+shared = {"root": os.environ.get("TAXOREFINE_CACHE_ROOT") or None}
+
+# Extension of the cache databases used under the shared root
+DATABASE_EXTENSION = ".sqlite3"
+
+# Number of locks the in-flight prompts of a cache file are spread over
+FLIGHT_LOCKS = 256
+
+# Responses looked up or added by this process, least recently used first: {(cache_dir, function_name, prompt): response}
+memory = OrderedDict()
+
+# Entries added by this process and not yet written to their cache file: {cache_file: {prompt: entry}}
+pending = {}
+
+# Guards pending, usage and snapshots against the background flush
+lock = threading.RLock()
+
+# Process id of the thread flushing the pending entries every flush_interval seconds
+flusher = {"pid": None}
+
+# Modules registering the cached functions, imported by the stats and compact commands
+CACHE_MODULES = [
+    "init_taxonomy.closest_sibling.merge_based_on_common_knowledge_and_size.gen_abstract",
+    "init_taxonomy.refine_with_meta.refine_taxonomy_perspective",
+]
+
+
+@contextmanager
+def locked(path):
+    """
+    Holds an exclusive inter-process lock on a sidecar file of the given path.
+    """
+    with open(f"{path}.lock", "a+") as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def set_root(root):
+    """Place the relative cache directories in an absolute, host-wide directory, or back in the working directory."""
+    shared["root"] = os.path.abspath(root) if root else None
+
+
+def cache_path(cache_dir):
+    """Return the directory a cache directory is stored in: under the shared root if it is relative."""
+    if shared["root"] and not os.path.isabs(cache_dir):
+        return os.path.join(shared["root"], cache_dir)
+    return cache_dir
+
+
+def get_cache_file(cache_dir, function_name):
+    """Generate a cache file path based on the function name: a JSON file, or a database under the shared root."""
+    extension = DATABASE_EXTENSION if shared["root"] else ".json"
+    return os.path.join(cache_path(cache_dir), f"{function_name}_prompts{extension}")
+
+
+def is_database(cache_file):
+    return cache_file.endswith(DATABASE_EXTENSION)
+
+
+def register_function(cache_dir, function_name, model, template_id, template):
+    """
+    Records the model and prompt template of a cached function, so that its new entries are tagged with
+    them and entries of other models or template versions can be told apart.
+
+    Parameters:
+        cache_dir (str): The cache directory.
+        function_name (str): The name of the cached function.
+        model (str): The model the function sends its prompts to.
+        template_id (str): The name of the prompt template, e.g. "merge_decision".
+        template (str): The text of the prompt template; its hash is the template version.
+    """
+    functions[(cache_dir, function_name)] = {"model": model, "template": template_id, "text": template,
+                                             "version": template_version(template)}
+
+
+def template_version(template):
+    """Return the version of a prompt template: a short hash of its text."""
+    return hashlib.sha256(template.encode("utf-8")).hexdigest()[:12]
+
+
+def template_pattern(template):
+    """Return a regex matching exactly the prompts the template can produce."""
+    parts = []
+    for literal, field, _, _ in string.Formatter().parse(template):
+        parts.append(re.escape(literal))
+        if field is not None:
+            parts.append("(.*?)")
+    return re.compile("".join(parts), re.DOTALL)
+
+
+def entry_response(entry):
+    """Return the response of a cache entry; entries written before tagging are the response itself."""
+    return entry if isinstance(entry, str) else entry["response"]
+
+
+def is_current(entry, function):
+    """
+    Return whether a cache entry may be served to its function, as registered with register_function: entries
+    tagged with another model or template version may not. Untagged entries and those of unregistered
+    functions are served.
+    """
+    if function is None or isinstance(entry, str) or "version" not in entry:
+        return True
+    return entry.get("model") == function["model"] and entry["version"] == function["version"]
+
+
+def file_identity(cache_file):
+    """Return what changes whenever a cache file is replaced, or None if there is no file."""
+    try:
+        stat = os.stat(cache_file)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def read_snapshot(cache_file):
+    identity = file_identity(cache_file)
+    snapshot = snapshots.get(cache_file)
+    if snapshot is None or snapshot[0] != identity:
+        entries = {}
+        if identity is not None:
+            try:
+                with open(cache_file, "r") as file:
+                    entries = json.load(file)
+            except json.JSONDecodeError:
+                # Keep the damaged file, which the next write would otherwise replace
+                backup = f"{cache_file}.corrupted"
+                shutil.copyfile(cache_file, backup)
+                print(f"Cache file {cache_file} is corrupted. Reinitializing; a copy was kept at {backup}.")
+        snapshot = snapshots[cache_file] = [identity, entries, None]
+    return snapshot
+
+
+def read_entries(cache_file):
+    """
+    Read the entries of a cache file, treating a missing or corrupted file as an empty cache.
+
+    The file is only parsed if it changed since this process last read or wrote it. Callers changing the
+    entries must write them with write_entries.
+    """
+    if is_database(cache_file):
+        return cache_database.read_all(cache_file)
+    return read_snapshot(cache_file)[1]
+
+
+def read_cache_file(cache_file, function=None):
+    """
+    Read the responses of a cache file as {prompt: response}.
+
+    Parameters:
+        cache_file (str): The cache file or database.
+        function (dict): Optional. The registered model and template of the function of the file; the entries
+            it may not be served, see is_current, are left out.
+    """
+    if is_database(cache_file):
+        return {prompt: entry["response"] for prompt, entry in cache_database.read_all(cache_file).items()
+                if is_current(entry, function)}
+    snapshot = read_snapshot(cache_file)
+    if snapshot[2] is None:
+        snapshot[2] = {prompt: entry_response(entry) for prompt, entry in snapshot[1].items()
+                       if is_current(entry, function)}
+    return snapshot[2]
+
+
+def load_cache(cache_dir, function_name):
+    """Load the cache for a specific function."""
+    return read_cache_file(get_cache_file(cache_dir, function_name), functions.get((cache_dir, function_name)))
+
+
+def write_entries(cache_file, entries):
+    """Replace a cache file atomically; the caller holds its lock."""
+    if is_database(cache_file):
+        cache_database.replace_all(cache_file, entries)
+        return
+    snapshots.pop(cache_file, None)
+    temp_file = f"{cache_file}.{os.getpid()}.tmp"
+    # json.dumps encodes in C; json.dump streams the nested entries through the Python encoder
+    text = json.dumps(entries)
+    with open(temp_file, "w") as file:
+        file.write(text)
+    os.replace(temp_file, cache_file)
+    snapshots[cache_file] = [file_identity(cache_file), entries, None]
+
+
+def upgrade_entries(cache_file, entries):
+    """
+    Converts the entries written before tagging to {"response", "created", "used", "hits"}, dated with the
+    last change of the file, and adds the usage recorded by this process.
+    """
+    if any(isinstance(entry, str) for entry in entries.values()):
+        written = os.path.getmtime(cache_file) if os.path.exists(cache_file) else time.time()
+        for prompt, entry in entries.items():
+            if isinstance(entry, str):
+                entries[prompt] = {"response": entry, "created": written, "used": written, "hits": 0}
+    for prompt, (used, hits) in usage.pop(cache_file, {}).items():
+        entry = entries.get(prompt)
+        if entry is not None:
+            entry["used"] = max(entry.get("used", 0), used)
+            entry["hits"] = entry.get("hits", 0) + hits
+
+
+def evict(entries, max_entries=None, max_age_days=None, now=None):
+    """
+    Drops the entries not used for max_age_days, then the least recently used entries above max_entries.
+
+    Returns:
+        int: The number of dropped entries.
+    """
+    count = len(entries)
+    if max_age_days is not None:
+        oldest = (now or time.time()) - max_age_days * 86400
+        for prompt in [prompt for prompt, entry in entries.items() if entry.get("used", 0) < oldest]:
+            del entries[prompt]
+    if max_entries is not None and len(entries) > max_entries:
+        by_use = sorted(entries, key=lambda prompt: entries[prompt].get("used", 0))
+        for prompt in by_use[:len(entries) - max_entries]:
+            del entries[prompt]
+    return count - len(entries)
+
+
+def remember(key, response):
+    """Add a response to the in-memory tier as its most recently used entry, within memory_entries."""
+    memory[key] = response
+    memory.move_to_end(key)
+    capacity = limits["memory_entries"]
+    if capacity is not None:
+        while len(memory) > capacity:
+            memory.popitem(last=False)
+
+
+def lookup(cache_dir, function_name, prompt):
+    """
+    Return the cached response to a prompt, or None if it is not cached.
+
+    Prompts looked up before are served from memory without touching the cache file. Others are looked up
+    in the entries not written yet, then in the cache database or in the cache file, which is only parsed
+    again if it changed. An entry of another model or template version than the function's is a miss; the
+    response requested instead replaces it.
+    """
+    key = (cache_dir, function_name, prompt)
+    response = memory.get(key)
+    if response is not None:
+        memory.move_to_end(key)
+        return response
+    cache_file = get_cache_file(cache_dir, function_name)
+    with lock:
+        entry = pending.get(cache_file, {}).get(prompt)
+        if entry is not None:
+            response = entry["response"]
+        elif is_database(cache_file):
+            entry = cache_database.get(cache_file, prompt)
+            if entry is not None and is_current(entry, functions.get((cache_dir, function_name))):
+                response = entry["response"]
+        else:
+            response = read_cache_file(cache_file, functions.get((cache_dir, function_name))).get(prompt)
+    if response is not None:
+        remember(key, response)
+    return response
+
+
+def save_cache_entry(cache_dir, function_name, prompt, result):
+    """
+    Adds a single response to the cache of a function.
+
+    The response is served from memory right away and written behind: with the other pending entries
+    once flush_entries of them are pending or flush_interval seconds passed, at the end of every iteration
+    of the abstraction rounds and at exit. See flush.
+
+    Parameters:
+        cache_dir (str): The cache directory.
+        function_name (str): The name of the cached function.
+        prompt (str): The prompt, used as the cache key.
+        result (str): The response to cache.
+    """
+    now = time.time()
+    entry = {"response": result}
+    function = functions.get((cache_dir, function_name))
+    if function:
+        entry.update(model=function["model"], template=function["template"], version=function["version"])
+    entry.update(created=now, used=now, hits=0)
+    remember((cache_dir, function_name, prompt), result)
+    with lock:
+        pending.setdefault(get_cache_file(cache_dir, function_name), {})[prompt] = entry
+        count = sum(len(entries) for entries in pending.values())
+    if limits["flush_entries"] is not None and count >= limits["flush_entries"]:
+        flush()
+    else:
+        start_flusher()
+
+
+def touch(cache_dir, function_name, prompt):
+    """Record a cache hit of an entry; the last use and hit count are written with the next flush."""
+    with lock:
+        file_usage = usage.setdefault(get_cache_file(cache_dir, function_name), {})
+        hits = file_usage.get(prompt, (0, 0))[1]
+        file_usage[prompt] = (time.time(), hits + 1)
+
+
+def flush():
+    """
+    Write the pending entries and the recorded cache hits of this process to the cache files.
+
+    A database takes the entries in one transaction. A JSON file is re-read under an inter-process lock and
+    replaced atomically, so concurrent runs sharing the cache directory never lose each other's entries or
+    leave a partial file. New entries are tagged with the
+    model and template version of their function, and the cache is kept within the bounds in limits.
+    """
+    with lock:
+        for cache_file in list(dict.fromkeys([*pending, *usage])):
+            new_entries = pending.pop(cache_file, {})
+            if is_database(cache_file):
+                try:
+                    cache_database.insert(cache_file, new_entries, usage.pop(cache_file, {}), limits["max_entries"],
+                                          limits["max_age_days"], time.time())
+                except Exception as e:
+                    print(f"Error saving cache: {e}")
+                continue
+            try:
+                os.makedirs(os.path.dirname(cache_file) or ".", exist_ok=True)
+                with locked(cache_file):
+                    entries = read_entries(cache_file)
+                    entries.update(new_entries)
+                    upgrade_entries(cache_file, entries)
+                    evict(entries, limits["max_entries"], limits["max_age_days"])
+                    write_entries(cache_file, entries)
+            except Exception as e:
+                usage.pop(cache_file, None)
+                snapshots.pop(cache_file, None)
+                print(f"Error saving cache: {e}")
+
+
+@contextmanager
+def single_flight(cache_dir, function_name, prompt):
+    """
+    Looks a prompt up in the cache and yields its response, or None if the caller has to request it.
+
+    With a shared root, a prompt missing from the cache is requested by one run at a time: the caller holds
+    a lock of the prompt until its response is written to the cache file, and other runs asking for the same
+    prompt wait for it and are then served from the cache instead of paying for the same call.
+    """
+    response = lookup(cache_dir, function_name, prompt)
+    if response is not None or not shared["root"]:
+        yield response
+        return
+    cache_file = get_cache_file(cache_dir, function_name)
+    flight_dir = os.path.join(os.path.dirname(cache_file), ".inflight")
+    os.makedirs(flight_dir, exist_ok=True)
+    stripe = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8], 16) % FLIGHT_LOCKS
+    with ExitStack() as stack:
+        # A thread of the pipelined executor waits without the executor lock, which the holder of the stripe may
+        # need to finish
+        with concurrency.released():
+            stack.enter_context(locked(os.path.join(flight_dir, f"{os.path.basename(cache_file)}.{stripe}")))
+        # Another run may have answered the prompt while this one waited
+        response = lookup(cache_dir, function_name, prompt)
+        yield response
+        if response is None:
+            flush()
+
+
+def start_flusher():
+    """Start the thread flushing the pending entries every flush_interval seconds, once per process."""
+    interval = limits["flush_interval"]
+    if interval is None or flusher["pid"] == os.getpid():
+        return
+    flusher["pid"] = os.getpid()
+    threading.Thread(target=run_flusher, args=(interval,), name="prompt-cache-flush", daemon=True).start()
+
+
+def run_flusher(interval):
+    while True:
+        time.sleep(interval)
+        flush()
+
+
+def reset_after_fork():
+    """
+    A forked worker starts with a fresh lock and without the pending entries and cache hits of its parent,
+    which the parent writes itself.
+    """
+    global lock
+    lock = threading.RLock()
+    pending.clear()
+    usage.clear()
+    cache_database.forget_connections()
+
+
+atexit.register(flush)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_after_fork)
+
+
+def record_call(function_name, cached):
+    """Count an LLM request of this process, either served from the cache or sent to the API."""
+    counts = call_counts.setdefault(function_name, {"api_calls": 0, "cache_hits": 0})
+    counts["cache_hits" if cached else "api_calls"] += 1
+
+
+def count_answer(function_name, outcome, amount=1):
+    """
+    Count an outcome of the answers of a function, e.g. "parse_failures", "repairs", "repaired", "quarantined",
+    "quarantine_hits" or "wasted_calls", next to its LLM requests.
+    """
+    counts = call_counts.setdefault(function_name, {"api_calls": 0, "cache_hits": 0})
+    counts[outcome] = counts.get(outcome, 0) + amount
+
+
+def total_api_calls():
+    """Return the number of API calls made by this process."""
+    return sum(counts["api_calls"] for counts in call_counts.values())
+
+
+def cache_files(cache_dirs, local=False):
+    """
+    Yields (cache_dir, function_name, cache_file) for the cache files and databases in the given directories,
+    under the shared root unless local is set.
+    """
+    for cache_dir in cache_dirs:
+        directory = cache_dir if local else cache_path(cache_dir)
+        if not os.path.isdir(directory):
+            continue
+        for name in sorted(os.listdir(directory)):
+            for suffix in ("_prompts.json", f"_prompts{DATABASE_EXTENSION}"):
+                if name.endswith(suffix):
+                    yield cache_dir, name[:-len(suffix)], os.path.join(directory, name)
+
+
+def file_stats(cache_dir, function_name, cache_file):
+    """
+    Returns the statistics of a cache file per template version.
+
+    Returns:
+        list: One {"file", "template", "version", "current", "entries", "bytes", "hits", "hit_rate"} entry per
+            template version. Every entry was written after a miss, so the hit rate is hits / (hits + entries).
+    """
+    function = functions.get((cache_dir, function_name))
+    current = template_version(function["text"]) if function else None
+    groups = {}
+    for prompt, entry in read_entries(cache_file).items():
+        tagged = isinstance(entry, dict) and "version" in entry
+        key = (entry.get("template", function_name), entry["version"]) if tagged else (function_name, None)
+        group = groups.setdefault(key, {"file": cache_file, "template": key[0], "version": key[1],
+                                        "current": key[1] is not None and key[1] == current,
+                                        "entries": 0, "bytes": 0, "hits": 0})
+        group["entries"] += 1
+        group["bytes"] += len(json.dumps({prompt: entry}).encode("utf-8"))
+        group["hits"] += entry.get("hits", 0) if isinstance(entry, dict) else 0
+    for group in groups.values():
+        group["hit_rate"] = group["hits"] / (group["hits"] + group["entries"])
+    return list(groups.values())
+
+
+def compact_file(cache_dir, function_name, cache_file, max_entries=None, max_age_days=None, dry_run=False):
+    """
+    Drops the stale and unreachable entries of a cache file and applies the bounds.
+
+    An entry is kept if it was written for the current model and template version of its function. Entries
+    of another model are stale. Entries of another template version, and those written before tagging, are
+    re-tagged if the current template can still produce their prompt; otherwise they are stale, or unreachable
+    if they were never tagged. Files of unregistered functions are only bounded.
+
+    Returns:
+        dict: The number of kept, stale, unreachable and evicted entries.
+    """
+    function = functions.get((cache_dir, function_name))
+    counts = {"stale": 0, "unreachable": 0}
+    with locked(cache_file):
+        entries = read_entries(cache_file)
+        upgrade_entries(cache_file, entries)
+        if function:
+            version = template_version(function["text"])
+            pattern = template_pattern(function["text"])
+            for prompt in list(entries):
+                entry = entries[prompt]
+                if entry.get("version") == version and entry.get("model") == function["model"]:
+                    continue
+                if entry.get("model", function["model"]) == function["model"] and pattern.fullmatch(prompt):
+                    entry.update(model=function["model"], template=function["template"], version=version)
+                    continue
+                del entries[prompt]
+                counts["stale" if "version" in entry else "unreachable"] += 1
+        evicted = evict(entries, max_entries, max_age_days)
+        if dry_run:
+            snapshots.pop(cache_file, None)
+        else:
+            write_entries(cache_file, entries)
+    return {"kept": len(entries), **counts, "evicted": evicted}
+
+
+def load_cache_modules():
+    """Import the modules registering the cached functions and return their cache directories."""
+    for module in CACHE_MODULES:
+        importlib.import_module(module)
+    return sorted({cache_dir for cache_dir, _ in functions})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect and compact the prompt caches, or import the caches of the "
+                                                 "working directory into the shared root.")
+    parser.add_argument("command", choices=["stats", "compact", "import"])
+    parser.add_argument("--cache-dir", nargs="+", default=None,
+                        help="Cache directories; by default those of the cached functions.")
+    parser.add_argument("--max-entries", type=int, default=None, help="Keep at most this many entries per file.")
+    parser.add_argument("--max-age-days", type=float, default=None, help="Drop entries not used for this many days.")
+    parser.add_argument("--dry-run", action="store_true", help="Report what compact would drop without writing.")
+    parser.add_argument("--cache-root", default=shared["root"],
+                        help="Shared directory of the caches; defaults to $TAXOREFINE_CACHE_ROOT.")
+    args = parser.parse_args(argv)
+    set_root(args.cache_root)
+
+    cache_dirs = load_cache_modules()
+    if args.cache_dir:
+        cache_dirs = args.cache_dir
+
+    if args.command == "stats":
+        print(f"{'file':<60} {'template':<44} {'version':<12} {'entries':>8} {'bytes':>10} {'hits':>7} {'hit rate':>8}")
+        for cache_dir, function_name, cache_file in cache_files(cache_dirs):
+            for group in file_stats(cache_dir, function_name, cache_file):
+                version = group["version"] or "untagged"
+                if group["current"]:
+                    version += "*"
+                print(f"{group['file']:<60} {group['template']:<44} {version:<12} {group['entries']:>8} "
+                      f"{group['bytes']:>10} {group['hits']:>7} {group['hit_rate']:>8.1%}")
+        print("* current template version")
+        return 0
+
+    if args.command == "import":
+        if not shared["root"]:
+            parser.error("import needs --cache-root or $TAXOREFINE_CACHE_ROOT")
+        for cache_dir, function_name, json_file in cache_files(cache_dirs, local=True):
+            if is_database(json_file):
+                continue
+            entries = read_entries(json_file)
+            upgrade_entries(json_file, entries)
+            database = get_cache_file(cache_dir, function_name)
+            added = cache_database.insert(database, entries)
+            print(f"{json_file}: imported {added} of {len(entries)} entries into {database}")
+        return 0
+
+    for cache_dir, function_name, cache_file in cache_files(cache_dirs):
+        result = compact_file(cache_dir, function_name, cache_file, max_entries=args.max_entries,
+                              max_age_days=args.max_age_days, dry_run=args.dry_run)
+        print(f"{cache_file}: kept {result['kept']}, dropped {result['stale']} stale, {result['unreachable']} "
+              f"unreachable and {result['evicted']} evicted entries{' (dry run)' if args.dry_run else ''}")
+    return 0
+
+
+if __name__ == "__main__":
+    # The cached functions register in the imported module, not in __main__
+    from llm import prompt_cache
+    sys.exit(prompt_cache.main())
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+
+from llm import prompt_cache as cache_store
+
+# Replay and recording state of this process
+state = {
+    "replay": False,
+    "decisions": {},
+    "caches": {},
+    "record_path": None,
+    # Prompts missing from the replay sources since the last check_missing: {prompt_key: entry}
+    "missing": {},
+}
+
+# Response of a missing prompt, so that the stage runs on and its other missing prompts are found; the decisions
+# read it as no merge and no removal
+MISSING_RESPONSE = "None"
+
+
+class ReplayCacheMiss(Exception):
+    """Raised in replay mode when a prompt is neither in the prompt cache nor in the decision log."""
+
+    def __init__(self, missing):
+        self.missing = missing
+        keys = ", ".join(f"{entry['function_name']}:{entry['key'][:12]}" for entry in missing[:5])
+        more = f" and {len(missing) - 5} more" if len(missing) > 5 else ""
+        super().__init__(f"{len(missing)} prompt(s) missing from the replay sources: {keys}{more}")
+
+
+def prompt_key(function_name, prompt):
+    """Return the short, stable key identifying a prompt of a function."""
+    return hashlib.sha256(f"{function_name}\n{prompt}".encode("utf-8")).hexdigest()
+
+
+def load_decision_log(path):
+    """
+    Loads a decision log written by record_decision.
+
+    Returns:
+        dict: The responses keyed by prompt_key.
+    """
+    decisions = {}
+    with open(path, "r") as file:
+        for line in file:
+            if line.strip():
+                entry = json.loads(line)
+                decisions[prompt_key(entry["function_name"], entry["prompt"])] = entry["response"]
+    return decisions
+
+
+def enable_replay(decision_logs=()):
+    """
+    Serves every chat_gpt call from the prompt caches and the given decision logs, without network.
+
+    Parameters:
+        decision_logs (list): Paths of decision logs used when a prompt is not in the prompt cache.
+    """
+    state["replay"] = True
+    for path in decision_logs:
+        state["decisions"].update(load_decision_log(path))
+
+
+def is_replay():
+    """Return whether replay mode is enabled."""
+    return state["replay"]
+
+
+def replay_response(cache_dir, function_name, prompt):
+    """
+    Returns the recorded response of a prompt.
+
+    Each cache file is read once per process, so replayed calls run at memory speed.
+
+    Returns:
+        str: The response, or None if neither the prompt cache nor the decision logs contain the prompt. The
+            prompt is then recorded as missing, see check_missing.
+    """
+    cache_file = cache_store.get_cache_file(cache_dir, function_name)
+    if cache_file not in state["caches"]:
+        state["caches"][cache_file] = cache_store.read_cache_file(cache_file,
+                                                                  cache_store.functions.get((cache_dir, function_name)))
+    prompt_cache = state["caches"][cache_file]
+
+    if prompt in prompt_cache:
+        cache_store.record_call(function_name, cached=True)
+        return prompt_cache[prompt]
+
+    key = prompt_key(function_name, prompt)
+    if key in state["decisions"]:
+        cache_store.record_call(function_name, cached=True)
+        return state["decisions"][key]
+
+    state["missing"].setdefault(key, {"function_name": function_name, "key": key, "prompt": prompt})
+    return None
+
+
+def add_missing(missing):
+    """Adds prompts found missing elsewhere, e.g. by a worker process, as listed by ReplayCacheMiss."""
+    for entry in missing:
+        state["missing"].setdefault(entry["key"], entry)
+
+
+def check_missing():
+    """
+    Called at the end of a stage; its output is only valid if no prompt was missing.
+
+    Raises:
+        ReplayCacheMiss: With every prompt found missing since the last check.
+    """
+    if state["missing"]:
+        missing = list(state["missing"].values())
+        state["missing"].clear()
+        raise ReplayCacheMiss(missing)
+
+
+def start_recording(path):
+    """Appends every response returned by chat_gpt to a decision log usable with enable_replay."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    state["record_path"] = path
+
+
+def record_decision(function_name, prompt, response):
+    """Append a response to the decision log, if recording is enabled."""
+    path = state["record_path"]
+    if path is None:
+        return
+    line = json.dumps({"function_name": function_name, "prompt": prompt, "response": response})
+    with cache_store.locked(path):
+        with open(path, "a") as file:
+            file.write(line + "\n")
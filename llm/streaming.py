@@ -0,0 +1,110 @@
+import re
+
+# Streamed decisions. Enabled, the merge and removal prompts are streamed, and the stream is cancelled as soon as
+# the text received so far decides the answer, instead of waiting for the whole completion.
+settings = {"enabled": False}
+
+# The opening of a merge response up to the end of its sibling code, e.g. {"sibling_code": "A01"
+SIBLING_CODE = re.compile(r"""\{\s*(["'])sibling_code\1\s*:\s*(["'])(.*?)\2""", re.DOTALL)
+
+# A bare word opening a response, e.g. None or 'Remove', complete once a whitespace or its closing quote follows
+BARE_WORD = re.compile(r"""\s*(?:(["'])([A-Za-z]+)\1|([A-Za-z]+)\s)""")
+
+
+def stage_settings():
+    """Return the settings the outputs of the LLM stages depend on, for the stage cache key; empty when disabled."""
+    return {"streaming": dict(settings)} if settings["enabled"] else {}
+
+
+def bare_decision(text, decisions):
+    """
+    Returns the decision of a response that opens with a bare word, or None.
+
+    The word must be one of the decisions and be complete: followed by a whitespace, or enclosed in quotes. Any
+    other opening, e.g. "Remove." or "Nonetheless", is read to the end and validated like an unstreamed response.
+
+    Parameters:
+        text (str): The response received so far.
+        decisions (dict): The decision of each word, by the lower-cased word, e.g. {"none": "None"}.
+    """
+    match = BARE_WORD.match(text)
+    if match is None:
+        return None
+    return decisions.get((match.group(2) or match.group(3)).lower())
+
+
+def merge_decision(labels_info):
+    """
+    Returns the incremental parser of a merge response, or None if streaming is disabled.
+
+    The parser decides "None" as soon as the response opens with it as a bare word, see bare_decision. It decides
+    a merge as soon as the sibling code of the response is complete and is one of the sibling codes, with the
+    label of that sibling as the prompt gives it.
+
+    Parameters:
+        labels_info (dict): The sibling codes and labels of the prompt, as collected by collect_labels.
+
+    Returns:
+        callable: parse(text) returns the response once text decides it, else None.
+    """
+    if not settings["enabled"]:
+        return None
+    labels = {}
+
+    def parse(text):
+        if bare_decision(text, {"none": "None"}):
+            return "None"
+        match = SIBLING_CODE.match(text.lstrip())
+        if match is None:
+            return None
+        if not labels:
+            labels.update(zip(labels_info["sibling_codes"], labels_info["sibling_labels"]))
+        code = match.group(3).strip()
+        if code not in labels:
+            # Read to the end, so that the invalid code is reported as before
+            return None
+        return str({"sibling_code": code, "sibling_label": labels[code]})
+
+    return parse
+
+
+def removal_decision():
+    """
+    Returns the incremental parser of a removal response, or None if streaming is disabled.
+
+    The parser decides once the response opens with "None" or "Remove" as a bare word, see bare_decision.
+    """
+    if not settings["enabled"]:
+        return None
+
+    def parse(text):
+        return bare_decision(text, {"none": "None", "remove": "Remove"})
+
+    return parse
+
+
+def chunk_text(chunk):
+    """Return the text of a streamed chunk; chunks without choices, e.g. usage chunks, carry none."""
+    if not chunk.choices:
+        return ""
+    return chunk.choices[0].delta.content or ""
+
+
+def read_stream(stream, parse):
+    """
+    Reads a response stream until parse decides it, then closes the stream, which cancels the rest.
+
+    Returns:
+        tuple: The response, either the decision of parse or the whole stripped text, and the number of
+            characters read, or None if the stream was read to the end.
+    """
+    text = ""
+    try:
+        for chunk in stream:
+            text += chunk_text(chunk)
+            decision = parse(text)
+            if decision is not None:
+                return decision, len(text)
+    finally:
+        stream.close()
+    return text.strip(), None
@@ -0,0 +1,171 @@
+import ast
+import json
+import os
+import time
+
+from llm import prompt_cache as cache_store
+
+# Appended to a prompt whose answer did not follow its output format, for the one repair request
+REPAIR_TEMPLATE = """{prompt}
+    ### Previous Answer
+    {response}
+
+    The previous answer does not follow the output format: {error}
+    Respond again, following the output format exactly and without any additional text.
+    """
+
+# Name of the file of the invalid answers of a cache directory
+QUARANTINE_FILE = "quarantine.jsonl"
+
+# Contract of a removal decision
+REMOVAL_SCHEMA = {"enum": ["None", "Remove"]}
+
+# Final invalid answers of the quarantine files read by this process:
+# {quarantine file: {(function_name, prompt): response}}
+quarantined = {}
+
+# Python types of the JSON schema types
+TYPES = {"null": type(None), "object": dict, "string": str, "array": list}
+
+
+def merge_schema(sibling_codes):
+    """Return the contract of a merge decision: None, or the code of one of the siblings with its label."""
+    return {
+        "oneOf": [
+            {"type": "null"},
+            {
+                "type": "object",
+                "required": ["sibling_code", "sibling_label"],
+                "properties": {"sibling_code": {"type": "string", "enum": list(sibling_codes)},
+                               "sibling_label": {"type": "string"}},
+                "additionalProperties": False,
+            },
+        ]
+    }
+
+
+def check(instance, schema, path="answer"):
+    """
+    Validates an instance against the subset of JSON schema used by the decision contracts: type, enum,
+    required, properties, additionalProperties and oneOf.
+
+    Returns:
+        str: The first validation error, or None if the instance is valid.
+    """
+    if "oneOf" in schema:
+        errors = [check(instance, option, path) for option in schema["oneOf"]]
+        if errors.count(None) == 1:
+            return None
+        return f"{path} matches none of the allowed forms ({'; '.join(error for error in errors if error)})"
+    if "type" in schema and not isinstance(instance, TYPES[schema["type"]]):
+        return f"{path} is not of type {schema['type']}"
+    if "enum" in schema and instance not in schema["enum"]:
+        return f"{path} {instance!r} is not one of {schema['enum']}"
+    if isinstance(instance, dict):
+        for name in schema.get("required", []):
+            if name not in instance:
+                return f"{path} has no {name!r}"
+        properties = schema.get("properties", {})
+        for name, value in instance.items():
+            if name in properties:
+                error = check(value, properties[name], f"{path}[{name!r}]")
+                if error:
+                    return error
+            elif schema.get("additionalProperties", True) is False:
+                return f"{path} has the unexpected key {name!r}"
+    return None
+
+
+def decode(text):
+    """
+    Reads the value of an answer: None for 'None', else its JSON or Python literal.
+
+    Raises:
+        ValueError: If the answer is neither.
+    """
+    text = text.strip()
+    if text.lower() in ("none", "'none'", '"none"'):
+        return None
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        raise ValueError("the answer is neither 'None' nor a dictionary literal")
+
+
+def merge_validator(labels_info):
+    """
+    Returns the validator of the answers to a merge prompt.
+
+    Parameters:
+        labels_info (dict): The sibling codes of the prompt, as collected by collect_labels.
+
+    Returns:
+        callable: validate(response) returns the validation error, or None if the response is valid.
+    """
+    def validate(response):
+        try:
+            answer = decode(response)
+        except ValueError as error:
+            return str(error)
+        if isinstance(answer, dict):
+            answer = {name: value.strip() if isinstance(value, str) else value for name, value in answer.items()}
+        return check(answer, merge_schema(labels_info["sibling_codes"]))
+
+    return validate
+
+
+def removal_validator(response):
+    """Returns the validation error of an answer to a removal prompt, or None if it is valid."""
+    answer = response.strip().strip("'\"")
+    return check(answer.capitalize(), REMOVAL_SCHEMA)
+
+
+def repair_prompt(prompt, response, error):
+    """Return the prompt of the repair request for an invalid answer."""
+    return REPAIR_TEMPLATE.format(prompt=prompt, response=response, error=error)
+
+
+def quarantine_file(cache_dir):
+    return os.path.join(cache_store.cache_path(cache_dir), QUARANTINE_FILE)
+
+
+def read_quarantine(path):
+    """Return the final invalid answers of a quarantine file, {(function_name, prompt): response}."""
+    if path not in quarantined:
+        held = {}
+        if os.path.exists(path):
+            with open(path, "r") as file:
+                for line in file:
+                    if line.strip():
+                        entry = json.loads(line)
+                        if entry["final"]:
+                            held[(entry["function_name"], entry["prompt"])] = entry["response"]
+        quarantined[path] = held
+    return quarantined[path]
+
+
+def held_answer(cache_dir, function_name, prompt):
+    """Return the final invalid answer quarantined for a prompt, or None if it is not quarantined."""
+    return read_quarantine(quarantine_file(cache_dir)).get((function_name, prompt))
+
+
+def quarantine(cache_dir, function_name, prompt, response, error, final):
+    """
+    Appends an invalid answer to the quarantine file of its cache directory instead of caching it.
+
+    A final answer is one no repair replaced. It is served for its prompt from then on, so that a restart
+    does not pay for the prompt again; delete the quarantine file to ask again.
+    """
+    path = quarantine_file(cache_dir)
+    entry = {"time": time.time(), "function_name": function_name, "prompt": prompt, "response": response,
+             "error": error, "final": final}
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with cache_store.locked(path):
+        with open(path, "a") as file:
+            file.write(json.dumps(entry) + "\n")
+    if final:
+        read_quarantine(path)[(function_name, prompt)] = response
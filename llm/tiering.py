@@ -0,0 +1,296 @@
+import argparse
+import ast
+import json
+import re
+import string
+import sys
+
+from instrumentation import events
+from llm import prompt_cache as cache_store
+
+# Words that name no field of knowledge, ignored by the lexical scorer
+STOPWORDS = frozenset(["a", "an", "and", "as", "at", "by", "e", "etc", "for", "from", "g", "i", "in", "into", "its",
+                       "of", "on", "or", "other", "the", "their", "to", "with", "without"])
+
+# Tiered decisions. Disabled, every decision is sent to the model. Enabled, the local scorer answers the decisions
+# it is confident about and only the others are escalated to the model:
+# - merge: the candidate is merged with the sibling whose words overlap its own by at least merge_threshold
+#   (Jaccard similarity), if no other sibling comes within margin of it. With keep_threshold set, a candidate
+#   overlapping no sibling by more than keep_threshold is kept separate.
+# - removal: with retain_threshold set, a candidate is retained if at least this share of its words are words
+#   of its parent label.
+# - merged label: two labels with the same words keep the label of the candidate.
+settings = {"enabled": False, "merge_threshold": 0.6, "margin": 0.2, "keep_threshold": None,
+            "retain_threshold": None}
+
+# Decisions of this process per function: {function_name: {"local", "escalated", "compared", "agreed"}}
+counts = {}
+
+
+def configure(enabled=True, **thresholds):
+    """Enables or disables the tiered decisions and sets the thresholds given, as in settings."""
+    settings["enabled"] = enabled
+    settings.update((name, value) for name, value in thresholds.items() if name in settings)
+
+
+def stage_settings():
+    """Return the settings the outputs of the LLM stages depend on, for the stage cache key; empty when disabled."""
+    return {"tiering": dict(settings)} if settings["enabled"] else {}
+
+
+def words(label):
+    """Return the content words of a label, lower-cased and without the plural s."""
+    tokens = re.findall(r"[a-z0-9]+", str(label).lower())
+    return frozenset(token[:-1] if len(token) > 3 and token.endswith("s") and not token.endswith("ss") else token
+                     for token in tokens if token not in STOPWORDS)
+
+
+def similarity(first, second):
+    """Return the Jaccard similarity of two word sets, 0 if either is empty."""
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+def merge_decision(fields):
+    """
+    Decides locally whether a candidate is merged with one of its siblings.
+
+    Returns:
+        str: The response the model would give, a dictionary with the sibling code and label or 'None', or None
+            if the scorer is not confident.
+    """
+    candidate = words(fields["candidate_label"])
+    scores = sorted(((similarity(candidate, words(label)), code, label)
+                     for code, label in zip(fields["sibling_codes"], fields["sibling_labels"])),
+                    key=lambda score: -score[0])
+    if not scores:
+        return None
+    best, code, label = scores[0]
+    runner_up = scores[1][0] if len(scores) > 1 else 0.0
+    if best >= settings["merge_threshold"] and best - runner_up >= settings["margin"]:
+        return str({"sibling_code": code, "sibling_label": label})
+    if settings["keep_threshold"] is not None and best <= settings["keep_threshold"]:
+        return "None"
+    return None
+
+
+def removal_decision(fields):
+    """Decides locally that a candidate is retained by the meta refinement; None if the scorer is not confident."""
+    if settings["retain_threshold"] is None or not fields.get("parent_label"):
+        return None
+    candidate = words(fields["candidate_label"])
+    if candidate and len(candidate & words(fields["parent_label"])) / len(candidate) >= settings["retain_threshold"]:
+        return "None"
+    return None
+
+
+def label_decision(fields):
+    """Keeps the candidate label for two merged labels with the same words; None otherwise."""
+    candidate = words(fields["candidate_label"])
+    if candidate and candidate == words(fields["sibling_label"]):
+        return str(fields["candidate_label"]).strip()
+    return None
+
+
+# Local decision of each function that can be tiered
+DECIDERS = {
+    "decide_to_merge": merge_decision,
+    "decision_on_meta_characteristics": removal_decision,
+    "generate_representative_label": label_decision,
+}
+
+
+def normalized(function_name, response):
+    """Return the decision a response stands for, so that local and model responses can be compared."""
+    text = str(response).strip()
+    if function_name == "generate_representative_label":
+        return words(text)
+    if text.lower().strip("'\"") in ("none", "remove"):
+        return text.lower().strip("'\"")
+    try:
+        parsed = ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return text
+    return str(parsed.get("sibling_code", "")).strip() if isinstance(parsed, dict) else text
+
+
+def tally(function_name, local, remote, decision_counts=None):
+    """
+    Counts a decision, escalated if local is None, and whether a local decision agrees with the response of the
+    model, if there is one.
+    """
+    decision_counts = counts if decision_counts is None else decision_counts
+    count = decision_counts.setdefault(function_name, {"local": 0, "escalated": 0, "compared": 0, "agreed": 0})
+    if local is None:
+        count["escalated"] += 1
+        return
+    count["local"] += 1
+    if remote is not None:
+        count["compared"] += 1
+        count["agreed"] += normalized(function_name, local) == normalized(function_name, remote)
+
+
+def resolve(function_name, cache_dir, prompt, fields, ask):
+    """
+    Returns the response to a decision prompt, from the local scorer if it is confident, else from the model.
+
+    A local decision is compared with the response of the model to the same prompt if an earlier run cached it,
+    without an API call.
+
+    Parameters:
+        function_name (str): The name of the calling function, which selects its local decision.
+        cache_dir (str): The cache directory of the calling module.
+        prompt (str): The prompt.
+        fields (dict): The values the prompt was formatted with.
+        ask (callable): Sends a prompt to the model, ask(prompt, function_name), e.g. the chat_gpt of the module
+            with the streaming parser and the validator of the decision, which repairs or quarantines invalid answers.
+
+    Returns:
+        str: The response, in the format of the model's responses.
+    """
+    decide = DECIDERS.get(function_name)
+    if not settings["enabled"] or decide is None:
+        return ask(prompt, function_name)
+
+    local = decide(fields)
+    if local is None:
+        tally(function_name, None, None)
+        events.emit("tier_decision", level=events.DEBUG, function_name=function_name, tier="remote")
+        return ask(prompt, function_name)
+
+    tally(function_name, local, cache_store.lookup(cache_dir, function_name, prompt))
+    events.emit("tier_decision", level=events.DEBUG, function_name=function_name, tier="local", decision=local)
+    return local
+
+
+def merge_counts(other):
+    """Adds the decision counts of a worker process to those of this process."""
+    for function_name, count in other.items():
+        own = counts.setdefault(function_name, {"local": 0, "escalated": 0, "compared": 0, "agreed": 0})
+        for name, value in count.items():
+            own[name] += value
+
+
+def build_report(decision_counts=None):
+    """
+    Returns the escalation rate and the agreement with the model of each function.
+
+    Returns:
+        dict: {"settings": settings, "functions": {function_name: counts with "decisions", "escalation_rate" and
+            "agreement"}}. The agreement is the share of local decisions that match a cached response of the model,
+            None if no local decision could be compared.
+    """
+    functions = {}
+    for function_name, count in sorted((counts if decision_counts is None else decision_counts).items()):
+        decisions = count["local"] + count["escalated"]
+        functions[function_name] = dict(count, decisions=decisions,
+                                        escalation_rate=count["escalated"] / decisions if decisions else None,
+                                        agreement=count["agreed"] / count["compared"] if count["compared"] else None)
+    return {"settings": dict(settings), "functions": functions}
+
+
+def print_report(report):
+    """Prints the decisions per tier, the escalation rate and the agreement with the model of each function."""
+    print(f"\n{'function':<36} {'decisions':>9} {'local':>7} {'escalated':>9} {'rate':>7} {'compared':>8} "
+          f"{'agreement':>9}")
+    for function_name, count in report["functions"].items():
+        rate = f"{count['escalation_rate']:.1%}" if count["escalation_rate"] is not None else "-"
+        agreement = f"{count['agreement']:.1%}" if count["agreement"] is not None else "-"
+        print(f"{function_name:<36} {count['decisions']:>9} {count['local']:>7} {count['escalated']:>9} {rate:>7} "
+              f"{count['compared']:>8} {agreement:>9}")
+
+
+def prompt_fields(template, prompt):
+    """
+    Returns the values a prompt was formatted with, or None if the template cannot produce it.
+
+    Lists and None are read back from their text; other values stay strings.
+    """
+    match = cache_store.template_pattern(template).fullmatch(prompt)
+    if match is None:
+        return None
+    names = [field for _, field, _, _ in string.Formatter().parse(template) if field is not None]
+    fields = {}
+    for name, text in zip(names, match.groups()):
+        try:
+            value = ast.literal_eval(text)
+        except (ValueError, SyntaxError):
+            value = text
+        fields[name] = value if isinstance(value, (list, type(None))) else text
+    return fields
+
+
+def evaluate_cache(cache_dirs):
+    """
+    Runs the local decisions on the cached prompts of the tiered functions and compares them with the cached
+    responses of the model.
+
+    Returns:
+        dict: The decision counts per function, as in counts, and the number of prompts of another template.
+    """
+    evaluated = {}
+    unparsed = 0
+    for cache_dir, function_name, cache_file in cache_store.cache_files(cache_dirs):
+        function = cache_store.functions.get((cache_dir, function_name))
+        decide = DECIDERS.get(function_name)
+        if function is None or decide is None:
+            continue
+        for prompt, entry in cache_store.read_entries(cache_file).items():
+            fields = prompt_fields(function["text"], prompt)
+            if fields is None:
+                unparsed += 1
+                continue
+            tally(function_name, decide(fields), cache_store.entry_response(entry), evaluated)
+    return evaluated, unparsed
+
+
+def add_threshold_arguments(parser, prefix="tier-"):
+    """Adds the thresholds of the local scorer to a parser, as --<prefix>merge-threshold and so on."""
+    parser.add_argument(f"--{prefix}merge-threshold", type=float, default=settings["merge_threshold"],
+                        help="Word overlap with a sibling from which a merge is decided locally.")
+    parser.add_argument(f"--{prefix}margin", type=float, default=settings["margin"],
+                        help="Lead of the most similar sibling over the next one needed for a local merge.")
+    parser.add_argument(f"--{prefix}keep-threshold", type=float, default=settings["keep_threshold"],
+                        help="Word overlap with every sibling up to which a candidate is kept separate locally; "
+                             "by default, such candidates are escalated.")
+    parser.add_argument(f"--{prefix}retain-threshold", type=float, default=settings["retain_threshold"],
+                        help="Share of the words of a candidate found in its parent label from which the meta "
+                             "refinement retains it locally; by default, every removal decision is escalated.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report how many cached decisions the local scorer would answer "
+                                                 "with the given thresholds, and how often it agrees with the "
+                                                 "cached responses of the model.")
+    parser.add_argument("--cache-dir", nargs="+", default=None,
+                        help="Cache directories; by default those of the cached functions.")
+    parser.add_argument("--cache-root", default=cache_store.shared["root"],
+                        help="Shared directory of the caches; defaults to $TAXOREFINE_CACHE_ROOT.")
+    add_threshold_arguments(parser, prefix="")
+    parser.add_argument("--output", default=None, help="Optional path the report is written to as JSON.")
+    args = parser.parse_args(argv)
+    cache_store.set_root(args.cache_root)
+    configure(merge_threshold=args.merge_threshold, margin=args.margin, keep_threshold=args.keep_threshold,
+              retain_threshold=args.retain_threshold)
+
+    cache_dirs = cache_store.load_cache_modules()
+    if args.cache_dir:
+        cache_dirs = args.cache_dir
+    evaluated, unparsed = evaluate_cache(cache_dirs)
+    report = build_report(evaluated)
+    report["unparsed_prompts"] = unparsed
+    print_report(report)
+    if unparsed:
+        print(f"{unparsed} cached prompts of other template versions were skipped.")
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=4)
+        print(f"Tiering report saved: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    # The cached functions register in the imported modules, and the settings live in llm.tiering, not __main__
+    from llm import tiering
+    sys.exit(tiering.main())
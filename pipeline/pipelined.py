@@ -0,0 +1,104 @@
+import queue
+import threading
+
+from init_taxonomy.closest_sibling.merge_based_on_common_knowledge_and_size import gen_abstract as gen_abstract_cpc_cnt
+from init_taxonomy.closest_sibling.merge_based_on_common_knowledge_and_size import prompts as prompts_cnt
+from llm import concurrency
+from taxonomy import merged_codes
+from taxonomy.index import TaxonomyIndex
+
+# Pipelined rounds. The merges of a sibling group only change the group and the children of its nodes, so a
+# group can be decided as soon as the group of its parent is done, next to every other such group: the count-based
+# merge pass runs its groups in up to `workers` threads, which wait for the model at the same time. The threads
+# run Python one at a time under the lock of llm.concurrency, so each group takes the same decisions as in a
+# single thread and the tree is the same. The artifacts of an iteration are written by a background thread from a
+# snapshot of the tree, while the thresholds and the next merge pass run. The level-based thresholds need the
+# counts of whole levels, so an iteration still starts once the previous one is done. Disabled with workers None.
+settings = {"workers": None}
+
+
+def is_enabled():
+    return bool(settings["workers"])
+
+
+def snapshot(data):
+    """Return a copy of a tree that later merges and thresholds do not change, for an artifact written later."""
+    return {code: dict(node, children=snapshot(node["children"])) if isinstance(node.get("children"), dict)
+            else dict(node) for code, node in data.items()}
+
+
+class ArtifactWriter:
+    """
+    Runs the writes of the iteration artifacts in a background thread, in the order they are submitted.
+
+    The first failed write stops the others and is raised by close.
+    """
+
+    def __init__(self):
+        self.tasks = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name="artifact-writer")
+        self.thread.start()
+
+    def submit(self, func, *args):
+        """Queues func(*args); its arguments must not be changed afterwards, e.g. a snapshot of the tree."""
+        self.tasks.put((func, args))
+
+    def run(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
+            func, args = task
+            if self.error is None:
+                try:
+                    func(*args)
+                except Exception as error:
+                    self.error = error
+
+    def close(self):
+        """Waits for the queued writes. Raises the first error of a write, if any."""
+        if self.thread.is_alive():
+            self.tasks.put(None)
+            self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+def count_merge_stage(data):
+    """
+    Pipelined equivalent of runner.count_merge_stage: the sibling groups are processed by up to settings["workers"]
+    threads, each group once the group of its parent is done.
+    """
+    # concurrent.futures is imported on first use, so that the pipeline starts faster
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+    prompt_template = prompts_cnt.PROMPT_TEMPLATES["merge_decision"]
+    lock = threading.Lock()
+    index = TaxonomyIndex(data)
+
+    def process(nodes, parent_label, level):
+        with lock:
+            gen_abstract_cpc_cnt.process_level(data, nodes, parent_label=parent_label, is_top_level=level == 0,
+                                               prompt_template=prompt_template, recurse=False, level=level,
+                                               index=index)
+            return [(node["children"], node.get("label"), level + 1) for node in nodes.values()
+                    if node.get("children")]
+
+    concurrency.install(lock)
+    try:
+        with ThreadPoolExecutor(max_workers=settings["workers"], thread_name_prefix="merge-group") as executor:
+            pending = {executor.submit(process, data, None, 0)}
+            try:
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        for group in future.result():
+                            pending.add(executor.submit(process, *group))
+            except BaseException:
+                for future in pending:
+                    future.cancel()
+                raise
+    finally:
+        concurrency.install(None)
+    return merged_codes.export_tree(data)
@@ -0,0 +1,675 @@
+import argparse
+import functools
+import json
+import os
+import sys
+import time
+
+# Add the project root to sys.path
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.append(PROJECT_ROOT)
+
+from init_taxonomy.set_threshold import update_threshold
+from init_taxonomy.set_threshold import add_thresholds_level_sibling_based
+from init_taxonomy.add_parent import add_pointers_to_parents
+from init_taxonomy.refine_with_meta import refine_taxonomy_perspective
+from init_taxonomy.refine_with_meta.prompts import PROMPT_TEMPLATES as prompts_meta
+from init_taxonomy.refine_with_meta.removed_groups import open_removed_groups
+from init_taxonomy.closest_sibling.merge_based_on_common_knowledge_and_size import gen_abstract as gen_abstract_cpc_cnt
+from init_taxonomy.closest_sibling.merge_small_leave_nodes import gen_abstract as gen_abstract_cpc_lvl
+from init_taxonomy.closest_sibling.merge_based_on_common_knowledge_and_size import prompts as prompts_cnt
+from init_taxonomy.closest_sibling.merge_small_leave_nodes import prompts as prompts_lvl
+from visualization import plot_abstract
+from pipeline.stage_cache import STAGE_CACHE_DIR, run_cached_stage
+from pipeline import pipelined
+from pipeline import sharding
+from instrumentation import events
+from instrumentation import metrics
+from llm import budget
+from llm import prompt_cache as cache_store
+from llm import replay
+from llm import streaming
+from llm import tiering
+from taxonomy import merged_codes
+
+# Stages in execution order
+STAGES = ["thresholds", "parent_pointers", "meta_refinement", "abstraction"]
+
+
+def decision_settings():
+    """Return the tiering and streaming settings the outputs of the LLM stages depend on."""
+    return {**tiering.stage_settings(), **streaming.stage_settings()}
+
+
+def run_stage(name, timings, func, *args, **kwargs):
+    """
+    Runs a single pipeline step and records its wall time.
+
+    In replay mode, the step fails once it is done if prompts were missing from the replay sources.
+
+    Parameters:
+        name (str): The name reported for the step.
+        timings (list): List collecting {"stage", "seconds"} entries.
+        func (callable): The step to run.
+
+    Returns:
+        The return value of func.
+    """
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    timings.append({"stage": name, "seconds": time.perf_counter() - start})
+    replay.check_missing()
+    return result
+
+
+def meta_refinement_stage(data, prompt_template, removed_groups=None):
+    """
+    Runs the meta refinement and returns the refined tree together with the removed groups.
+
+    If removed_groups is a RemovedGroupsWriter, the removed groups are written as they are removed and
+    the writer is returned in their place.
+    """
+    removed_groups = refine_taxonomy_perspective.process_level(
+        data, is_top_level=True, prompt_template=prompt_template,
+        removed_groups=[] if removed_groups is None else removed_groups)
+    return {"data": data, "removed_groups": removed_groups}
+
+
+def count_merge_stage(data):
+    """Runs one pass of the count-based merge on the whole tree and renders the keys of the merged nodes."""
+    prompt_template = prompts_cnt.PROMPT_TEMPLATES["merge_decision"]
+    gen_abstract_cpc_cnt.process_level(data, data, is_top_level=True, prompt_template=prompt_template)
+    return merged_codes.export_tree(data)
+
+
+def budgeted_count_merge_stage(data):
+    """
+    Like count_merge_stage, with the sibling groups in order of impact. The pass ends where the LLM budget runs
+    out, with the merges of the groups processed so far applied.
+    """
+    prompt_template = prompts_cnt.PROMPT_TEMPLATES["merge_decision"]
+    limit = gen_abstract_cpc_cnt.process_by_impact(data, prompt_template=prompt_template)
+    if limit is not None:
+        print(f"LLM budget exhausted: {limit} reached. Remaining merge decisions skipped.")
+    return merged_codes.export_tree(data)
+
+
+def level_merge_stage(data):
+    """
+    Runs the merge of small leave nodes followed by the merge of single-child nodes and renders the keys
+    of the merged nodes.
+    """
+    prompt_template = prompts_lvl.PROMPT_TEMPLATES["merge_decision"]
+    gen_abstract_cpc_lvl.process_level(data, data, is_top_level=True, prompt_template=prompt_template)
+    gen_abstract_cpc_lvl.merge_single_child_nodes(data, is_top_level=True)
+    return merged_codes.export_tree(data)
+
+
+def save_json(data, path):
+    """Write a JSON artifact in the same indented format the standalone scripts use."""
+    with open(path, 'w') as file:
+        json.dump(data, file, indent=4)
+    print(f"Saved: {path}")
+
+
+def copy_tree(data):
+    """Return a copy of a JSON tree that later merges do not change."""
+    return json.loads(json.dumps(data))
+
+
+def save_removed_groups(removed_groups, output_dir):
+    """
+    Saves the groups removed by the meta refinement to a JSON and a text file.
+
+    Parameters:
+        removed_groups (list): The removed groups returned by the meta refinement.
+        output_dir (str): The directory the files are written to.
+    """
+    with open_removed_groups(output_dir) as writer:
+        writer.extend(removed_groups)
+    print(f"Saved: {writer.json_path}")
+
+
+def save_artifact(data, path, writer=None):
+    """Write a JSON artifact, in the background from a snapshot of the tree if an ArtifactWriter is given."""
+    if writer is None:
+        save_json(data, path)
+    else:
+        writer.submit(save_json, pipelined.snapshot(data), path)
+
+
+def write_iteration(data, rows, output_json, excel_file):
+    """Writes the merged taxonomy JSON and the visualization Excel file of an iteration."""
+    import pandas as pd
+
+    save_json(data, output_json)
+    pd.DataFrame(rows).to_excel(excel_file, index=False)
+    print(f"Visualization saved: {excel_file}")
+
+
+def export_iteration(data, output_json, excel_file, save_intermediate, writer=None):
+    """
+    Counts the visualization rows of the current taxonomy and optionally writes the iteration artifacts.
+
+    Parameters:
+        data (dict): The hierarchical JSON data.
+        output_json (str): Path of the merged taxonomy JSON of this iteration.
+        excel_file (str): Path of the visualization Excel file of this iteration.
+        save_intermediate (bool): Whether the JSON and Excel files are written.
+        writer (ArtifactWriter): Optional. If given, the files are written in the background from a snapshot.
+
+    Returns:
+        int: The number of visualization rows.
+    """
+    rows = plot_abstract.process_hierarchy(data)
+    if save_intermediate:
+        if writer is None:
+            write_iteration(data, rows, output_json, excel_file)
+        else:
+            writer.submit(write_iteration, pipelined.snapshot(data), rows, output_json, excel_file)
+    return len(rows)
+
+
+def run_abstraction(data, output_dir, z_th=-2, subjective_ending_condition=100, save_intermediate=True, timings=None,
+                    stage_cache_dir=None, max_iterations=None, shard_pool=None, start=None):
+    """
+    Runs the count-based and level-based merge rounds until the row count falls under the ending condition.
+    This is the loop of main.py, operating on a single in-memory tree. The new prompt cache entries are
+    written to disk at the end of every iteration.
+
+    With an LLM budget, the merge decisions are taken in order of impact. A round whose budget is exhausted
+    ends with its level-based merge. Once the budget of the run is exhausted, the input of the last iteration
+    and the loop state are saved to checkpoint.json in output_dir and the tree reached is returned.
+
+    Pipelined (see pipeline.pipelined), the sibling groups of the count-based merge are decided concurrently,
+    unless a budget or shard_pool is given, and the artifacts are written in the background.
+
+    Parameters:
+        data (dict): The meta-refined hierarchical JSON data with thresholds and parent codes.
+        output_dir (str): The directory the per-iteration artifacts are written to.
+        z_th (float): The Z-score threshold used when refreshing thresholds.
+        subjective_ending_condition (int): The row count under which no further round is started.
+        save_intermediate (bool): Whether the per-iteration JSON and Excel files are written.
+        timings (list): Optional list collecting the per-step timings.
+        stage_cache_dir (str): Optional artifact cache directory; merge and threshold steps whose input is
+            unchanged are loaded from it instead of being recomputed.
+        max_iterations (int): Optional maximum number of count-based iterations per round; a round ends
+            as if its row count had stabilized once it is reached.
+        shard_pool (multiprocessing.Pool): Optional pool; if given, each top-level section is processed
+            by a worker process.
+        start (dict): Optional loop state of a checkpoint to resume from; data is then the tree of the
+            checkpoint.
+
+    Returns:
+        dict: The abstracted taxonomy.
+    """
+    if timings is None:
+        timings = []
+
+    writer = pipelined.ArtifactWriter() if pipelined.is_enabled() and save_intermediate else None
+    try:
+        return run_rounds(data, output_dir, z_th=z_th, subjective_ending_condition=subjective_ending_condition,
+                          save_intermediate=save_intermediate, timings=timings, stage_cache_dir=stage_cache_dir,
+                          max_iterations=max_iterations, shard_pool=shard_pool, start=start, writer=writer)
+    finally:
+        if writer is not None:
+            run_stage("artifact_writes", timings, writer.close)
+
+
+def run_rounds(data, output_dir, z_th, subjective_ending_condition, save_intermediate, timings, stage_cache_dir,
+               max_iterations, shard_pool, start, writer):
+    """The rounds of run_abstraction; writer is the ArtifactWriter of a pipelined run, else None."""
+    count_merge = count_merge_stage
+    count_merge_cache_dir = stage_cache_dir
+    level_merge = level_merge_stage
+    final_thresholds = add_thresholds_level_sibling_based.add_final_thresholds
+    if shard_pool is not None:
+        count_merge = functools.partial(sharding.count_merge_stage, pool=shard_pool)
+        level_merge = functools.partial(sharding.level_merge_stage, pool=shard_pool)
+        final_thresholds = functools.partial(sharding.final_thresholds_stage, pool=shard_pool)
+    if budget.is_enabled():
+        # A pass the budget stops depends on the spend before it, so it is not cached
+        count_merge = budgeted_count_merge_stage
+        count_merge_cache_dir = None
+    elif shard_pool is None and pipelined.is_enabled():
+        count_merge = pipelined.count_merge_stage
+
+    start = start or {}
+    iteration = start.get("iteration", 1)
+    previous_row_count = start.get("previous_row_count", -1)
+    round_number = start.get("round", 1)
+    round_iterations = start.get("round_iterations", 0)
+    if budget.is_enabled():
+        budget.record_step("start", len(plot_abstract.process_hierarchy(data)))
+    while previous_row_count > subjective_ending_condition or previous_row_count == -1:
+        budget.start_round()
+        while True:
+            print(f"\n### Starting Iteration {iteration} ###")
+            step = f"round{round_number}_iter{iteration + 1}"
+            output_json = os.path.join(output_dir, f"cpc_abstract_{step}.json")
+            excel_file = os.path.join(output_dir, f"cpc_abstract_{step}.xlsx")
+            updated_json = os.path.join(output_dir, f"cpc_abstract_{step}_updated.json")
+
+            if budget.is_enabled():
+                checkpoint = {"data": copy_tree(data),
+                              "state": {"round": round_number, "iteration": iteration,
+                                        "previous_row_count": previous_row_count,
+                                        "round_iterations": round_iterations}}
+
+            data = run_stage(f"{step}/merge", timings, run_cached_stage, count_merge_cache_dir, "count_merge",
+                             count_merge, data, templates=prompts_cnt.PROMPT_TEMPLATES,
+                             settings=decision_settings())
+
+            current_row_count = run_stage(f"{step}/export", timings, export_iteration,
+                                          data, output_json, excel_file, save_intermediate, writer)
+            print(f"Row Count: {current_row_count}")
+            metrics.record_tree_size(step, data, current_row_count)
+            budget.record_step(step, current_row_count)
+
+            data = run_stage(f"{step}/thresholds", timings, run_cached_stage, stage_cache_dir, "final_thresholds",
+                             final_thresholds, data,
+                             params={"z_threshold": z_th})
+            if save_intermediate:
+                save_artifact(data, updated_json, writer)
+            cache_store.flush()
+
+            limit = budget.exhausted()
+            if limit is not None and limit.startswith("run"):
+                # Resuming repeats this iteration, whose answers so far are in the prompt cache
+                print(f"LLM budget of the run exhausted: {limit} reached. Stopping.")
+                budget.stop(limit)
+                budget.save_checkpoint(os.path.join(output_dir, budget.CHECKPOINT_FILE), "abstraction",
+                                       checkpoint["data"], checkpoint["state"])
+                return data
+            if current_row_count == previous_row_count:
+                print("Row count stabilized. Exiting loop.")
+                break
+            previous_row_count = current_row_count
+            round_iterations += 1
+            if limit is not None:
+                print(f"LLM budget of the round exhausted: {limit} reached. Exiting loop.")
+                break
+            if max_iterations is not None and round_iterations >= max_iterations:
+                print(f"Reached {max_iterations} iterations. Exiting loop.")
+                break
+            iteration += 1
+
+        print(f"### Round {round_number} Completed Successfully ###")
+        round_iterations = 0
+        iteration = 0
+        round_number += 1
+        step = f"round{round_number}_iter{iteration + 1}"
+        output_json = os.path.join(output_dir, f"cpc_abstract_{step}.json")
+        excel_file = os.path.join(output_dir, f"cpc_abstract_{step}.xlsx")
+        updated_json = os.path.join(output_dir, f"cpc_abstract_{step}_updated.json")
+
+        data = run_stage(f"{step}/merge", timings, run_cached_stage, stage_cache_dir, "level_merge",
+                         level_merge, data, templates=prompts_lvl.PROMPT_TEMPLATES)
+
+        row_count = run_stage(f"{step}/export", timings, export_iteration, data, output_json, excel_file,
+                              save_intermediate, writer)
+        metrics.record_tree_size(step, data, row_count)
+        budget.record_step(step, row_count)
+
+        data = run_stage(f"{step}/thresholds", timings, run_cached_stage, stage_cache_dir, "final_thresholds",
+                         final_thresholds, data,
+                         params={"z_threshold": z_th})
+        if save_intermediate:
+            save_artifact(data, updated_json, writer)
+        cache_store.flush()
+
+    print("subjective ending condition is satisfied!")
+    return data
+
+
+def run_preparation(data, output_dir, from_stage="thresholds", initial_z_th=-1, save_intermediate=False,
+                    timings=None, stage_cache_dir=None, shard_pool=None):
+    """
+    Runs the stages before the abstraction rounds: thresholds, parent pointers and meta refinement.
+
+    Parameters:
+        data (dict): The input taxonomy, in the format expected by from_stage.
+        output_dir (str): The directory the artifacts are written to.
+        from_stage (str): The first stage to run, one of STAGES.
+        initial_z_th (float): The Z-score threshold used for the initial thresholds.
+        save_intermediate (bool): Whether the artifacts of the standalone scripts are written.
+        timings (list): Optional list collecting the per-stage timings.
+        stage_cache_dir (str): Optional artifact cache directory.
+        shard_pool (multiprocessing.Pool): Optional pool; if given, the meta refinement of each top-level
+            section is run by a worker process.
+
+    Returns:
+        dict: The meta-refined taxonomy with thresholds and parent codes.
+
+    Raises:
+        BudgetExhausted: If the LLM budget of the run is exhausted during the meta refinement; its input is
+            saved to checkpoint.json in output_dir first.
+    """
+    if timings is None:
+        timings = []
+
+    meta_refinement = meta_refinement_stage
+    if shard_pool is not None:
+        meta_refinement = functools.partial(sharding.meta_refinement_stage, pool=shard_pool)
+    first = STAGES.index(from_stage)
+
+    if first <= STAGES.index("thresholds"):
+        data = run_stage("thresholds", timings, run_cached_stage, stage_cache_dir, "thresholds",
+                         update_threshold.update_thresholds, data, params={"z_threshold": initial_z_th})
+        if save_intermediate:
+            save_json(data, os.path.join(output_dir, "label_count_updated.json"))
+
+    if first <= STAGES.index("parent_pointers"):
+        data = run_stage("parent_pointers", timings, run_cached_stage, stage_cache_dir, "parent_pointers",
+                         add_pointers_to_parents.assign_parent_codes, data)
+        if save_intermediate:
+            save_json(data, os.path.join(output_dir, "label_count_updated_parents.json"))
+
+    if first <= STAGES.index("meta_refinement"):
+        prompt_template = prompts_meta["decision_on_meta_characteristics"]
+        # Without an artifact that has to store them, the removed groups are written as they are removed
+        writer = open_removed_groups(output_dir) if stage_cache_dir is None else None
+        checkpoint_data = copy_tree(data) if budget.is_enabled() else None
+        try:
+            output = run_stage("meta_refinement", timings, run_cached_stage, stage_cache_dir, "meta_refinement",
+                               functools.partial(meta_refinement, removed_groups=writer), data,
+                               params={"prompt_template": prompt_template}, templates=prompts_meta,
+                               settings=decision_settings())
+        except budget.BudgetExhausted as error:
+            budget.stop(error.limit)
+            budget.save_checkpoint(os.path.join(output_dir, budget.CHECKPOINT_FILE), "meta_refinement",
+                                   checkpoint_data)
+            raise
+        finally:
+            if writer is not None:
+                writer.close()
+        data = output["data"]
+        metrics.record_tree_size("meta_refinement", data)
+        if writer is None:
+            save_removed_groups(output["removed_groups"], output_dir)
+        else:
+            print(f"Saved: {writer.json_path}")
+        if save_intermediate:
+            save_json(data, os.path.join(output_dir, "cpc_abstract_meta_refined_relavants.json"))
+
+    return data
+
+
+def run_pipeline(data, output_dir, from_stage="thresholds", initial_z_th=-1, z_th=-2,
+                 subjective_ending_condition=100, save_intermediate=False, timings=None, stage_cache_dir=None,
+                 max_iterations=None, shard_pool=None, start=None):
+    """
+    Chains threshold setting, parent pointers, meta refinement and the abstraction rounds on one tree.
+
+    Parameters:
+        data (dict): The input taxonomy, in the format expected by from_stage.
+        output_dir (str): The directory the artifacts are written to.
+        from_stage (str): The first stage to run, one of STAGES.
+        initial_z_th (float): The Z-score threshold used for the initial thresholds.
+        z_th (float): The Z-score threshold used by the abstraction rounds.
+        subjective_ending_condition (int): The row count under which no further round is started.
+        save_intermediate (bool): Whether the artifacts of the standalone scripts are written.
+        timings (list): Optional list collecting the per-stage timings.
+        stage_cache_dir (str): Optional artifact cache directory; stages whose input tree, parameters and
+            prompt templates are unchanged are loaded from it instead of being recomputed.
+        max_iterations (int): Optional maximum number of count-based iterations per round.
+        shard_pool (multiprocessing.Pool): Optional pool; if given, each top-level section is processed
+            by a worker process.
+        start (dict): Optional loop state of an abstraction checkpoint to resume from.
+
+    The abstracted taxonomy is saved as cpc_abstract_final.json, or as cpc_abstract_partial.json if the LLM
+    budget of the run stopped the rounds.
+
+    Returns:
+        dict: The abstracted taxonomy.
+    """
+    if timings is None:
+        timings = []
+
+    data = run_preparation(data, output_dir, from_stage=from_stage, initial_z_th=initial_z_th,
+                           save_intermediate=save_intermediate, timings=timings, stage_cache_dir=stage_cache_dir,
+                           shard_pool=shard_pool)
+    data = run_abstraction(data, output_dir, z_th=z_th, subjective_ending_condition=subjective_ending_condition,
+                           save_intermediate=save_intermediate, timings=timings, stage_cache_dir=stage_cache_dir,
+                           max_iterations=max_iterations, shard_pool=shard_pool, start=start)
+    save_json(data, os.path.join(output_dir, budget.PARTIAL_FILE if budget.is_stopped() else "cpc_abstract_final.json"))
+    return data
+
+
+def print_timing_report(timings):
+    """Prints the recorded steps with their wall time and share of the total."""
+    total = sum(entry["seconds"] for entry in timings) or 1e-12
+    width = max([len(entry["stage"]) for entry in timings] + [5])
+    print(f"\n{'stage'.ljust(width)}  {'seconds':>10}  {'share':>6}")
+    for entry in timings:
+        print(f"{entry['stage'].ljust(width)}  {entry['seconds']:>10.3f}  {entry['seconds'] / total:>6.1%}")
+    print(f"{'total'.ljust(width)}  {total:>10.3f}")
+
+
+def print_timing_comparison(timings, reference):
+    """
+    Prints the recorded steps next to the same steps of a reference run, e.g. a live run compared with a replay.
+
+    Parameters:
+        timings (list): The timings of this run.
+        reference (list): The timings of the reference run, as written by --timings-json.
+    """
+    reference_seconds = {}
+    for entry in reference:
+        reference_seconds[entry["stage"]] = reference_seconds.get(entry["stage"], 0) + entry["seconds"]
+    width = max([len(entry["stage"]) for entry in timings] + [5])
+    print(f"\n{'stage'.ljust(width)}  {'reference':>10}  {'this run':>10}  {'speedup':>8}")
+    for entry in timings:
+        before = reference_seconds.get(entry["stage"])
+        if before is None:
+            print(f"{entry['stage'].ljust(width)}  {'-':>10}  {entry['seconds']:>10.3f}  {'-':>8}")
+        else:
+            speedup = before / max(entry["seconds"], 1e-9)
+            print(f"{entry['stage'].ljust(width)}  {before:>10.3f}  {entry['seconds']:>10.3f}  {speedup:>7.1f}x")
+    total_before = sum(entry["seconds"] for entry in reference)
+    total = sum(entry["seconds"] for entry in timings)
+    print(f"{'total'.ljust(width)}  {total_before:>10.3f}  {total:>10.3f}  {total_before / max(total, 1e-9):>7.1f}x")
+
+
+def add_run_arguments(parser):
+    """
+    Add the run options shared by the pipeline entry points: replay and decision logs, timings and metrics, the
+    event log, the prompt caches, tiered and streamed decisions, the LLM budget and pipelined rounds.
+    """
+    parser.add_argument("--replay", action="store_true",
+                        help="Serve all LLM calls from the prompt caches and decision logs, without network.")
+    parser.add_argument("--decision-log", action="append", default=[],
+                        help="Decision log used in replay mode when a prompt is not cached. Can be repeated.")
+    parser.add_argument("--record-decisions", default=None,
+                        help="Append every LLM response of this run to the given decision log.")
+    parser.add_argument("--timings-json", default=None,
+                        help="Optional path the per-stage timing report is written to.")
+    parser.add_argument("--compare-timings", default=None,
+                        help="Timing report of a reference run (e.g. live mode) to compare this run with.")
+    parser.add_argument("--metrics", default=None,
+                        help="Record LLM latencies, cache hit rates, merges and removals per level and tree sizes, "
+                             "write them to the given .json or .csv file and print a summary at the end of the run.")
+    parser.add_argument("--event-log", default=None,
+                        help="Write merge, removal, decision and LLM call events to the given JSONL file instead of "
+                             "printing them; the console shows periodic progress summaries.")
+    parser.add_argument("--event-level", choices=list(events.LEVELS), default="info",
+                        help="Lowest level of the events written to --event-log.")
+    parser.add_argument("--event-sample-rate", type=float, default=1.0,
+                        help="Share of the debug and info events written to --event-log.")
+    parser.add_argument("--progress-interval", type=float, default=10.0,
+                        help="Seconds between the progress summaries printed with --event-log.")
+    parser.add_argument("--cache-max-entries", type=int, default=None,
+                        help="Keep at most this many entries per prompt cache file, evicting the least recently used.")
+    parser.add_argument("--cache-max-age-days", type=float, default=None,
+                        help="Evict prompt cache entries not used for this many days.")
+    parser.add_argument("--cache-root", default=cache_store.shared["root"],
+                        help="Host-wide directory of the prompt caches, shared by concurrent runs, which then never "
+                             "pay twice for the same prompt; defaults to $TAXOREFINE_CACHE_ROOT, else the working "
+                             "directory.")
+    parser.add_argument("--cache-memory-entries", type=int, default=cache_store.limits["memory_entries"],
+                        help="Number of prompt cache responses kept in memory for repeated lookups.")
+    parser.add_argument("--cache-flush-interval", type=float, default=cache_store.limits["flush_interval"],
+                        help="Seconds after which new prompt cache entries are written to disk.")
+    parser.add_argument("--cache-flush-entries", type=int, default=cache_store.limits["flush_entries"],
+                        help="Number of new prompt cache entries after which they are written to disk.")
+    parser.add_argument("--tiering", action="store_true",
+                        help="Answer the merge, removal and label decisions the local lexical scorer is confident "
+                             "about without the model, escalate the others, and report the escalation rate.")
+    tiering.add_threshold_arguments(parser)
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream the merge and removal decisions of the model and cancel each stream as soon as "
+                             "its decision is known.")
+    parser.add_argument("--max-calls", type=int, default=None,
+                        help="Stop the run with a checkpoint once this many LLM requests have been sent.")
+    parser.add_argument("--max-tokens", type=int, default=None,
+                        help="Stop the run with a checkpoint once this many LLM tokens have been spent.")
+    parser.add_argument("--max-round-calls", type=int, default=None,
+                        help="End an abstraction round once it has sent this many LLM requests.")
+    parser.add_argument("--max-round-tokens", type=int, default=None,
+                        help="End an abstraction round once it has spent this many LLM tokens.")
+    parser.add_argument("--pipeline-workers", type=int, default=None,
+                        help="Decide up to this many sibling groups of the count-based merge at the same time and "
+                             "write the iteration artifacts in the background; the results are unchanged.")
+
+
+def apply_run_arguments(args):
+    """Applies the run options of add_run_arguments as requested on the command line."""
+    cache_store.set_root(args.cache_root)
+    cache_store.limits.update(max_entries=args.cache_max_entries, max_age_days=args.cache_max_age_days,
+                              memory_entries=args.cache_memory_entries, flush_interval=args.cache_flush_interval,
+                              flush_entries=args.cache_flush_entries)
+    if args.metrics:
+        metrics.enable()
+    if args.event_log:
+        events.configure(args.event_log, level=args.event_level, sample_rate=args.event_sample_rate,
+                         progress_interval=args.progress_interval)
+    if args.tiering:
+        tiering.configure(merge_threshold=args.tier_merge_threshold, margin=args.tier_margin,
+                          keep_threshold=args.tier_keep_threshold, retain_threshold=args.tier_retain_threshold)
+    streaming.settings["enabled"] = args.stream
+    budget.configure(run_calls=args.max_calls, run_tokens=args.max_tokens, round_calls=args.max_round_calls,
+                     round_tokens=args.max_round_tokens)
+    pipelined.settings["workers"] = args.pipeline_workers
+    if args.replay:
+        replay.enable_replay(args.decision_log)
+    if args.record_decisions:
+        replay.start_recording(args.record_decisions)
+
+
+def run_reported(args, output_dir, func, *func_args, **kwargs):
+    """
+    Runs a pipeline entry point, then prints and saves its timing report and, if enabled, its metrics, the
+    report of the tiered decisions, tiering_report.json, and the spend of the LLM budget, budget_report.json in
+    the output directory.
+
+    In replay mode, missing prompts stop the run at the end of their stage; the missing keys are printed and
+    written to replay_missing_keys.json in the output directory. A run stopped by the LLM budget reports as usual, with a
+    non-zero exit status since its result is partial.
+
+    Returns:
+        int: The process exit status.
+    """
+    timings = []
+    try:
+        func(*func_args, timings=timings, **kwargs)
+    except replay.ReplayCacheMiss as error:
+        print(f"Replay failed: {error}")
+        save_json(error.missing, os.path.join(output_dir, "replay_missing_keys.json"))
+        return 1
+    except budget.BudgetExhausted as error:
+        print(f"Run stopped: {error}")
+    finally:
+        events.close()
+
+    print_timing_report(timings)
+    if args.timings_json:
+        save_json(timings, args.timings_json)
+    if args.compare_timings:
+        with open(args.compare_timings, 'r') as file:
+            print_timing_comparison(timings, json.load(file))
+    if args.metrics:
+        report = metrics.build_report(timings)
+        metrics.write_report(report, args.metrics)
+        print(f"Metrics saved: {args.metrics}")
+        metrics.print_summary(report)
+    if tiering.settings["enabled"]:
+        report = tiering.build_report()
+        save_json(report, os.path.join(output_dir, "tiering_report.json"))
+        tiering.print_report(report)
+    if budget.is_enabled():
+        report = budget.build_report()
+        save_json(report, os.path.join(output_dir, "budget_report.json"))
+        budget.print_report(report)
+    return 1 if budget.is_stopped() else 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run the taxonomy refinement pipeline in memory on a single tree.")
+    parser.add_argument("--input", default="data/cpc/label_count.json",
+                        help="Input taxonomy JSON, in the format expected by --from-stage.")
+    parser.add_argument("--output-dir", default="output/cpc/abstract_cpc",
+                        help="Directory the artifacts are written to.")
+    parser.add_argument("--from-stage", choices=STAGES, default="thresholds",
+                        help="First stage to run; earlier stages are assumed to be applied to --input.")
+    parser.add_argument("--initial-z-th", type=float, default=-1,
+                        help="Z-score threshold of the initial thresholds.")
+    parser.add_argument("--z-th", type=float, default=-2,
+                        help="Z-score threshold used by the abstraction rounds.")
+    parser.add_argument("--ending-condition", type=int, default=100,
+                        help="Row count under which no further round is started.")
+    parser.add_argument("--max-iterations", type=int, default=None,
+                        help="Maximum number of count-based iterations per round.")
+    parser.add_argument("--save-intermediate", action="store_true",
+                        help="Also write the artifacts of each stage and iteration.")
+    parser.add_argument("--stage-cache", default=STAGE_CACHE_DIR,
+                        help="Directory of the stage artifact cache used to skip unchanged stages on rerun.")
+    parser.add_argument("--no-stage-cache", action="store_true",
+                        help="Recompute every stage without reading or writing the stage artifact cache.")
+    parser.add_argument("--shards", type=int, default=None,
+                        help="Number of worker processes the top-level sections are distributed over.")
+    parser.add_argument("--resume", default=None,
+                        help="Checkpoint of a run stopped by the LLM budget to continue from, instead of --input. "
+                             "The spend recorded in it counts against --max-calls and --max-tokens.")
+    add_run_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.shards and any(limit is not None for limit in (args.max_calls, args.max_tokens, args.max_round_calls,
+                                                           args.max_round_tokens)):
+        parser.error("the LLM budget orders the decisions across the whole tree and cannot be used with --shards")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.makedirs(args.output_dir, exist_ok=True)
+    start = None
+    if args.resume:
+        with open(args.resume, 'r') as file:
+            checkpoint = json.load(file)
+        data = checkpoint["data"]
+        args.from_stage = checkpoint["stage"]
+        start = checkpoint["state"] or None
+        print(f"Resuming from {args.resume} at the {args.from_stage} stage.")
+    else:
+        with open(args.input, 'r') as file:
+            data = json.load(file)
+
+    apply_run_arguments(args)
+    if args.resume:
+        budget.resume(checkpoint.get("spent", {}))
+    shard_pool = sharding.create_pool(args.shards) if args.shards else None
+    try:
+        return run_reported(args, args.output_dir, run_pipeline, data, args.output_dir, from_stage=args.from_stage,
+                            initial_z_th=args.initial_z_th, z_th=args.z_th,
+                            subjective_ending_condition=args.ending_condition,
+                            save_intermediate=args.save_intermediate, max_iterations=args.max_iterations,
+                            stage_cache_dir=None if args.no_stage_cache else args.stage_cache,
+                            shard_pool=shard_pool, start=start)
+    finally:
+        if shard_pool is not None:
+            shard_pool.close()
+            shard_pool.join()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+from init_taxonomy.set_threshold import add_thresholds_level_sibling_based
+from init_taxonomy.refine_with_meta import refine_taxonomy_perspective
+from init_taxonomy.closest_sibling.merge_based_on_common_knowledge_and_size import gen_abstract as gen_abstract_cpc_cnt
+from init_taxonomy.closest_sibling.merge_small_leave_nodes import gen_abstract as gen_abstract_cpc_lvl
+from init_taxonomy.closest_sibling.merge_based_on_common_knowledge_and_size import prompts as prompts_cnt
+from init_taxonomy.closest_sibling.merge_small_leave_nodes import prompts as prompts_lvl
+from instrumentation import events
+from instrumentation import metrics
+from llm import prompt_cache as cache_store
+from llm import replay
+from llm import streaming
+from llm import tiering
+from taxonomy import merged_codes
+
+# Below the top level, merges and removals never cross sections (A-H, Y). Each section subtree is
+# therefore processed by a worker process, while the coordinator runs the top-level pass, reconciles
+# the level-based threshold statistics and reassembles the tree in the order the single-process
+# pipeline would have produced. Merged codes are rendered to their legacy keys before a subtree
+# crosses a process boundary.
+
+
+def _init_worker(metrics_enabled, event_settings, cache_limits, cache_root, tiering_settings, streaming_settings):
+    cache_store.limits.update(cache_limits)
+    cache_store.set_root(cache_root)
+    tiering.settings.update(tiering_settings)
+    streaming.settings.update(streaming_settings)
+    if metrics_enabled:
+        metrics.enable()
+    if event_settings:
+        events.configure(**event_settings)
+
+
+def create_pool(shards):
+    """
+    Create the worker pool used for the section subtrees. Workers record metrics and events if this
+    process does, and apply the same prompt cache root and bounds and the same tiered and streamed decisions.
+    """
+    from multiprocessing import Pool
+
+    return Pool(processes=shards, initializer=_init_worker,
+                initargs=(metrics.is_enabled(), events.settings(), dict(cache_store.limits),
+                          cache_store.shared["root"], dict(tiering.settings), dict(streaming.settings)))
+
+
+def section_tasks(data, *args):
+    """Build one task per top-level section, in tree order."""
+    return [(code, node) + args for code, node in data.items()]
+
+
+def worker_stats():
+    """
+    Return the LLM call counts, tiered decision counts, metrics and missing replay prompts a worker reports with
+    its result, once its events and its new and used prompt cache entries are written.
+    """
+    events.flush()
+    cache_store.flush()
+    return {"call_counts": cache_store.call_counts, "tiering": tiering.counts, "metrics": metrics.snapshot(),
+            "replay_missing": list(replay.state["missing"].values())}
+
+
+def reset_worker_stats():
+    """Drop the call counts, metrics and missing replay prompts left over from an earlier task of the worker."""
+    cache_store.call_counts.clear()
+    replay.state["missing"].clear()
+    tiering.counts.clear()
+    metrics.reset()
+
+
+def merge_call_counts(results):
+    """
+    Add the LLM call counts, tiered decision counts, metrics and missing replay prompts reported by the workers
+    to those of this process.
+    """
+    for result in results:
+        metrics.merge_snapshot(result[-1]["metrics"])
+        replay.add_missing(result[-1]["replay_missing"])
+        tiering.merge_counts(result[-1]["tiering"])
+        for function_name, counts in result[-1]["call_counts"].items():
+            for outcome, amount in counts.items():
+                cache_store.count_answer(function_name, outcome, amount)
+
+
+def reassemble_sections(data, results):
+    """
+    Replaces the top-level sections of data with the subtrees returned by the workers.
+
+    A section renamed by a merge with one of its children is appended to the top level by
+    merge_with_parent, so renamed sections follow the unchanged ones, in section order.
+
+    Parameters:
+        data (dict): The hierarchical JSON data.
+        results (list): (section code, {code: node}, ...) tuples in section order.
+
+    Returns:
+        dict: The same data object with the reassembled top level.
+    """
+    unchanged = {}
+    renamed = {}
+    for result in results:
+        section_code, shard = result[0], result[1]
+        for code, node in shard.items():
+            if code == section_code:
+                unchanged[code] = node
+            else:
+                renamed[code] = node
+    data.clear()
+    data.update(unchanged)
+    data.update(renamed)
+    return data
+
+
+def _count_merge_section(task):
+    code, node = task
+    reset_worker_stats()
+    shard = {code: node}
+    children = node.get("children", {})
+    if children:
+        prompt_template = prompts_cnt.PROMPT_TEMPLATES["merge_decision"]
+        gen_abstract_cpc_cnt.process_level(shard, children, parent_label=node.get("label"), is_top_level=False,
+                                           prompt_template=prompt_template, level=1)
+    return code, merged_codes.export_tree(shard), worker_stats()
+
+
+def _level_merge_section(task):
+    code, node = task
+    reset_worker_stats()
+    shard = {code: node}
+    children = node.get("children", {})
+    if children:
+        prompt_template = prompts_lvl.PROMPT_TEMPLATES["merge_decision"]
+        gen_abstract_cpc_lvl.process_level(shard, children, parent_label=node.get("label"), is_top_level=False,
+                                           parent_node=node, prompt_template=prompt_template, level=1)
+    gen_abstract_cpc_lvl.merge_single_child_nodes(shard, is_top_level=True)
+    return code, merged_codes.export_tree(shard), worker_stats()
+
+
+def _meta_refinement_section(task):
+    code, node, prompt_template = task
+    reset_worker_stats()
+    removed_groups = []
+    children = node.get("children", {})
+    if children:
+        refine_taxonomy_perspective.process_level(children, parent_label=node.get("label"), is_top_level=False,
+                                                  prompt_template=prompt_template, removed_groups=removed_groups, level=1)
+    return code, {code: node}, removed_groups, worker_stats()
+
+
+def _thresholds_section(task):
+    code, node, z_threshold = task
+    add_thresholds_level_sibling_based.add_children_sibling_thresholds(node, z_threshold)
+    level_counts = add_thresholds_level_sibling_based.collect_level_counts({code: node})
+    return code, {code: node}, level_counts
+
+
+def count_merge_stage(data, pool):
+    """Sharded equivalent of runner.count_merge_stage."""
+    prompt_template = prompts_cnt.PROMPT_TEMPLATES["merge_decision"]
+    gen_abstract_cpc_cnt.process_level(data, data, is_top_level=True, prompt_template=prompt_template,
+                                       recurse=False)
+    data = merged_codes.export_tree(data)
+    results = pool.map(_count_merge_section, section_tasks(data))
+    merge_call_counts(results)
+    return reassemble_sections(data, results)
+
+
+def level_merge_stage(data, pool):
+    """Sharded equivalent of runner.level_merge_stage."""
+    prompt_template = prompts_lvl.PROMPT_TEMPLATES["merge_decision"]
+    gen_abstract_cpc_lvl.process_level(data, data, is_top_level=True, prompt_template=prompt_template,
+                                       recurse=False)
+    data = merged_codes.export_tree(data)
+    results = pool.map(_level_merge_section, section_tasks(data))
+    merge_call_counts(results)
+    return reassemble_sections(data, results)
+
+
+def meta_refinement_stage(data, prompt_template, pool, removed_groups=None):
+    """Sharded equivalent of runner.meta_refinement_stage."""
+    removed_groups = refine_taxonomy_perspective.process_level(
+        data, is_top_level=True, prompt_template=prompt_template,
+        removed_groups=[] if removed_groups is None else removed_groups, recurse=False)
+    results = pool.map(_meta_refinement_section, section_tasks(data, prompt_template))
+    merge_call_counts(results)
+    for result in results:
+        removed_groups.extend(result[2])
+    return {"data": reassemble_sections(data, results), "removed_groups": removed_groups}
+
+
+def final_thresholds_stage(data, z_threshold, pool):
+    """
+    Sharded equivalent of add_thresholds_level_sibling_based.add_final_thresholds.
+
+    Sibling thresholds are computed by the workers. The level counts of all sections are
+    concatenated in section order, so the level thresholds match the single-process computation.
+    """
+    add_thresholds_level_sibling_based.add_root_sibling_thresholds(data, z_threshold)
+    results = pool.map(_thresholds_section, section_tasks(data, z_threshold))
+    reassemble_sections(data, results)
+
+    level_counts = {}
+    for result in results:
+        for level, counts in result[2].items():
+            level_counts.setdefault(level, []).extend(counts)
+    level_thresholds = add_thresholds_level_sibling_based.calculate_level_thresholds(level_counts, z_threshold)
+    add_thresholds_level_sibling_based.apply_level_thresholds(data, level_thresholds)
+    return add_thresholds_level_sibling_based.assign_maximum_threshold(data)
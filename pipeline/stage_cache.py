@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+
+from llm import replay
+
+# Bump when the logic of a stage changes so that older artifacts are no longer reused
+STAGE_CACHE_VERSION = 1
+
+# Default artifact cache directory
+STAGE_CACHE_DIR = "stage_cache"
+
+
+def stage_key(stage, data, params=None, templates=None, settings=None):
+    """
+    Computes the content hash identifying a stage run.
+
+    Parameters:
+        stage (str): The name of the stage, e.g. "thresholds" or "count_merge".
+        data (dict): The input tree of the stage. Key order is part of the hash, since it drives the merge order.
+        params (dict): The parameters the stage output depends on.
+        templates (dict): The prompt templates used by the stage; their text acts as the template version.
+        settings (dict): Settings the output depends on that are not parameters of the stage, e.g. the tiered
+            decisions. Left out of the key when empty, so that keys without settings are unchanged.
+
+    Returns:
+        str: A hex digest usable as the artifact file name.
+    """
+    header = {
+        "version": STAGE_CACHE_VERSION,
+        "stage": stage,
+        "params": params or {},
+        "templates": {
+            name: hashlib.sha256(template.encode("utf-8")).hexdigest()
+            for name, template in sorted((templates or {}).items())
+        },
+    }
+    if settings:
+        header["settings"] = settings
+    digest = hashlib.sha256()
+    digest.update(json.dumps(header, sort_keys=True).encode("utf-8"))
+    digest.update(json.dumps(data).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def get_artifact_file(cache_dir, stage, key):
+    """Generate an artifact file path based on the stage name and its key."""
+    return os.path.join(cache_dir, f"{stage}_{key}.json")
+
+
+def load_artifact(cache_dir, stage, key):
+    """
+    Loads a cached stage output.
+
+    Returns:
+        The cached output, or None if there is no usable artifact.
+    """
+    artifact_file = get_artifact_file(cache_dir, stage, key)
+    if not os.path.exists(artifact_file):
+        return None
+    try:
+        with open(artifact_file, "r") as file:
+            return json.load(file)["output"]
+    except (json.JSONDecodeError, KeyError):
+        print(f"Stage artifact {artifact_file} is corrupted. Ignoring it.")
+        return None
+
+
+def save_artifact(cache_dir, stage, key, output):
+    """Atomically writes a stage output to the artifact cache."""
+    os.makedirs(cache_dir, exist_ok=True)
+    artifact_file = get_artifact_file(cache_dir, stage, key)
+    temp_file = f"{artifact_file}.{os.getpid()}.tmp"
+    with open(temp_file, "w") as file:
+        json.dump({"stage": stage, "output": output}, file)
+    os.replace(temp_file, artifact_file)
+
+
+def run_cached_stage(cache_dir, stage, func, data, params=None, templates=None, settings=None):
+    """
+    Runs a stage unless an artifact for the same input tree, parameters and templates exists.
+
+    Parameters:
+        cache_dir (str): The artifact cache directory. If None, the stage always runs.
+        stage (str): The name of the stage.
+        func (callable): Called as func(data, **params); must return a JSON-serializable output.
+        data (dict): The input tree of the stage.
+        params (dict): Keyword arguments of func, also part of the key.
+        templates (dict): The prompt templates used by the stage.
+        settings (dict): Settings the output depends on that are not arguments of func, part of the key only.
+
+    Returns:
+        The output of func, either computed or loaded from the cache.
+    """
+    params = params or {}
+    if cache_dir is None:
+        return func(data, **params)
+
+    key = stage_key(stage, data, params=params, templates=templates, settings=settings)
+    output = load_artifact(cache_dir, stage, key)
+    if output is not None:
+        print(f"Stage cache hit for {stage}.")
+        return output
+
+    output = func(data, **params)
+    # An output computed without some replayed responses is not stored
+    replay.check_missing()
+    save_artifact(cache_dir, stage, key, output)
+    return output
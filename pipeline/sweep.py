@@ -0,0 +1,178 @@
+import argparse
+import contextlib
+import csv
+import itertools
+import json
+import os
+import time
+from multiprocessing import Pool
+
+from pipeline import runner
+from pipeline.stage_cache import STAGE_CACHE_DIR
+from llm import prompt_cache as cache_store
+from visualization import plot_abstract
+
+# Columns of the comparison table
+RESULT_COLUMNS = ["name", "z_th", "subjective_ending_condition", "max_iterations", "rows", "llm_calls",
+                  "cache_hits", "seconds"]
+
+
+def build_grid(z_ths, ending_conditions, max_iterations):
+    """
+    Builds the list of configurations of a sweep.
+
+    Parameters:
+        z_ths (list): The Z-score thresholds of the abstraction rounds.
+        ending_conditions (list): The subjective ending conditions.
+        max_iterations (list): The maximum numbers of iterations per round.
+
+    Returns:
+        list: One dictionary per combination of the given values.
+    """
+    grid = []
+    for z_th, ending_condition, max_iteration in itertools.product(z_ths, ending_conditions, max_iterations):
+        grid.append({
+            "name": f"z{z_th}_end{ending_condition}_max{max_iteration}",
+            "z_th": z_th,
+            "subjective_ending_condition": ending_condition,
+            "max_iterations": max_iteration,
+        })
+    return grid
+
+
+def run_configuration(config, data, output_dir, stage_cache_dir, save_intermediate):
+    """
+    Runs the abstraction rounds of one configuration. Executed in a worker process.
+
+    The console output of the run is written to run.log in the directory of the configuration.
+
+    Parameters:
+        config (dict): The configuration, as built by build_grid.
+        data (dict): The meta-refined taxonomy shared by all configurations.
+        output_dir (str): The sweep output directory.
+        stage_cache_dir (str): The artifact cache shared by all configurations.
+        save_intermediate (bool): Whether the per-iteration artifacts are written.
+
+    Returns:
+        dict: The configuration with its final row count, LLM calls, cache hits and wall time.
+    """
+    cache_store.call_counts.clear()
+    config_dir = os.path.join(output_dir, config["name"])
+    os.makedirs(config_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    with open(os.path.join(config_dir, "run.log"), "w") as log_file, contextlib.redirect_stdout(log_file):
+        final = runner.run_abstraction(data, config_dir, z_th=config["z_th"],
+                                       subjective_ending_condition=config["subjective_ending_condition"],
+                                       save_intermediate=save_intermediate, stage_cache_dir=stage_cache_dir,
+                                       max_iterations=config["max_iterations"])
+        runner.save_json(final, os.path.join(config_dir, "cpc_abstract_final.json"))
+    seconds = time.perf_counter() - start
+
+    result = dict(config)
+    result.update({
+        "rows": len(plot_abstract.process_hierarchy(final)),
+        "llm_calls": cache_store.total_api_calls(),
+        "cache_hits": sum(counts["cache_hits"] for counts in cache_store.call_counts.values()),
+        "seconds": round(seconds, 3),
+    })
+    return result
+
+
+def _run_configuration(args):
+    return run_configuration(*args)
+
+
+def run_sweep(data, grid, output_dir, workers=None, initial_z_th=-1, stage_cache_dir=STAGE_CACHE_DIR,
+              save_intermediate=False):
+    """
+    Runs a grid of configurations in parallel processes.
+
+    The stages every configuration has in common (thresholds, parent pointers and meta refinement) run
+    once before the workers start. Workers share the prompt caches and the stage artifact cache, so
+    identical early rounds are computed by whichever configuration reaches them first and reused by
+    the others.
+
+    Parameters:
+        data (dict): The input taxonomy (data/cpc/label_count.json format).
+        grid (list): The configurations, as built by build_grid.
+        output_dir (str): The sweep output directory; each configuration writes to its own subdirectory.
+        workers (int): The number of worker processes. Defaults to the number of CPUs.
+        initial_z_th (float): The Z-score threshold used for the initial thresholds.
+        stage_cache_dir (str): The artifact cache shared by all configurations.
+        save_intermediate (bool): Whether the per-iteration artifacts are written.
+
+    Returns:
+        list: One result per configuration, in grid order.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    cache_store.call_counts.clear()
+    start = time.perf_counter()
+    prepared = runner.run_preparation(data, output_dir, initial_z_th=initial_z_th, stage_cache_dir=stage_cache_dir)
+    print(f"Shared stages completed in {time.perf_counter() - start:.1f}s "
+          f"with {cache_store.total_api_calls()} LLM calls.")
+
+    tasks = [(config, prepared, output_dir, stage_cache_dir, save_intermediate) for config in grid]
+    results = []
+    with Pool(processes=workers) as pool:
+        for result in pool.imap_unordered(_run_configuration, tasks):
+            print(f"Finished {result['name']}: {result['rows']} rows, {result['llm_calls']} LLM calls, "
+                  f"{result['seconds']}s")
+            results.append(result)
+
+    order = [config["name"] for config in grid]
+    return sorted(results, key=lambda result: order.index(result["name"]))
+
+
+def print_results(results):
+    """Prints the comparison table of a sweep."""
+    widths = {column: max([len(column)] + [len(str(result[column])) for result in results])
+              for column in RESULT_COLUMNS}
+    print("  ".join(column.rjust(widths[column]) for column in RESULT_COLUMNS))
+    for result in results:
+        print("  ".join(str(result[column]).rjust(widths[column]) for column in RESULT_COLUMNS))
+
+
+def save_results(results, output_dir):
+    """Saves the comparison table of a sweep as CSV and JSON."""
+    with open(os.path.join(output_dir, "sweep_results.csv"), "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=RESULT_COLUMNS)
+        writer.writeheader()
+        writer.writerows(results)
+    with open(os.path.join(output_dir, "sweep_results.json"), "w") as file:
+        json.dump(results, file, indent=4)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run a grid of pipeline configurations in parallel processes.")
+    parser.add_argument("--input", default="data/cpc/label_count.json", help="Input taxonomy JSON.")
+    parser.add_argument("--output-dir", default="output/cpc/sweep", help="Sweep output directory.")
+    parser.add_argument("--z-th", type=float, nargs="+", default=[-2],
+                        help="Z-score thresholds of the abstraction rounds.")
+    parser.add_argument("--ending-condition", type=int, nargs="+", default=[100],
+                        help="Subjective ending conditions.")
+    parser.add_argument("--max-iterations", type=int, nargs="+", default=[100],
+                        help="Maximum numbers of count-based iterations per round.")
+    parser.add_argument("--initial-z-th", type=float, default=-1,
+                        help="Z-score threshold of the initial thresholds, shared by all configurations.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes.")
+    parser.add_argument("--stage-cache", default=STAGE_CACHE_DIR, help="Shared stage artifact cache directory.")
+    parser.add_argument("--save-intermediate", action="store_true",
+                        help="Also write the artifacts of each iteration of each configuration.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with open(args.input, "r") as file:
+        data = json.load(file)
+
+    grid = build_grid(args.z_th, args.ending_condition, args.max_iterations)
+    results = run_sweep(data, grid, args.output_dir, workers=args.workers, initial_z_th=args.initial_z_th,
+                        stage_cache_dir=args.stage_cache, save_intermediate=args.save_intermediate)
+    print_results(results)
+    save_results(results, args.output_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+# Fields of a taxonomy node, in the order the pipeline writes them
+FIELDS = ("label", "children", "count", "threshold", "parent_code", "key")
+
+# One shared tuple per distinct field order, so that a node only stores a reference to it
+_field_orders = {}
+
+
+def _field_order(names):
+    names = tuple(names)
+    return _field_orders.setdefault(names, names)
+
+
+class TaxonomyNode:
+    """
+    Compact taxonomy node: the fields of the JSON node dict stored in slots.
+
+    The parent code of every child shares the string object of its parent's code. The node also
+    supports the read and write access of a dict (node["label"], node.get("count", 0), "children" in
+    node), so the traversal helpers of the pipeline run on compact trees unchanged; attribute access
+    (node.count) is faster. The order of the fields is kept, so to_dict reproduces the JSON exactly.
+    """
+
+    __slots__ = ("label", "children", "count", "threshold", "parent_code", "key", "fields", "extra")
+
+    def __init__(self, fields=(), extra=None):
+        self.fields = _field_order(fields)
+        self.extra = extra
+        self.label = None
+        self.children = None
+        self.count = None
+        self.threshold = None
+        self.parent_code = None
+        self.key = None
+
+    def __contains__(self, name):
+        return name in self.fields
+
+    def __getitem__(self, name):
+        if name not in self.fields:
+            raise KeyError(name)
+        if name in FIELDS:
+            return getattr(self, name)
+        return self.extra[name]
+
+    def __setitem__(self, name, value):
+        if name not in self.fields:
+            self.fields = _field_order(self.fields + (name,))
+        if name in FIELDS:
+            setattr(self, name, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[name] = value
+
+    def get(self, name, default=None):
+        if name not in self.fields:
+            return default
+        if name in FIELDS:
+            return getattr(self, name)
+        return self.extra[name]
+
+    def keys(self):
+        return self.fields
+
+    def items(self):
+        return [(name, self[name]) for name in self.fields]
+
+
+def node_from_dict(node, code=None):
+    """Converts a node dict and its descendants to TaxonomyNode objects."""
+    compact = TaxonomyNode(node.keys())
+    for name, value in node.items():
+        if name == "children":
+            value = from_dict(value, parent_code=code)
+        compact[name] = value
+    return compact
+
+
+def from_dict(data, parent_code=None):
+    """
+    Converts a taxonomy in the JSON format to compact nodes.
+
+    Parameters:
+        data (dict): The hierarchical JSON data.
+        parent_code (str): The code of the node data belongs to, if any.
+
+    Returns:
+        dict: The taxonomy as {code: TaxonomyNode}, in the same order.
+    """
+    nodes = {}
+    for code, node in data.items():
+        compact = nodes[code] = node_from_dict(node, code)
+        if parent_code is not None and compact.parent_code == parent_code:
+            compact.parent_code = parent_code
+    return nodes
+
+
+def node_to_dict(node):
+    """Converts a TaxonomyNode and its descendants back to a node dict."""
+    exported = {}
+    for name in node.fields:
+        value = node[name]
+        exported[name] = to_dict(value) if name == "children" else value
+    return exported
+
+
+def to_dict(nodes):
+    """
+    Converts compact nodes back to the JSON format.
+
+    Returns:
+        dict: The hierarchical JSON data; json.dump writes it exactly as the tree that was imported.
+    """
+    return {code: node_to_dict(node) for code, node in nodes.items()}
+
+
+def iter_nodes(data):
+    """Yields (code, node) for every node, in depth-first order. Works on dict and compact trees."""
+    stack = list(reversed(list(data.items())))
+    while stack:
+        code, node = stack.pop()
+        yield code, node
+        children = node.get("children")
+        if children:
+            stack.extend(reversed(list(children.items())))
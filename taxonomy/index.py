@@ -0,0 +1,70 @@
+class TaxonomyIndex:
+    """
+    Parent index of a taxonomy: for every code, its node, the dict holding it and the code of its parent.
+
+    Looking up the parent of a node therefore takes constant time instead of a search from the root, and
+    removals walk up the ancestors only. Nodes removed through the index are dropped from it together with
+    their descendants, so the index holds no reference to removed subtrees.
+    """
+
+    def __init__(self, data):
+        """
+        Parameters:
+            data (dict): The hierarchical JSON data, or the children of a node.
+        """
+        self.data = data
+        # {code: (node, dict holding the node, parent code or None)}
+        self.entries = {}
+        stack = [(data, None)]
+        while stack:
+            nodes, parent_code = stack.pop()
+            for code, node in nodes.items():
+                self.entries.setdefault(code, (node, nodes, parent_code))
+                children = node.get("children")
+                if children:
+                    stack.append((children, code))
+
+    def __contains__(self, code):
+        return code in self.entries
+
+    def node(self, code):
+        """Return the node of a code, or None if it is not in the index."""
+        entry = self.entries.get(code)
+        return entry[0] if entry else None
+
+    def siblings(self, code):
+        """Return the dict holding the node of a code, i.e. its parent's children or the indexed data."""
+        return self.entries[code][1]
+
+    def parent_code(self, code):
+        """Return the code of the parent of a node, or None for the nodes of the indexed data."""
+        return self.entries[code][2]
+
+    def add(self, code, node, siblings, parent_code=None):
+        """Indexes a node added to siblings, e.g. a merged node, and points its children to it."""
+        self.entries[code] = (node, siblings, parent_code)
+        children = node.get("children")
+        if children:
+            for child_code, child in children.items():
+                self.entries[child_code] = (child, children, code)
+
+    def discard(self, code):
+        """Drops a node, e.g. one that was merged, from the index only; its descendants stay indexed."""
+        self.entries.pop(code, None)
+
+    def remove(self, code):
+        """
+        Removes a node and its descendants from the tree and from the index.
+
+        Returns:
+            str: The code of the parent of the removed node, or None if it was one of the indexed data.
+        """
+        node, siblings, parent_code = self.entries.pop(code)
+        del siblings[code]
+        stack = list(node.get("children", {}).items())
+        while stack:
+            child_code, child = stack.pop()
+            if self.entries.get(child_code, (None,))[0] is child:
+                del self.entries[child_code]
+            stack.extend(child.get("children", {}).items())
+        return parent_code
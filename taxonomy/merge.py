@@ -0,0 +1,51 @@
+from taxonomy.index import TaxonomyIndex
+
+
+def find_siblings(data, code, index=None):
+    """
+    Returns the dict holding the node of a code, at any depth: data for a top-level node, otherwise the
+    children of its parent.
+
+    Parameters:
+        data (dict): The hierarchical JSON data.
+        code (str): The code of the node.
+        index (TaxonomyIndex): Optional. The parent index of data; built for this lookup if not given.
+
+    Returns:
+        dict: The siblings of the node including the node, or None if there is no node with this code.
+    """
+    if code in data:
+        return data
+    if index is None:
+        index = TaxonomyIndex(data)
+    return index.siblings(code) if code in index else None
+
+
+def merge_siblings(siblings, codes, merged_key, combine, index=None):
+    """
+    Replaces sibling nodes by one merged node, added at the end of their dict.
+
+    Parameters:
+        siblings (dict): The dict holding the nodes, see find_siblings.
+        codes (list): The codes of the nodes to merge, the candidate first.
+        merged_key (str): The key of the merged node.
+        combine (callable): Called with the list of the nodes of codes; returns the merged node.
+        index (TaxonomyIndex): Optional. A parent index of the tree, updated by the merge.
+
+    Returns:
+        dict: The merged node, or None if one of the codes is not in siblings.
+    """
+    nodes = [siblings.get(code) for code in codes]
+    if any(node is None for node in nodes):
+        return None
+
+    merged_node = combine(nodes)
+    siblings[merged_key] = merged_node
+    parent_code = index.parent_code(codes[0]) if index is not None and codes[0] in index else None
+    for code in codes:
+        siblings.pop(code, None)
+        if index is not None:
+            index.discard(code)
+    if index is not None:
+        index.add(merged_key, merged_node, siblings, parent_code)
+    return merged_node
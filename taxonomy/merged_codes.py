@@ -0,0 +1,83 @@
+import itertools
+
+# Prefix of the compact codes of merged nodes; original codes never contain it
+MERGED_PREFIX = "#"
+
+# Member table of the merged nodes of this process: {merged code: member codes}
+members = {}
+# Legacy keys already rendered, by merged code
+_rendered = {}
+_next_id = itertools.count(1)
+
+
+def merge_code(codes):
+    """
+    Returns a new compact code for a node merged from the given codes and records its members.
+
+    The legacy key, e.g. "A01_A02" for the count-based merge of A01 and A02, is only built by render,
+    so merging already merged nodes does not grow the keys, and rewriting the parent_code of the
+    children copies a short string.
+
+    Parameters:
+        codes (list): The codes of the merged nodes, in the order of the legacy key.
+
+    Returns:
+        str: The code of the merged node.
+    """
+    code = f"{MERGED_PREFIX}{next(_next_id)}"
+    members[code] = tuple(codes)
+    return code
+
+
+def render(code):
+    """Return the legacy key of a code; codes of unmerged nodes are returned unchanged."""
+    if code not in members:
+        return code
+    rendered = _rendered.get(code)
+    if rendered is None:
+        rendered = _rendered[code] = "_".join(render(member) for member in members[code])
+    return rendered
+
+
+def original_codes(code):
+    """Return the codes of the unmerged nodes a node was merged from."""
+    if code not in members:
+        return (code,)
+    return tuple(original for member in members[code] for original in original_codes(member))
+
+
+def render_node(node):
+    """Return a copy of a node with the merged codes of its children, parent_code and key rendered."""
+    rendered = dict(node)
+    if "children" in node:
+        rendered["children"] = render_tree(node["children"])
+    if "parent_code" in node:
+        rendered["parent_code"] = render(node["parent_code"])
+    if "key" in node:
+        rendered["key"] = render(node["key"])
+    return rendered
+
+
+def render_tree(data):
+    """
+    Returns the taxonomy with every merged code rendered as its legacy key.
+
+    Returns:
+        dict: A rendered copy of data, or data itself if no merged code exists.
+    """
+    if not members:
+        return data
+    return {render(code): render_node(node) for code, node in data.items()}
+
+
+def export_tree(data):
+    """
+    Renders the merged codes of a taxonomy at the end of a merge stage and clears the member table.
+
+    Everything outside of a merge stage (stage artifacts, exported files, worker processes) therefore
+    sees the same keys as before the compact codes were introduced.
+    """
+    rendered = render_tree(data)
+    members.clear()
+    _rendered.clear()
+    return rendered
@@ -0,0 +1,118 @@
+# Fields of a sibling group shown in the prompts
+FIELDS = ("keys", "codes", "labels")
+
+
+class SiblingContext:
+    """
+    The codes and labels of one sibling group as the prompts show them, collected once per group.
+
+    collect_labels used to rebuild the lists of all siblings but the candidate for every decision. The
+    context keeps the text of each field and the position of every sibling in it, so the prompt text of
+    "all siblings except X" is two slices of that text. Merges and removals update the context through
+    add and remove, and only the text of the next prompt is built again.
+    """
+
+    def __init__(self, nodes, render=None):
+        """
+        Parameters:
+            nodes (dict): The sibling group, e.g. the children of one node.
+            render (callable): Returns the code shown in the prompts for a key, e.g. merged_codes.render.
+        """
+        self.nodes = nodes
+        self.render = render
+        # {key: (code, label)}, in the order of nodes
+        self.entries = {}
+        # {field: (text, {key: (start, end)})}, built when a prompt needs it
+        self.texts = {}
+        # {code: key}
+        self.keys_by_code = {}
+        for key in nodes:
+            self.add(key)
+
+    def add(self, key):
+        """Adds a sibling, e.g. the node a merge created, at the end of the group."""
+        code = self.render(key) if self.render else key
+        self.entries[key] = (code, self.nodes[key].get("label", "No Label"))
+        self.keys_by_code[code] = key
+        self.texts.clear()
+
+    def remove(self, key):
+        """Removes a merged or removed sibling from the group."""
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.keys_by_code.pop(entry[0], None)
+            self.texts.clear()
+
+    def values(self, field):
+        """Yields a field of all siblings, in the order of the group."""
+        if field == "keys":
+            return iter(self.entries)
+        index = FIELDS.index(field) - 1
+        return (entry[index] for entry in self.entries.values())
+
+    def text(self, field):
+        """Return the text of a field for all siblings without brackets, and the span of every sibling in it."""
+        if field not in self.texts:
+            spans = {}
+            pieces = []
+            position = 0
+            for key, value in zip(self.entries, self.values(field)):
+                piece = repr(value)
+                spans[key] = (position, position + len(piece))
+                position += len(piece) + 2
+                pieces.append(piece)
+            self.texts[field] = (", ".join(pieces), spans)
+        return self.texts[field]
+
+    def text_except(self, field, excluded):
+        """Return str() of the list of a field for all siblings but excluded, e.g. "['A01', 'A21']"."""
+        text, spans = self.text(field)
+        if excluded not in spans:
+            return f"[{text}]"
+        start, end = spans[excluded]
+        if start == 0:
+            return f"[{text[end + 2:]}]"
+        return f"[{text[:start - 2]}{text[end:]}]"
+
+    def excluding(self, field, excluded):
+        """Return the view of a field for all siblings but excluded."""
+        return SiblingView(self, field, excluded)
+
+
+class SiblingView:
+    """
+    A field of all siblings but one, e.g. the sibling labels of a candidate.
+
+    It iterates and counts like the list collect_labels built before, and str() gives the same text, so
+    prompt_template.format writes identical prompts and the prompt cache keys are kept.
+    """
+
+    __slots__ = ("context", "field", "excluded")
+
+    def __init__(self, context, field, excluded):
+        self.context = context
+        self.field = field
+        self.excluded = excluded
+
+    def __len__(self):
+        return len(self.context.entries) - (self.excluded in self.context.entries)
+
+    def __iter__(self):
+        for key, value in zip(self.context.entries, self.context.values(self.field)):
+            if key != self.excluded:
+                yield value
+
+    def __str__(self):
+        return self.context.text_except(self.field, self.excluded)
+
+    __repr__ = __str__
+
+    def key_of(self, code):
+        """
+        Return the key of the sibling shown as code, or None if it is not one of the siblings, e.g. a list or
+        a dict the model gave as the code.
+        """
+        if not isinstance(code, str):
+            return None
+        key = self.context.keys_by_code.get(code)
+        return None if key is None or key == self.excluded else key
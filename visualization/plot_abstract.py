@@ -1,7 +1,4 @@
 import json
-import pandas as pd
-from openpyxl import load_workbook
-from openpyxl.styles import PatternFill
 
 
 
@@ -89,6 +86,8 @@ def process_hierarchy(data, label0="", lbl0_code="", lbl0_count=0):
     return rows
 
 if __name__ == "__main__":
+    import pandas as pd
+
 # Load your JSON data
     with open('output/cpc/abstract_cpc13/cpc_abstract_round11_iter1_refined.json', 'r') as f:
         data = json.load(f)